@@ -1,38 +1,122 @@
+import asyncio
+import functools
 import uuid
-from collections.abc import Generator
-from typing import Annotated
+from collections.abc import Callable, Coroutine, Generator
+from typing import Annotated, Any
 
-import jwt
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request, Response
+from fastapi.routing import APIRoute
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
 from sqlmodel import Session
 
-from app import security
+from app import security, shards
+from app.api.profiling import current_profiler
+from app.cancellation import STATEMENT_TIMEOUT_KEY
 from app.config import settings
-from app.db import engine
+from app.db import get_engine, get_user_engine
 from app.models import TokenPayload, User
+from app.tracing import span, traced
 
 oauth2_scheme = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/signin/access-token"
 )
 
 
-def get_db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
+def _request_shard(request: Request) -> int:
+    # The shard of the user signed in, the token itself is checked later
+    if shards.count() == 1:
+        return 0
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return 0
+    try:
+        return shards.for_user(uuid.UUID(security.decode_access_token(token)["sub"]))
+    except (InvalidTokenError, KeyError, ValueError):
+        return 0
+
+
+def get_db(request: Request) -> Generator[Session, None, None]:
+    """A session on the shard of the user making the request."""
+    with Session(get_engine(_request_shard(request))) as session:
         yield session
 
 
 SessionDep = Annotated[Session, Depends(get_db)]
+
+
+def get_user_db(user_id: uuid.UUID) -> Generator[Session, None, None]:
+    """A session on the shard of the user in the path."""
+    with Session(get_user_engine(user_id)) as session:
+        yield session
+
+
+UserSessionDep = Annotated[Session, Depends(get_user_db)]
+
+
+def _release_sessions(values: dict[str, Any]) -> None:
+    for value in values.values():
+        if isinstance(value, Session):
+            value.close()
+
+
+class AppRoute(APIRoute):
+    """Route class of the API's routers, wrapping every endpoint call.
+
+    The endpoint runs in a tracing span, and under the request's profiler
+    if one was requested.
+    Its sessions are released as soon as it returns: they check out a
+    connection at their first query, but ``get_db`` only closes them after
+    the response has been validated and serialized, so the connection
+    would sit idle in the meantime. Closing the session returns it to the
+    pool early, while the loaded objects keep their state for serialization.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        call = self.dependant.call
+        assert call is not None
+        if asyncio.iscoroutinefunction(call):
+
+            @functools.wraps(call)
+            async def endpoint(**values: Any) -> Any:
+                try:
+                    with span("endpoint", route=self.name):
+                        if (profiler := current_profiler.get()) is not None:
+                            return await profiler.run_async(call, values)
+                        return await call(**values)
+                finally:
+                    _release_sessions(values)
+
+        else:
+
+            @functools.wraps(call)
+            def endpoint(**values: Any) -> Any:
+                try:
+                    with span("endpoint", route=self.name):
+                        if (profiler := current_profiler.get()) is not None:
+                            return profiler.run(call, values)
+                        return call(**values)
+                finally:
+                    _release_sessions(values)
+
+        self.dependant.call = endpoint
+        return super().get_route_handler()
+
+
+def apply_statement_timeout(request: Request, session: SessionDep) -> None:
+    route = request.scope.get("route")
+    timeout = settings.ROUTE_STATEMENT_TIMEOUTS_MS.get(getattr(route, "name", ""))
+    if timeout:
+        session.info[STATEMENT_TIMEOUT_KEY] = timeout
+
+
 TokenDep = Annotated[str, Depends(oauth2_scheme)]
 
 
+@traced
 def get_current_user(session: SessionDep, token: TokenDep) -> User:
     try:
-        payload = jwt.decode(
-            token, key=settings.SECRET_KEY, algorithms=[security.ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
+        token_data = TokenPayload(**security.decode_access_token(token))
     except InvalidTokenError:
         raise HTTPException(status_code=403, detail="Could not validate credentials")
     user_id = uuid.UUID(token_data.sub)
@@ -46,6 +130,7 @@ def get_current_user(session: SessionDep, token: TokenDep) -> User:
 
 CurrentUser = Annotated[User, Depends(get_current_user)]
 
+
 def get_current_active_superuser(current_user: CurrentUser) -> User:
     if not current_user.is_superuser:
         raise HTTPException(
@@ -53,4 +138,5 @@ def get_current_active_superuser(current_user: CurrentUser) -> User:
         )
     return current_user
 
+
 CurrentSuperuser = Annotated[User, Depends(get_current_active_superuser)]
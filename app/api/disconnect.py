@@ -0,0 +1,75 @@
+import asyncio
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.exc import OperationalError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.cancellation import (
+    QueryCanceller,
+    current_canceller,
+    is_query_canceled,
+    query_stats,
+)
+
+
+class CancelOnDisconnectMiddleware:
+    """Cancel a request's running queries when its client disconnects.
+
+    Messages from the client are read by a separate task, so a disconnect
+    is noticed while the endpoint is still busy in the database.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        canceller = QueryCanceller()
+        scope.setdefault("state", {})["canceller"] = canceller
+        messages: asyncio.Queue[Message] = asyncio.Queue()
+        response_complete = False
+
+        async def listen() -> None:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect" and not response_complete:
+                    # Sending the cancel request blocks on a socket round trip
+                    await asyncio.to_thread(canceller.cancel)
+                await messages.put(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                response_complete = True
+            await send(message)
+
+        token = current_canceller.set(canceller)
+        listener = asyncio.create_task(listen())
+        try:
+            await self.app(scope, messages.get, send_wrapper)
+        finally:
+            listener.cancel()
+            current_canceller.reset(token)
+
+
+async def query_canceled_handler(request: Request, exc: Exception) -> Response:
+    """Answer queries cancelled by a disconnect or a statement timeout."""
+    if not isinstance(exc, OperationalError) or not is_query_canceled(exc):
+        raise exc
+    canceller: QueryCanceller | None = getattr(request.state, "canceller", None)
+    cancelled = canceller is not None and canceller.cancelled
+    query_stats.record(cancelled=cancelled)
+    if cancelled:
+        # Nobody is listening, but the server still has to answer something
+        return Response(status_code=499)
+    return JSONResponse(
+        status_code=503, content={"detail": "The request took too long"}
+    )
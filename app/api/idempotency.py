@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import hmac
+import itertools
+import time
+from collections.abc import Iterator
+from datetime import timedelta
+from types import TracebackType
+from typing import Annotated
+
+from fastapi import Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlmodel import Session
+
+from app import dialects
+from app.config import settings
+from app.cruds import idempotency_crud
+from app.db import get_engine
+from app.models import IdempotencyKey
+
+IdempotencyKeyHeader = Annotated[str | None, Header(min_length=1, max_length=255)]
+
+_claims = itertools.count(1)
+
+# Bounds of the backoff between two looks at a key still in flight
+POLL_MIN_DELAY = 0.01
+POLL_MAX_DELAY = 0.25
+
+
+def _poll_delays() -> Iterator[float]:
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    delay = POLL_MIN_DELAY
+    while (remaining := deadline - time.monotonic()) > 0:
+        yield min(delay, remaining)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+
+class IdempotencyGuard:
+    """Make a create request safe to retry with an ``Idempotency-Key`` header.
+
+    The first request with a key runs normally and its response is stored
+    by ``store``; replays get the stored response in ``replay`` without the
+    handler touching any other table. A concurrent duplicate polls the key
+    until the first request stores its response, then replays it. It holds
+    no connection between polls, so duplicates can't starve the first
+    request of one, and it gets a 409 after ``IDEMPOTENCY_WAIT_SECONDS``.
+    The key is released if the handler raises, and a waiting duplicate
+    claims it in turn.
+
+    SQLite has a single writer, so an uncommitted claim would block the
+    handler's own writes. There the claim is committed at once.
+    """
+
+    def __init__(self, key: str | None, *, scope: str, request: BaseModel) -> None:
+        self.replay: JSONResponse | None = None
+        self._session: Session | None = None
+        self._key_hash: bytes | None = None
+        self._stored = False
+        if key is not None:
+            self._key_hash = hashlib.sha256(f"{scope}:{key}".encode()).digest()
+        # Keyed, as the request may hold a password: a plain digest stored
+        # for the whole TTL would let it be guessed offline
+        self._request_hash = hmac.digest(
+            settings.SECRET_KEY.encode(), request.model_dump_json().encode(), "sha256"
+        )
+
+    def _attempt(self) -> bool:
+        """Claim the key or load its response, ``False`` while it's in flight."""
+        assert self._key_hash is not None
+        ttl = timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS)
+        session = Session(get_engine())
+        # Keep the claim uncommitted until the response is stored, so that
+        # it is released if the handler fails
+        if idempotency_crud.claim(
+            session=session,
+            key_hash=self._key_hash,
+            request_hash=self._request_hash,
+            ttl=ttl,
+        ):
+            if dialects.is_sqlite(session):
+                session.commit()
+            self._session = session
+            return True
+
+        record = session.get(IdempotencyKey, self._key_hash)
+        session.close()
+        if record is None or record.response is None or record.status_code is None:
+            # The claim isn't committed, or has no response yet. Rarely, it
+            # expired and was purged between the two statements.
+            return False
+        if record.request_hash != self._request_hash:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used with a different request",
+            )
+        self.replay = JSONResponse(
+            content=record.response,
+            status_code=record.status_code,
+            headers={"Idempotent-Replayed": "true"},
+        )
+        return True
+
+    def _in_progress(self) -> HTTPException:
+        return HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is in progress",
+        )
+
+    def __enter__(self) -> "IdempotencyGuard":
+        if self._key_hash is None:
+            return self
+        for delay in _poll_delays():
+            if self._attempt():
+                return self
+            time.sleep(delay)
+        if self._attempt():
+            return self
+        raise self._in_progress()
+
+    async def __aenter__(self) -> "IdempotencyGuard":
+        if self._key_hash is None:
+            return self
+        # Waits on the event loop, rather than in a threadpool worker
+        for delay in _poll_delays():
+            if await run_in_threadpool(self._attempt):
+                return self
+            await asyncio.sleep(delay)
+        if await run_in_threadpool(self._attempt):
+            return self
+        raise self._in_progress()
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await run_in_threadpool(self.__exit__, exc_type, exc, traceback)
+
+    def store(self, response: BaseModel, status_code: int = 200) -> None:
+        if self._session is None or self._key_hash is None:
+            return
+        idempotency_crud.store(
+            session=self._session,
+            key_hash=self._key_hash,
+            status_code=status_code,
+            response=response.model_dump(mode="json"),
+        )
+        self._stored = True
+        if next(_claims) % settings.IDEMPOTENCY_KEY_PURGE_INTERVAL == 0:
+            idempotency_crud.purge_expired(
+                session=self._session,
+                ttl=timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS),
+            )
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._session is not None:
+            if (
+                not self._stored
+                and self._key_hash is not None
+                and dialects.is_sqlite(self._session)
+            ):
+                self._session.rollback()
+                idempotency_crud.release(session=self._session, key_hash=self._key_hash)
+            # Rolls back an unstored claim, releasing the key
+            self._session.close()
+            self._session = None
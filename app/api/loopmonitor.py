@@ -0,0 +1,157 @@
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config import settings
+from app.models import LagBucket, LoopBlock, LoopStats
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1_000)
+
+
+class LoopMonitor:
+    """Measure event loop lag and catch what blocks the loop.
+
+    A task on the loop sleeps for a fixed interval and records how late it
+    wakes up. A watchdog thread notices when that task stops waking up and
+    samples the loop thread's stack while it is still blocked, along with
+    the route of the request whose task is running. The block is recorded
+    once the loop is free again and its duration is known.
+    """
+
+    def __init__(self) -> None:
+        self.running = False
+        self.samples = 0
+        self.max_lag = 0.0
+        self.histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.blocked: deque[LoopBlock] = deque(maxlen=settings.LOOP_MONITOR_MAX_EVENTS)
+        self._pending: tuple[str | None, str] | None = None
+        self._requests: weakref.WeakKeyDictionary[asyncio.Task[None], Scope] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._heartbeat = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._task: asyncio.Task[None] | None = None
+        self._watchdog: threading.Thread | None = None
+
+    def start(self) -> None:
+        """Monitor the running loop, from a coroutine running on it."""
+        loop = asyncio.get_running_loop()
+        self.running = True
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = loop.create_task(self._measure())
+        self._watchdog = threading.Thread(
+            target=self._watch,
+            args=(loop, threading.get_ident()),
+            name="loop-monitor",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self.running = False
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        if self._watchdog is not None:
+            self._watchdog.join()
+
+    def track(self, scope: Scope) -> None:
+        """Attribute the current task's time on the loop to a request."""
+        if self.running and (task := asyncio.current_task()) is not None:
+            self._requests[task] = scope
+
+    async def _measure(self) -> None:
+        interval = settings.LOOP_MONITOR_INTERVAL_MS / 1000
+        threshold = settings.LOOP_BLOCK_THRESHOLD_MS / 1000
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(now - start - interval, 0.0)
+            with self._lock:
+                self.samples += 1
+                self.max_lag = max(self.max_lag, lag)
+                self.histogram[bisect.bisect_left(LAG_BUCKETS_MS, lag * 1000)] += 1
+                pending, self._pending = self._pending, None
+            if lag >= threshold:
+                route, stack = pending or (None, None)
+                self._record(route, stack, lag)
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, thread_id: int) -> None:
+        interval = settings.LOOP_MONITOR_INTERVAL_MS / 1000
+        threshold = settings.LOOP_BLOCK_THRESHOLD_MS / 1000
+        while not self._stopped.wait(interval):
+            if time.monotonic() - self._heartbeat < threshold or self._pending:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            route = None
+            if (task := asyncio.current_task(loop)) is not None:
+                if (scope := self._requests.get(task)) is not None:
+                    endpoint = scope.get("route")
+                    route = getattr(endpoint, "name", None) or scope["path"]
+            with self._lock:
+                self._pending = (route, stack)
+
+    def _record(self, route: str | None, stack: str | None, lag: float) -> None:
+        block = LoopBlock(
+            route=route,
+            started_at=datetime.now() - timedelta(seconds=lag),
+            duration_ms=lag * 1000,
+            stack=stack,
+        )
+        with self._lock:
+            self.blocked.append(block)
+        logger.warning(
+            "Event loop blocked for %.0f ms by %s\n%s",
+            block.duration_ms,
+            route or "a callback",
+            stack or "",
+        )
+
+    def stats(self) -> LoopStats:
+        with self._lock:
+            bounds: list[float | None] = [*LAG_BUCKETS_MS, None]
+            return LoopStats(
+                running=self.running,
+                samples=self.samples,
+                max_lag_ms=self.max_lag * 1000,
+                lag_histogram=[
+                    LagBucket(le_ms=bound, count=count)
+                    for bound, count in zip(bounds, self.histogram, strict=True)
+                ],
+                blocked=list(self.blocked),
+            )
+
+
+loop_monitor = LoopMonitor()
+
+
+class LoopMonitorMiddleware:
+    """Let the loop monitor tell which request's handler blocked the loop."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            loop_monitor.track(scope)
+        await self.app(scope, receive, send)
@@ -1,8 +1,14 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from app.api.routes import expenses, login, users
+from app.api.deps import apply_statement_timeout
+from app.api.ratelimit import rate_limit
+from app.api.routes import expenses, login, users, utils
 
-api_router = APIRouter()
+# Rate limiting comes first, so rejected requests never touch the database
+api_router = APIRouter(
+    dependencies=[Depends(rate_limit), Depends(apply_statement_timeout)]
+)
 api_router.include_router(login.router)
 api_router.include_router(expenses.router)
 api_router.include_router(users.router)
+api_router.include_router(utils.router)
@@ -0,0 +1,308 @@
+import asyncio
+import contextlib
+import io
+import json
+import marshal
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+import zipfile
+from collections import defaultdict
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any
+from urllib.parse import parse_qs
+
+from fastapi.responses import JSONResponse
+from jwt.exceptions import InvalidTokenError
+from sqlmodel import Session
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import security
+from app.config import settings
+from app.db import get_user_engine
+from app.models import User
+
+# (filename, first line, function name), as pstats keys functions
+Function = tuple[str, int, str]
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY = "profile"
+# ASGI header names are lowercased bytes
+_PROFILE_HEADER_RAW = PROFILE_HEADER.lower().encode()
+_PROFILE_QUERY_RAW = PROFILE_QUERY.encode()
+
+# tracemalloc and the sampler see the whole process, so requests are
+# profiled one at a time
+_profiling = threading.Lock()
+
+
+class RequestProfiler:
+    """Sample the stack of the thread running an endpoint.
+
+    Samples are taken from another thread, so the endpoint runs unmodified
+    between them, and only frames below the endpoint call are kept. An
+    async endpoint shares its thread with the other tasks on the loop, so
+    their work shows up when it runs while the endpoint is on the stack.
+    Allocations are traced for the duration of the call.
+    """
+
+    def __init__(self) -> None:
+        self.ran = False
+        self.samples: list[tuple[tuple[Function, ...], float]] = []
+        self.allocations = ""
+        self.duration = 0.0
+
+    def run(self, call: Callable[..., Any], values: dict[str, Any]) -> Any:
+        with self._capture(sys._getframe()):
+            return call(**values)
+
+    async def run_async(
+        self, call: Callable[..., Awaitable[Any]], values: dict[str, Any]
+    ) -> Any:
+        with self._capture(sys._getframe()):
+            return await call(**values)
+
+    @contextmanager
+    def _capture(self, root: FrameType) -> Iterator[None]:
+        self.ran = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), root, stop),
+            name="request-profiler",
+            daemon=True,
+        )
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            self.duration = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self.allocations = _allocation_summary(before, after, peak)
+
+    def _sample(self, thread_id: int, root: FrameType, stop: threading.Event) -> None:
+        interval = settings.PROFILE_SAMPLE_INTERVAL_MS / 1000
+        last = time.perf_counter()
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            now = time.perf_counter()
+            stack: list[Function] = []
+            while frame is not None and frame is not root:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            # The root is missing while an async endpoint is suspended, and
+            # the capture's own setup and teardown run below it
+            if frame is root and stack and stack[-1][0] != contextlib.__file__:
+                self.samples.append((tuple(reversed(stack)), now - last))
+            last = now
+
+    def speedscope(self, name: str) -> bytes:
+        """Export the samples in speedscope's sampled profile format."""
+        frames: dict[Function, int] = {}
+        samples = []
+        for stack, _ in self.samples:
+            samples.append([frames.setdefault(f, len(frames)) for f in stack])
+        weights = [weight for _, weight in self.samples]
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": settings.PROJECT_NAME,
+            "shared": {
+                "frames": [
+                    {"name": function, "file": filename, "line": line}
+                    for filename, line, function in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+        return json.dumps(profile).encode()
+
+    def pstats(self) -> bytes:
+        """Export the samples as a file ``pstats.Stats`` can load.
+
+        Call counts are sample counts, and times are the time between
+        samples spent in a function (``tottime``) or below it (``cumtime``).
+        """
+        sampled: dict[Function, list[float]] = defaultdict(lambda: [0, 0, 0.0, 0.0])
+        callers: dict[Function, dict[Function, list[float]]] = defaultdict(
+            lambda: defaultdict(lambda: [0, 0, 0.0, 0.0])
+        )
+        for stack, weight in self.samples:
+            sampled[stack[-1]][2] += weight
+            # Count recursive functions once per sample
+            for function in set(stack):
+                stats = sampled[function]
+                stats[0] += 1
+                stats[1] += 1
+                stats[3] += weight
+            for caller, callee in set(zip(stack, stack[1:], strict=False)):
+                edge = callers[callee][caller]
+                edge[0] += 1
+                edge[1] += 1
+                edge[2] += weight if callee == stack[-1] else 0.0
+                edge[3] += weight
+        return marshal.dumps(
+            {
+                function: (
+                    *stats,
+                    {caller: tuple(edge) for caller, edge in callers[function].items()},
+                )
+                for function, stats in sampled.items()
+            }
+        )
+
+    def artifact(self, name: str, status_code: int) -> bytes:
+        summary = (
+            f"{name}: {self.duration * 1000:.1f} ms, status {status_code}, "
+            f"{len(self.samples)} samples every "
+            f"{settings.PROFILE_SAMPLE_INTERVAL_MS} ms\n\n{self.allocations}"
+        )
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("profile.pstats", self.pstats())
+            archive.writestr("profile.speedscope.json", self.speedscope(name))
+            archive.writestr("summary.txt", summary)
+        return buffer.getvalue()
+
+
+def _allocation_summary(
+    before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int
+) -> str:
+    lines = [f"Peak traced memory: {peak / 1024:.1f} KiB", "Allocations still held:"]
+    for stat in after.compare_to(before, "lineno")[: settings.PROFILE_TOP_ALLOCATIONS]:
+        if stat.size_diff > 0:
+            lines.append(f"  {stat}")
+    return "\n".join(lines) + "\n"
+
+
+current_profiler: ContextVar[RequestProfiler | None] = ContextVar(
+    "current_profiler", default=None
+)
+
+
+def profile_requested(scope: Scope) -> bool:
+    # Runs on every request, so nothing is decoded or parsed unless the raw
+    # headers or query string may hold the trigger
+    if any(name == _PROFILE_HEADER_RAW for name, _ in scope["headers"]):
+        return True
+    if _PROFILE_QUERY_RAW not in scope["query_string"]:
+        return False
+    query = parse_qs(scope["query_string"].decode(), keep_blank_values=True)
+    return PROFILE_QUERY in query
+
+
+def _is_superuser(authorization: str) -> bool:
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    try:
+        user_id = uuid.UUID(security.decode_access_token(token)["sub"])
+    except (InvalidTokenError, KeyError, ValueError):
+        return False
+    with Session(get_user_engine(user_id)) as session:
+        user = session.get(User, user_id)
+    return user is not None and user.is_active and user.is_superuser
+
+
+class ProfileMiddleware:
+    """Profile a superuser's request on demand.
+
+    A request with an ``X-Profile`` header or a ``profile`` query parameter
+    gets a zip of the endpoint's sampled CPU profile, in pstats and
+    speedscope formats, and a summary of its allocations instead of its
+    response. Other requests pass straight through.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        authorization = Headers(scope=scope).get("Authorization", "")
+        if not await asyncio.to_thread(_is_superuser, authorization):
+            response = JSONResponse(
+                status_code=403,
+                content={"detail": "The user doesn't have enough privileges"},
+            )
+            await response(scope, receive, send)
+            return
+        if not _profiling.acquire(blocking=False):
+            response = JSONResponse(
+                status_code=409,
+                content={"detail": "Another request is being profiled"},
+            )
+            await response(scope, receive, send)
+            return
+
+        messages: list[Message] = []
+
+        async def buffer(message: Message) -> None:
+            messages.append(message)
+
+        profiler = RequestProfiler()
+        token = current_profiler.set(profiler)
+        try:
+            await self.app(scope, receive, buffer)
+        finally:
+            current_profiler.reset(token)
+            _profiling.release()
+
+        if not profiler.ran:
+            # Rejected before reaching the endpoint, send the response as is
+            for message in messages:
+                await send(message)
+            return
+
+        route = scope.get("route")
+        name = getattr(route, "name", None) or scope["path"]
+        status_code = next(
+            m["status"] for m in messages if m["type"] == "http.response.start"
+        )
+        content = profiler.artifact(name, status_code)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/zip"),
+                    (b"content-length", str(len(content)).encode()),
+                    (
+                        b"content-disposition",
+                        f'attachment; filename="profile-{name}.zip"'.encode(),
+                    ),
+                    (b"x-profiled-status", str(status_code).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
@@ -0,0 +1,182 @@
+import importlib
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Protocol
+
+from fastapi import HTTPException, Request
+from jwt.exceptions import InvalidTokenError
+from sqlmodel import Session
+
+from app import security
+from app.config import settings
+from app.cruds import ratelimit_crud
+from app.db import get_engine
+from app.models import RateLimitStats
+
+GLOBAL_KEY = "global"
+
+
+class RateLimitBackend(Protocol):
+    """Storage for token buckets.
+
+    Buckets must be shared by every process serving requests for the
+    limits to hold across a multi-worker deployment.
+    """
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Take ``cost`` tokens, or return the seconds to wait for them."""
+        ...
+
+    def size(self) -> int: ...
+
+
+class MemoryBackend:
+    """In-process buckets, evicting the least recently used past ``max_keys``.
+
+    An evicted bucket starts full if its key comes back, so ``max_keys``
+    should comfortably exceed the number of clients active at once.
+    """
+
+    def __init__(self, max_keys: int = settings.RATE_LIMIT_MAX_KEYS) -> None:
+        self.max_keys = max_keys
+        self.evictions = 0
+        # Tokens left and when they were counted, by key
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return wait
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+class DatabaseBackend:
+    """Buckets in the database, shared by every worker.
+
+    Each request costs a round trip and a commit on its own connection.
+    Buckets idle long enough to be full again are purged periodically.
+    """
+
+    def __init__(self) -> None:
+        self._takes = itertools.count(1)
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        with Session(get_engine()) as session:
+            wait = ratelimit_crud.take(
+                session=session, key=key, cost=cost, rate=rate, burst=burst
+            )
+            if next(self._takes) % settings.RATE_LIMIT_PURGE_INTERVAL == 0:
+                ratelimit_crud.purge_idle(
+                    session=session, before=datetime.now() - _refill_time()
+                )
+        return wait
+
+    def size(self) -> int:
+        with Session(get_engine()) as session:
+            return ratelimit_crud.count(session=session)
+
+
+def _refill_time() -> timedelta:
+    seconds = settings.RATE_LIMIT_BURST / settings.RATE_LIMIT_PER_SECOND
+    if settings.RATE_LIMIT_GLOBAL_PER_SECOND:
+        seconds = max(
+            seconds,
+            settings.RATE_LIMIT_GLOBAL_BURST / settings.RATE_LIMIT_GLOBAL_PER_SECOND,
+        )
+    return timedelta(seconds=seconds)
+
+
+class RateLimiter:
+    """Limit each client, and optionally all clients together.
+
+    A request is charged to its client's bucket first, so a client over
+    its limit never spends the shared global tokens.
+    """
+
+    def __init__(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+        self.allowed = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def check(self, client_key: str, cost: float) -> float:
+        """Charge a request, returning 0 or the seconds before it may retry."""
+        wait = self.backend.take(
+            client_key,
+            min(cost, settings.RATE_LIMIT_BURST),
+            settings.RATE_LIMIT_PER_SECOND,
+            settings.RATE_LIMIT_BURST,
+        )
+        if not wait and settings.RATE_LIMIT_GLOBAL_PER_SECOND:
+            wait = self.backend.take(
+                GLOBAL_KEY,
+                min(cost, settings.RATE_LIMIT_GLOBAL_BURST),
+                settings.RATE_LIMIT_GLOBAL_PER_SECOND,
+                settings.RATE_LIMIT_GLOBAL_BURST,
+            )
+        with self._lock:
+            if wait:
+                self.limited += 1
+            else:
+                self.allowed += 1
+        return wait
+
+    def stats(self) -> RateLimitStats:
+        return RateLimitStats(
+            allowed=self.allowed, limited=self.limited, keys=self.backend.size()
+        )
+
+
+def load_backend(path: str) -> RateLimitBackend:
+    module_name, _, class_name = path.rpartition(".")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    backend: RateLimitBackend = backend_class()
+    return backend
+
+
+rate_limiter = RateLimiter(load_backend(settings.RATE_LIMIT_BACKEND))
+
+
+def _client_key(request: Request) -> str:
+    # Only the signature is checked, the user is loaded later if at all
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            return f"user:{security.decode_access_token(token)['sub']}"
+        except (InvalidTokenError, KeyError):
+            pass
+    host = request.client.host if request.client else "unknown"
+    return f"ip:{host}"
+
+
+def rate_limit(request: Request) -> None:
+    """Reject the request with 429 if its client is over its rate limit."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return
+    route = request.scope.get("route")
+    cost = settings.ROUTE_RATE_LIMIT_COSTS.get(getattr(route, "name", ""), 1)
+    wait = rate_limiter.check(_client_key(request), cost)
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
@@ -1,23 +1,114 @@
+import asyncio
+import base64
+import functools
+import heapq
+import itertools
+import json
 import uuid
 from datetime import datetime, timedelta
+from operator import itemgetter
 from typing import Annotated, Any
 
-from fastapi import APIRouter, HTTPException, Query
-from sqlmodel import col, func, select
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
 
-from app.api.deps import CurrentUser, SessionDep
+from app import shards
+from app.api.deps import AppRoute, CurrentUser, SessionDep
+from app.api.idempotency import IdempotencyGuard, IdempotencyKeyHeader
+from app.cache import response_cache
+from app.config import settings
 from app.cruds import expense_crud
+from app.db import fan_out
+from app.enums import LookupStatus
+from app.ingest import expense_batcher
 from app.models import (
     Expense,
+    ExpenseBatchGet,
+    ExpenseChanges,
     ExpenseCreate,
     ExpenseFilter,
+    ExpenseLookup,
+    ExpenseLookups,
     ExpensePublic,
     ExpensesPublic,
+    ExpenseTombstone,
     ExpenseUpdate,
     Message,
 )
+from app.models.expenses import ExpenseFields, partial_expense_models
+from app.singleflight import expense_flights
 
-router = APIRouter(prefix="/expenses", tags=["expenses"])
+router = APIRouter(prefix="/expenses", tags=["expenses"], route_class=AppRoute)
+
+_change_requests = itertools.count(1)
+
+
+def _encode_change_token(
+    since: datetime, cursor_id: uuid.UUID | None = None, started: datetime | None = None
+) -> str:
+    payload = {
+        "t": since.isoformat(),
+        "i": str(cursor_id) if cursor_id else None,
+        "s": started.isoformat() if started else None,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def _decode_change_token(
+    token: str,
+) -> tuple[datetime, uuid.UUID | None, datetime | None]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token))
+        return (
+            datetime.fromisoformat(payload["t"]),
+            uuid.UUID(payload["i"]) if payload["i"] else None,
+            datetime.fromisoformat(payload["s"]) if payload["s"] else None,
+        )
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid change token")
+
+
+def _read_page_from_shards(queries: ExpenseFilter) -> bytes:
+    pages = fan_out(
+        functools.partial(
+            expense_crud.get_multi_sorted, filters=queries, fields=queries.fields
+        )
+    )
+    pairs, count = shards.merge_pages(
+        pages,
+        key=itemgetter(0),
+        skip=queries.skip,
+        limit=queries.limit,
+        reverse=queries.sort_order == "desc",
+    )
+    page_model: type[BaseModel] = ExpensesPublic
+    if queries.fields:
+        _, page_model = partial_expense_models(tuple(queries.fields))
+    page = page_model.model_validate(
+        {"data": [row for _, row in pairs], "count": count}
+    )
+    return page.model_dump_json().encode()
+
+
+def _exist_on_any_shard(expense_ids: list[uuid.UUID]) -> set[uuid.UUID]:
+    """Return which of the ids missing from the user's shard exist elsewhere.
+
+    A user's own expenses all live on their shard, so these belong to
+    other users.
+    """
+    if shards.count() == 1 or not expense_ids:
+        return set()
+    found = fan_out(
+        functools.partial(expense_crud.get_existing_ids, expense_ids=expense_ids)
+    )
+    return set().union(*found)
+
+
+def _missing_expense_error(expense_id: uuid.UUID) -> HTTPException:
+    if _exist_on_any_shard([expense_id]):
+        return HTTPException(status_code=403, detail="Not enough permissions")
+    return HTTPException(status_code=404, detail="Expense not found")
 
 
 @router.get("/", response_model=ExpensesPublic)
@@ -26,63 +117,215 @@ def read_expenses(
     current_user: CurrentUser,
     queries: Annotated[ExpenseFilter, Query()],
 ) -> Any:
-    if current_user.is_superuser:
-        statement = select(Expense)
-    else:
-        statement = select(Expense).where(Expense.owner_id == current_user.id)
-
-    statement = statement.where(col(Expense.category).in_(queries.categories))
-    if queries.period and queries.n_periods:
-        date_threshold = datetime.now() - timedelta(
-            days=queries.n_periods * queries.period.get_days()
-        )
-        statement = statement.where(Expense.created_at >= date_threshold)
-    elif queries.start_date and queries.end_date:
+    if queries.start_date and queries.end_date:
         if queries.start_date > queries.end_date:
             raise HTTPException(
                 status_code=400, detail="Start date must be before end date"
             )
-        statement = statement.where(
-            col(Expense.created_at).between(queries.start_date, queries.end_date)
+    if queries.min_amount is not None and queries.max_amount is not None:
+        if queries.min_amount > queries.max_amount:
+            raise HTTPException(
+                status_code=400,
+                detail="Minimum amount must not exceed maximum amount",
+            )
+    if queries.order_by == "relevance" and not queries.q:
+        raise HTTPException(
+            status_code=400, detail="Sorting by relevance requires a search query"
         )
 
-    # Get total count before pagination
-    count_statement = statement.with_only_columns(
-        func.count(), maintain_column_froms=True
-    )
-    count = session.scalar(count_statement)
+    owner_id = None if current_user.is_superuser else current_user.id
+    cache_key = response_cache.key(owner_id, queries)
+    if cache_key and (cached := response_cache.get(cache_key)):
+        return Response(content=cached, media_type="application/json")
 
-    # Apply sorting
-    sort_column = col(getattr(Expense, queries.order_by))
-    if queries.sort_order == "desc":
-        statement = statement.order_by(sort_column.desc())
+    def read_page() -> bytes:
+        if owner_id is None and shards.count() > 1:
+            return _read_page_from_shards(queries)
+        if queries.fields:
+            rows, count = expense_crud.get_multi_fields(
+                session=session,
+                filters=queries,
+                fields=queries.fields,
+                owner_id=owner_id,
+            )
+            # The rows are loaded, don't hold the connection while serializing
+            session.close()
+            _, page_model = partial_expense_models(tuple(queries.fields))
+            page = page_model.model_validate({"data": rows, "count": count})
+            return page.model_dump_json().encode()
+        expenses, count = expense_crud.get_multi(
+            session=session, filters=queries, owner_id=owner_id
+        )
+        session.close()
+        return ExpensesPublic(data=expenses, count=count).model_dump_json().encode()
+
+    if settings.SINGLEFLIGHT_ENABLED:
+        # Keyed by write version, so reads after a write never join older reads
+        flight_key = cache_key or response_cache.versioned_key(owner_id, queries)
+        content = expense_flights.do(flight_key, read_page)
     else:
-        statement = statement.order_by(sort_column.asc())
+        content = read_page()
+    if cache_key:
+        response_cache.set(cache_key, content)
+    return Response(content=content, media_type="application/json")
 
-    # Apply pagination
-    statement = statement.offset(queries.skip).limit(queries.limit)
 
-    expenses = session.exec(statement).all()
-    return ExpensesPublic(data=expenses, count=count)
+@router.get("/changes", response_model=ExpenseChanges)
+def read_expense_changes(
+    session: SessionDep,
+    current_user: CurrentUser,
+    since: str | None = None,
+    limit: Annotated[int, Query(gt=0, le=settings.EXPENSE_CHANGES_MAX_PAGE_SIZE)] = 100,
+) -> Any:
+    """Return the expenses changed and deleted since a change token.
+
+    Without ``since`` the feed starts from the beginning. Follow
+    ``next_token`` while ``has_more`` is set, then keep the last token for
+    the next sync. Changes may be sent more than once and must be applied
+    idempotently.
+    """
+    now = datetime.now()
+    retention = timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS)
+    watermark: datetime | None = None
+    cursor_id = None
+    started = now
+    if since:
+        watermark, cursor_id, run_started = _decode_change_token(since)
+        if cursor_id is not None and run_started is not None:
+            started = run_started
+        # Older deletions may have been purged, the client must resync
+        if (run_started or watermark) < now - retention:
+            raise HTTPException(
+                status_code=410, detail="Change token expired, resync all expenses"
+            )
+
+    owner_id = None if current_user.is_superuser else current_user.id
+    if owner_id is None and shards.count() > 1:
+        results = fan_out(
+            functools.partial(
+                expense_crud.get_changes,
+                since=watermark,
+                cursor_id=cursor_id,
+                limit=limit,
+            )
+        )
+        merged = heapq.merge(
+            *(changes for changes, _ in results), key=expense_crud.change_key
+        )
+        changes = list(itertools.islice(merged, limit + 1))
+        has_more = len(changes) > limit or any(more for _, more in results)
+        changes = changes[:limit]
+    else:
+        changes, has_more = expense_crud.get_changes(
+            session=session,
+            since=watermark,
+            cursor_id=cursor_id,
+            limit=limit,
+            owner_id=owner_id,
+        )
+    if has_more:
+        changed_at, last_id = expense_crud.change_key(changes[-1])
+        next_token = _encode_change_token(changed_at, last_id, started)
+    else:
+        overlap = timedelta(seconds=settings.CHANGE_FEED_OVERLAP_SECONDS)
+        next_token = _encode_change_token(started - overlap)
+    expenses = [change for change in changes if isinstance(change, Expense)]
+    deleted = [change.id for change in changes if isinstance(change, ExpenseTombstone)]
+
+    if next(_change_requests) % settings.CHANGE_FEED_PURGE_INTERVAL == 0:
+        if shards.count() > 1:
+            fan_out(
+                functools.partial(expense_crud.purge_tombstones, before=now - retention)
+            )
+        else:
+            expense_crud.purge_tombstones(session=session, before=now - retention)
+    return ExpenseChanges(
+        data=expenses, deleted=deleted, next_token=next_token, has_more=has_more
+    )
 
 
 @router.post("/", response_model=ExpensePublic)
-def create_expense(
-    session: SessionDep, current_user: CurrentUser, expense_in: ExpenseCreate
+async def create_expense(
+    session: SessionDep,
+    current_user: CurrentUser,
+    expense_in: ExpenseCreate,
+    idempotency_key: IdempotencyKeyHeader = None,
+) -> Any:
+    async with IdempotencyGuard(
+        idempotency_key, scope=f"expenses:{current_user.id}", request=expense_in
+    ) as guard:
+        if guard.replay:
+            return guard.replay
+        if settings.EXPENSE_BATCHING_ENABLED:
+            # Wait for the batch on the event loop, holding neither a worker
+            # thread nor a connection, so batches can outgrow the threadpool
+            await run_in_threadpool(session.close)
+            expense = await asyncio.wrap_future(
+                expense_batcher.enqueue(expense_in, owner_id=current_user.id)
+            )
+        else:
+            expense = await run_in_threadpool(
+                expense_crud.create,
+                session=session,
+                expense_in=expense_in,
+                owner_id=current_user.id,
+            )
+        await run_in_threadpool(guard.store, ExpensePublic.model_validate(expense))
+        return expense
+
+
+@router.post("/batch-get", response_model=ExpenseLookups)
+def read_expenses_batch(
+    session: SessionDep, current_user: CurrentUser, batch_in: ExpenseBatchGet
 ) -> Any:
-    expense = expense_crud.create(
-        session=session, expense_in=expense_in, owner_id=current_user.id
+    expenses = expense_crud.get_batch(
+        session=session, expense_ids=batch_in.ids, owner_id=current_user.id
     )
-    return expense
+    elsewhere = _exist_on_any_shard(
+        [expense_id for expense_id in batch_in.ids if expense_id not in expenses]
+    )
+    lookups = []
+    for expense_id in batch_in.ids:
+        if expense_id in elsewhere:
+            lookups.append(ExpenseLookup(id=expense_id, status=LookupStatus.FORBIDDEN))
+        elif expense_id not in expenses:
+            lookups.append(ExpenseLookup(id=expense_id, status=LookupStatus.MISSING))
+        elif (expense := expenses[expense_id]) is None:
+            lookups.append(ExpenseLookup(id=expense_id, status=LookupStatus.FORBIDDEN))
+        else:
+            lookups.append(
+                ExpenseLookup(
+                    id=expense_id,
+                    status=LookupStatus.FOUND,
+                    expense=ExpensePublic.model_validate(expense),
+                )
+            )
+    return ExpenseLookups(data=lookups)
 
 
 @router.get("/{expense_id}", response_model=ExpensePublic)
 def read_expense(
-    session: SessionDep, current_user: CurrentUser, expense_id: uuid.UUID
+    session: SessionDep,
+    current_user: CurrentUser,
+    expense_id: uuid.UUID,
+    fields: Annotated[ExpenseFields, Query()] = None,
 ) -> Any:
+    if fields:
+        found = expense_crud.get_fields(
+            session=session, expense_id=expense_id, fields=fields
+        )
+        if not found:
+            raise _missing_expense_error(expense_id)
+        owner_id, values = found
+        if owner_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not enough permissions")
+        expense_model, _ = partial_expense_models(tuple(fields))
+        content = expense_model.model_validate(values).model_dump_json()
+        return Response(content=content, media_type="application/json")
+
     expense = session.get(Expense, expense_id)
     if not expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
+        raise _missing_expense_error(expense_id)
     if expense.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     return expense
@@ -95,14 +338,16 @@ def update_expense(
     expense_id: uuid.UUID,
     expense_in: ExpenseUpdate,
 ) -> Any:
-    expense = session.get(Expense, expense_id)
+    found, expense = expense_crud.update(
+        session=session,
+        expense_id=expense_id,
+        owner_id=current_user.id,
+        expense_in=expense_in,
+    )
+    if not found:
+        raise _missing_expense_error(expense_id)
     if not expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    if expense.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    expense = expense_crud.update(
-        session=session, db_expense=expense, expense_in=expense_in
-    )
     return expense
 
 
@@ -110,10 +355,11 @@ def update_expense(
 def delete_expense(
     session: SessionDep, current_user: CurrentUser, expense_id: uuid.UUID
 ) -> Message:
-    expense = session.get(Expense, expense_id)
-    if not expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    if expense.owner_id != current_user.id:
+    found, deleted = expense_crud.delete(
+        session=session, expense_id=expense_id, owner_id=current_user.id
+    )
+    if not found:
+        raise _missing_expense_error(expense_id)
+    if not deleted:
         raise HTTPException(status_code=403, detail="Not enough permissions")
-    expense_crud.delete(session=session, expense_in=expense)
     return Message(message="Expense deleted successfully")
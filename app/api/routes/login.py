@@ -4,33 +4,39 @@ from typing import Annotated, Any
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 
-from app.api.deps import SessionDep
+from app.api.deps import AppRoute
+from app.api.idempotency import IdempotencyGuard, IdempotencyKeyHeader
 from app.config import settings
-from app.cruds import user_crud
+from app.cruds import account_crud
 from app.models import Token, UserCreate, UserPublic, UserRegister
 from app.security import create_access_token
 
-router = APIRouter(tags=["login"])
+router = APIRouter(tags=["login"], route_class=AppRoute)
 
 
 @router.post("/signup", response_model=UserPublic)
-def register(session: SessionDep, user_in: UserRegister) -> Any:
-    user = user_crud.get_by_email(session=session, email=user_in.email)
-    if user:
-        raise HTTPException(
-            status_code=400, detail="The email is already used with an account"
-        )
-    user_create = UserCreate.model_validate(user_in)
-    user = user_crud.create(session=session, user_create=user_create)
-    return user
+def register(
+    user_in: UserRegister,
+    idempotency_key: IdempotencyKeyHeader = None,
+) -> Any:
+    with IdempotencyGuard(idempotency_key, scope="signup", request=user_in) as guard:
+        if guard.replay:
+            return guard.replay
+        user = account_crud.create(user_create=UserCreate.model_validate(user_in))
+        if not user:
+            raise HTTPException(
+                status_code=400, detail="The email is already used with an account"
+            )
+        guard.store(UserPublic.model_validate(user))
+        return user
 
 
 @router.post("/signin/access-token", response_model=Token)
 def login_access_token(
-    session: SessionDep, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
+    form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ) -> Any:
-    user = user_crud.authenticate(
-        session=session, email=form_data.username, password=form_data.password
+    user = account_crud.authenticate(
+        email=form_data.username, password=form_data.password
     )
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
@@ -1,29 +1,45 @@
+import functools
 import uuid
-from typing import Any
-
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import func, select
+from operator import attrgetter
+from typing import Annotated, Any
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Query,
+    Response,
+)
 
+from app import shards
 from app.api.deps import (
+    AppRoute,
     CurrentSuperuser,
     CurrentUser,
     SessionDep,
+    UserSessionDep,
     get_current_active_superuser,
 )
-from app.cruds import user_crud
+from app.config import settings
+from app.cruds import account_crud, user_crud
+from app.db import fan_out
 from app.models import (
     Message,
     UpdatePassword,
     User,
     UserCreate,
     UserPublic,
+    UserPurge,
+    UserPurgePublic,
     UsersPublic,
     UserUpdateMe,
     UserUpdateStatus,
 )
 from app.security import verify_password
+from app.tasks import purge_user
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], route_class=AppRoute)
 
 
 @router.get(
@@ -31,30 +47,34 @@ router = APIRouter(prefix="/users", tags=["users"])
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UsersPublic,
 )
-async def read_users(session: SessionDep, skip: int = 0, limit: int = 10) -> Any:
-    count_statement = select(func.count()).select_from(User)
-    count = session.exec(count_statement).one()
-
-    statement = select(User).offset(skip).limit(limit)
-    users = list(session.exec(statement).all())
-
+async def read_users(
+    session: SessionDep,
+    skip: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(gt=0, le=settings.USERS_MAX_PAGE_SIZE)] = 10,
+) -> Any:
+    if shards.count() == 1:
+        users, count = user_crud.get_multi(session=session, skip=skip, limit=limit)
+    else:
+        pages = fan_out(
+            functools.partial(user_crud.get_multi, skip=0, limit=skip + limit)
+        )
+        users, count = shards.merge_pages(
+            pages, key=attrgetter("id"), skip=skip, limit=limit
+        )
     return UsersPublic(data=users, count=count)
 
 
 @router.post("/", response_model=UserPublic)
-async def create_user(
-    session: SessionDep, current_superuser: CurrentSuperuser, user_in: UserCreate
-) -> Any:
-    user = user_crud.get_by_email(session=session, email=user_in.email)
-    if user:
-        raise HTTPException(
-            status_code=400, detail="The email is already used with an account"
-        )
+async def create_user(current_superuser: CurrentSuperuser, user_in: UserCreate) -> Any:
     if not current_superuser.is_root and user_in.is_root:
         raise HTTPException(
             status_code=403, detail="The superuser doesn't have enough privileges"
         )
-    user = user_crud.create(session=session, user_create=user_in)
+    user = account_crud.create(user_create=user_in)
+    if not user:
+        raise HTTPException(
+            status_code=400, detail="The email is already used with an account"
+        )
     return user
 
 
@@ -67,15 +87,13 @@ async def read_user_me(current_user: CurrentUser) -> Any:
 async def update_user_me(
     session: SessionDep, current_user: CurrentUser, user_in: UserUpdateMe
 ) -> Any:
-    if user_in.email:
-        user = user_crud.get_by_email(session=session, email=user_in.email)
-        if user:
-            raise HTTPException(
-                status_code=409, detail="The email is already used with an account"
-            )
-    updated_user = user_crud.update(
-        session=session, db_user=current_user, new_data=user_in
+    updated_user = account_crud.update(
+        session=session, db_user=current_user, user_in=user_in
     )
+    if not updated_user:
+        raise HTTPException(
+            status_code=409, detail="The email is already used with an account"
+        )
     return updated_user
 
 
@@ -110,7 +128,7 @@ async def delete_user_me(session: SessionDep, current_user: CurrentUser) -> Any:
     dependencies=[Depends(get_current_active_superuser)],
     response_model=UserPublic,
 )
-async def read_user(session: SessionDep, user_id: uuid.UUID) -> Any:
+async def read_user(session: UserSessionDep, user_id: uuid.UUID) -> Any:
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=400, detail="User not found")
@@ -119,7 +137,7 @@ async def read_user(session: SessionDep, user_id: uuid.UUID) -> Any:
 
 @router.patch("/{user_id}", response_model=UserPublic)
 async def update_user_status(
-    session: SessionDep,
+    session: UserSessionDep,
     current_user: CurrentSuperuser,
     user_id: uuid.UUID,
     user_status_in: UserUpdateStatus,
@@ -142,11 +160,35 @@ async def update_user_status(
     dependencies=[Depends(get_current_active_superuser)],
     response_model=Message,
 )
-async def delete_user(session: SessionDep, user_id: uuid.UUID) -> Any:
+async def delete_user(
+    session: UserSessionDep,
+    user_id: uuid.UUID,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    background: bool = False,
+) -> Any:
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     if user.is_root:
         raise HTTPException(status_code=403, detail="Cannot delete root user")
+    if background:
+        # Very large accounts are purged in batches after the response
+        user_crud.start_purge(session=session, db_user=user)
+        background_tasks.add_task(purge_user, user_id)
+        response.status_code = 202
+        return Message(message="User deletion scheduled")
     user_crud.delete(session=session, user_in=user)
     return Message(message="Delete user successfully")
+
+
+@router.get(
+    "/{user_id}/purge",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=UserPurgePublic,
+)
+async def read_user_purge(session: UserSessionDep, user_id: uuid.UUID) -> Any:
+    purge = session.get(UserPurge, user_id)
+    if not purge:
+        raise HTTPException(status_code=404, detail="User purge not found")
+    return purge
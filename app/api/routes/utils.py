@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends
+
+from app.api.deps import AppRoute, get_current_active_superuser
+from app.api.loopmonitor import loop_monitor
+from app.api.ratelimit import rate_limiter
+from app.cache import response_cache
+from app.cancellation import query_stats
+from app.db import pool_usage
+from app.models import (
+    CacheStats,
+    LoopStats,
+    PoolStats,
+    QueryStats,
+    RateLimitStats,
+    SingleFlightStats,
+)
+from app.singleflight import expense_flights
+
+router = APIRouter(prefix="/utils", tags=["utils"], route_class=AppRoute)
+
+
+@router.get(
+    "/cache-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=CacheStats,
+)
+def read_cache_stats() -> CacheStats:
+    return response_cache.stats()
+
+
+@router.get(
+    "/singleflight-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=SingleFlightStats,
+)
+def read_singleflight_stats() -> SingleFlightStats:
+    return expense_flights.stats()
+
+
+@router.get(
+    "/query-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=QueryStats,
+)
+def read_query_stats() -> QueryStats:
+    return query_stats.stats()
+
+
+@router.get(
+    "/pool-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=PoolStats,
+)
+def read_pool_stats() -> PoolStats:
+    return pool_usage.stats()
+
+
+@router.get(
+    "/rate-limit-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=RateLimitStats,
+)
+def read_rate_limit_stats() -> RateLimitStats:
+    return rate_limiter.stats()
+
+
+@router.get(
+    "/loop-stats",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=LoopStats,
+)
+def read_loop_stats() -> LoopStats:
+    return loop_monitor.stats()
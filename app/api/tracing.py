@@ -0,0 +1,52 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.tracing import Span, current_span, start_span, trace_processor
+
+
+class TracingMiddleware:
+    """Trace each request, rooting the spans of the code that serves it.
+
+    Besides the spans recorded by the instrumented code, a ``serialize``
+    span covers the time from the endpoint returning to the response
+    starting, when FastAPI validates and serializes the response.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        root = start_span("http.request", method=scope["method"], path=scope["path"])
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                endpoint = next(
+                    (s for s in reversed(root.trace.spans) if s.name == "endpoint"),
+                    None,
+                )
+                if endpoint is not None:
+                    serialize = Span(root.trace, "serialize", root.span_id, {})
+                    serialize.start_ns = endpoint.end_ns
+                    serialize.end()
+            await send(message)
+
+        token = current_span.set(root)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException:
+            root.error = True
+            raise
+        finally:
+            current_span.reset(token)
+            if (route := scope.get("route")) is not None:
+                root.name = f"{scope['method']} {route.path}"
+            root.attributes["status_code"] = status_code
+            root.end()
+            trace_processor.submit(root.trace.spans)
@@ -0,0 +1,181 @@
+import hashlib
+import importlib
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Protocol
+
+from sqlmodel import Session
+
+# app.db loads the cruds, which invalidate this cache, so the engine is
+# looked up through the module once it has finished loading
+from app import db
+from app.config import settings
+from app.cruds import cache_crud
+from app.models import CacheStats, ExpenseFilter
+
+ALL_OWNERS = "*"
+
+
+class CacheBackend(Protocol):
+    """Storage for cached responses and the write versions of their owners.
+
+    Versions must be shared by every process serving requests, so a
+    multi-worker deployment needs a shared backend.
+    """
+
+    evictions: int
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes) -> None: ...
+
+    def get_version(self, namespace: str) -> int: ...
+
+    def bump_version(self, namespace: str) -> None: ...
+
+    def size(self) -> tuple[int, int]: ...
+
+
+class MemoryBackend:
+    """In-process LRU cache bounded by the total size of the stored values."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if (previous := self._entries.pop(key, None)) is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = value
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def bump_version(self, namespace: str) -> None:
+        # Entries of older versions are never read again and age out of the LRU
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def size(self) -> tuple[int, int]:
+        return len(self._entries), self._bytes
+
+
+class DatabaseBackend(MemoryBackend):
+    """Versions in the database, shared by every worker, entries in memory.
+
+    Entries are keyed by their owner's version, so a worker never serves a
+    page another worker's write has replaced, it only misses pages cached
+    by other workers. Each lookup costs a primary key read of the version,
+    and each bump a round trip and a commit.
+    """
+
+    def get_version(self, namespace: str) -> int:
+        with Session(db.get_engine()) as session:
+            return cache_crud.get_version(session=session, namespace=namespace)
+
+    def bump_version(self, namespace: str) -> None:
+        with Session(db.get_engine()) as session:
+            cache_crud.bump_version(session=session, namespace=namespace)
+
+
+class ResponseCache:
+    """Cache expense list responses until their owner's expenses change.
+
+    Entries are keyed by the owner's write version, which every expense
+    write bumps after committing, so a cached page is never served once
+    the data behind it has changed. Reads across all owners use a version
+    bumped by every write.
+    """
+
+    def __init__(self, backend: CacheBackend) -> None:
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, owner_id: uuid.UUID | None, filters: ExpenseFilter) -> str | None:
+        """Return the cache key for a page, or ``None`` if it can't be cached.
+
+        The version must be read before querying, so that a page racing a
+        write is stored under the version that write already replaced.
+        """
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        # Relative periods move with the clock, not with writes
+        if filters.period is not None:
+            return None
+        return self.versioned_key(owner_id, filters)
+
+    def versioned_key(self, owner_id: uuid.UUID | None, filters: ExpenseFilter) -> str:
+        """Identify a page of ``filters`` as of the owner's current version."""
+        normalized = filters.model_dump(mode="json")
+        normalized["categories"] = sorted(set(normalized["categories"]))
+        digest = hashlib.sha256(
+            json.dumps(normalized, sort_keys=True).encode()
+        ).hexdigest()
+        namespace = str(owner_id) if owner_id else ALL_OWNERS
+        version = self.backend.get_version(namespace)
+        return f"expenses:{namespace}:{version}:{digest}"
+
+    def get(self, key: str) -> bytes | None:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        self.backend.set(key, value)
+
+    def invalidate(self, *owner_ids: uuid.UUID) -> None:
+        # Bumped even while disabled, so re-enabling never serves stale pages
+        for owner_id in set(owner_ids):
+            self.backend.bump_version(str(owner_id))
+        self.backend.bump_version(ALL_OWNERS)
+
+    def stats(self) -> CacheStats:
+        entries, size = self.backend.size()
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return CacheStats(
+            hits=hits,
+            misses=misses,
+            hit_ratio=hits / lookups if lookups else 0.0,
+            evictions=self.backend.evictions,
+            entries=entries,
+            size_bytes=size,
+        )
+
+
+def load_backend(path: str) -> CacheBackend:
+    module_name, _, class_name = path.rpartition(".")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    backend: CacheBackend = backend_class(max_bytes=settings.RESPONSE_CACHE_MAX_BYTES)
+    return backend
+
+
+response_cache = ResponseCache(load_backend(settings.RESPONSE_CACHE_BACKEND))
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import Engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import ConnectionPoolEntry
+
+from app.config import settings
+from app.models import QueryStats
+
+QUERY_CANCELED = "57014"
+STATEMENT_TIMEOUT_KEY = "statement_timeout_ms"
+DEADLINE_KEY = "statement_deadline"
+# SQLite virtual machine instructions between two deadline checks
+PROGRESS_INSTRUCTIONS = 1_000
+
+
+class QueryCanceller:
+    """Track the connections a request holds so its queries can be cancelled.
+
+    Connections are attached on checkout and detached on checkin, under a
+    lock, so a cancel never reaches a connection that has gone back to the
+    pool and may be running another request's query.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._connections: set[Any] = set()
+        self._lock = threading.Lock()
+
+    def attach(self, dbapi_connection: Any) -> None:
+        with self._lock:
+            self._connections.add(dbapi_connection)
+
+    def detach(self, dbapi_connection: Any) -> None:
+        with self._lock:
+            self._connections.discard(dbapi_connection)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            for dbapi_connection in self._connections:
+                if isinstance(dbapi_connection, sqlite3.Connection):
+                    dbapi_connection.interrupt()
+                else:
+                    dbapi_connection.cancel()
+
+
+current_canceller: ContextVar[QueryCanceller | None] = ContextVar(
+    "current_canceller", default=None
+)
+
+
+class QueryStatsCounter:
+    def __init__(self) -> None:
+        self.cancelled = 0
+        self.timed_out = 0
+        self._lock = threading.Lock()
+
+    def record(self, *, cancelled: bool) -> None:
+        with self._lock:
+            if cancelled:
+                self.cancelled += 1
+            else:
+                self.timed_out += 1
+
+    def stats(self) -> QueryStats:
+        with self._lock:
+            return QueryStats(cancelled=self.cancelled, timed_out=self.timed_out)
+
+
+query_stats = QueryStatsCounter()
+
+
+def _on_checkout(
+    dbapi_connection: Any, record: ConnectionPoolEntry, proxy: Any
+) -> None:
+    canceller = current_canceller.get()
+    if canceller is not None:
+        canceller.attach(dbapi_connection)
+        record.info["canceller"] = canceller
+
+
+def _on_checkin(dbapi_connection: Any, record: ConnectionPoolEntry) -> None:
+    record.info.pop(STATEMENT_TIMEOUT_KEY, None)
+    canceller = record.info.pop("canceller", None)
+    if canceller is not None:
+        canceller.detach(dbapi_connection)
+
+
+def _apply_statement_timeout(
+    session: Session, transaction: Any, connection: Any
+) -> None:
+    if not (timeout := session.info.get(STATEMENT_TIMEOUT_KEY)):
+        return
+    if connection.dialect.name == "sqlite":
+        # Picked up by the deadline of each statement until checkin
+        connection.info[STATEMENT_TIMEOUT_KEY] = timeout
+    else:
+        # Scoped to the transaction, so the pooled connection keeps its default
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def _watch_deadline(dbapi_connection: Any, record: ConnectionPoolEntry) -> None:
+    # SQLite has no statement timeout, a progress handler returning true
+    # interrupts the running statement instead
+    def past_deadline() -> bool:
+        deadline = record.info.get(DEADLINE_KEY)
+        return deadline is not None and time.monotonic() > deadline
+
+    dbapi_connection.set_progress_handler(past_deadline, PROGRESS_INSTRUCTIONS)
+
+
+def _set_deadline(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    timeout = conn.info.get(STATEMENT_TIMEOUT_KEY, settings.DB_STATEMENT_TIMEOUT_MS)
+    conn.info[DEADLINE_KEY] = time.monotonic() + timeout / 1000
+
+
+def is_query_canceled(error: OperationalError) -> bool:
+    """Whether a query was cancelled or ran past its statement timeout."""
+    if isinstance(error.orig, sqlite3.OperationalError):
+        return str(error.orig) == "interrupted"
+    return getattr(error.orig, "sqlstate", None) == QUERY_CANCELED
+
+
+def install(engine: Engine) -> None:
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _on_checkin)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _watch_deadline)
+        event.listen(engine, "before_cursor_execute", _set_deadline)
+
+
+event.listen(Session, "after_begin", _apply_statement_timeout)
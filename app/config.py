@@ -1,4 +1,5 @@
 import secrets
+from typing import Literal
 
 from pydantic import EmailStr, PostgresDsn, computed_field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -20,21 +21,132 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
+    # Tables live in this schema, created if missing, ahead of public on the
+    # search path. Lets several copies of the app share one database.
+    POSTGRES_SCHEMA: str | None = None
+
+    # Takes precedence over the Postgres settings. A SQLite file such as
+    # sqlite:///./app.db runs the app without a database server.
+    DATABASE_URL: str | None = None
 
     @computed_field  # type: ignore[prop-decorator]
     @property
-    def SQLALCHEMY_DATABASE_URI(self) -> PostgresDsn:  # noqa: N802
-        return PostgresDsn.build(
-            scheme="postgresql+psycopg",
-            username=self.POSTGRES_USER,
-            password=self.POSTGRES_PASSWORD,
-            host=self.POSTGRES_SERVER,
-            port=self.POSTGRES_PORT,
-            path=self.POSTGRES_DB,
+    def SQLALCHEMY_DATABASE_URI(self) -> str:  # noqa: N802
+        if self.DATABASE_URL:
+            return self.DATABASE_URL
+        return str(
+            PostgresDsn.build(
+                scheme="postgresql+psycopg",
+                username=self.POSTGRES_USER,
+                password=self.POSTGRES_PASSWORD,
+                host=self.POSTGRES_SERVER,
+                port=self.POSTGRES_PORT,
+                path=self.POSTGRES_DB,
+            )
         )
 
+    # More databases to spread users over, each user's expenses with them.
+    # The main database is shard 0 and also holds the tables that belong to
+    # no user, such as idempotency keys and rate limit buckets.
+    DATABASE_SHARD_URLS: list[str] = []
+
     ROOT_USER_EMAIL: EmailStr
     ROOT_USER_PASSWORD: str
 
+    # Worker processes for `python -m app.server`, one per usable CPU if unset.
+    # Every worker has its own pool, so WEB_WORKERS * (DB_POOL_SIZE +
+    # DB_MAX_OVERFLOW) must stay below the server's max_connections.
+    WEB_WORKERS: int | None = None
+    WEB_HOST: str = "0.0.0.0"
+    WEB_PORT: int = 8000
+    WEB_GRACEFUL_SHUTDOWN_SECONDS: int = 30
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # Connections opened when a worker starts, so first requests don't pay for it
+    DB_POOL_WARMUP: int = 2
+
+    # Default for every statement, overridden per route by the route name
+    DB_STATEMENT_TIMEOUT_MS: int = 30_000
+    ROUTE_STATEMENT_TIMEOUTS_MS: dict[str, int] = {
+        "read_expenses": 5_000,
+        "read_expense_changes": 5_000,
+        "read_expenses_batch": 5_000,
+        "read_users": 5_000,
+    }
+
+    # Measure event loop lag, and record what blocks the loop for longer than
+    # the threshold along with a stack sample of the loop thread
+    LOOP_MONITOR_ENABLED: bool = False
+    LOOP_MONITOR_INTERVAL_MS: int = 10
+    LOOP_BLOCK_THRESHOLD_MS: int = 100
+    LOOP_MONITOR_MAX_EVENTS: int = 100
+
+    # Record spans for each request, exported from a background thread to the
+    # log, a file of OTLP JSON lines or an OTLP/HTTP collector
+    TRACING_ENABLED: bool = False
+    TRACING_EXPORTER: Literal["console", "file", "otlp"] = "console"
+    TRACING_FILE: str = "traces.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+
+    # Let superusers profile a request with an X-Profile header or a
+    # profile query parameter. Disabled, the middleware isn't installed.
+    PROFILING_ENABLED: bool = False
+    PROFILE_SAMPLE_INTERVAL_MS: float = 1
+    PROFILE_TOP_ALLOCATIONS: int = 25
+
+    # Token buckets per signed-in user, or per client IP otherwise. Each
+    # worker keeps its own buckets unless a shared backend is configured.
+    RATE_LIMIT_ENABLED: bool = False
+    RATE_LIMIT_BACKEND: str = "app.api.ratelimit.MemoryBackend"
+    RATE_LIMIT_PER_SECOND: float = 10
+    RATE_LIMIT_BURST: float = 50
+    # Shared by all clients, disabled if unset
+    RATE_LIMIT_GLOBAL_PER_SECOND: float | None = None
+    RATE_LIMIT_GLOBAL_BURST: float = 1_000
+    RATE_LIMIT_MAX_KEYS: int = 100_000
+    RATE_LIMIT_PURGE_INTERVAL: int = 1_000
+    # Tokens a request costs by route name, 1 for routes not listed
+    ROUTE_RATE_LIMIT_COSTS: dict[str, float] = {
+        "login_access_token": 10,
+        "register": 10,
+        "update_password_me": 10,
+        "read_expenses": 2,
+        "read_expense_changes": 2,
+        "read_users": 2,
+    }
+
+    EXPENSES_MAX_PAGE_SIZE: int = 1_000
+    EXPENSE_CHANGES_MAX_PAGE_SIZE: int = 1_000
+    USERS_MAX_PAGE_SIZE: int = 1_000
+
+    # Coalesce concurrent expense creations into multi-row INSERTs
+    EXPENSE_BATCHING_ENABLED: bool = False
+    EXPENSE_BATCH_MAX_SIZE: int = 500
+    EXPENSE_BATCH_MAX_DELAY_MS: int = 5
+    EXPENSE_BATCH_SYNCHRONOUS_COMMIT: bool = True
+
+    IDEMPOTENCY_KEY_TTL_SECONDS: int = 60 * 60 * 24
+    IDEMPOTENCY_KEY_PURGE_INTERVAL: int = 1_000
+    # How long a duplicate waits for the first request's response
+    IDEMPOTENCY_WAIT_SECONDS: float = 10
+
+    # The in-process backend only sees its own process's writes, so running
+    # several workers needs app.cache.DatabaseBackend, which shares versions
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_BACKEND: str = "app.cache.MemoryBackend"
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Let identical concurrent list reads share one query in each worker
+    SINGLEFLIGHT_ENABLED: bool = True
+
+    # Re-scan this far behind a change token, so that changes committed late
+    # with an earlier timestamp are still picked up
+    CHANGE_FEED_OVERLAP_SECONDS: int = 5
+    CHANGE_FEED_RETENTION_DAYS: int = 30
+    CHANGE_FEED_PURGE_INTERVAL: int = 1_000
+
+    USER_PURGE_BATCH_SIZE: int = 5_000
+    USER_PURGE_BATCH_DELAY_SECONDS: float = 0.05
+
 
 settings = Settings()  # type: ignore
@@ -0,0 +1,112 @@
+import functools
+import uuid
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from app import security, shards
+from app.cruds import user_crud
+from app.db import fan_out, get_engine, get_user_engine
+from app.models import User, UserCreate, UserEmail, UserUpdateMe
+from app.tracing import traced
+
+# Longer than writing a user takes, so a reservation is only taken over
+# once the signup or email change that made it has finished
+EMAIL_CLAIM_GRACE = timedelta(minutes=1)
+
+
+@traced
+def find_by_email(*, email: str) -> User | None:
+    """Look up a user on any shard.
+
+    Users sign up on their email's shard, which is searched first, but
+    stay where they are when they change their email.
+    """
+    with Session(get_engine(shards.for_email(email))) as session:
+        user = user_crud.get_by_email(session=session, email=email)
+    if user is not None or shards.count() == 1:
+        return user
+    found = fan_out(functools.partial(user_crud.get_by_email, email=email))
+    return next((user for user in found if user is not None), None)
+
+
+@traced
+def authenticate(*, email: str, password: str) -> User | None:
+    user = find_by_email(email=email)
+    if not user or not security.verify_password(password, user.hashed_password):
+        return None
+    return user
+
+
+@traced
+def claim_email(*, email: str, user_id: uuid.UUID) -> bool:
+    """Reserve an email for a user across shards.
+
+    The reservation of a user who was since deleted or moved to another
+    email is taken over. The users who got their email before it was
+    reserved are found by the callers' ``find_by_email``.
+    """
+    with Session(get_engine()) as registry:
+        if user_crud.claim_email(session=registry, email=email, user_id=user_id):
+            return True
+        claim = registry.get(UserEmail, email)
+    if claim is None or datetime.now() - claim.claimed_at < EMAIL_CLAIM_GRACE:
+        return False
+    with Session(get_user_engine(claim.user_id)) as session:
+        holder = session.get(User, claim.user_id)
+    if holder is not None and holder.email == email:
+        return False
+    with Session(get_engine()) as registry:
+        return user_crud.claim_email(
+            session=registry, email=email, user_id=user_id, replace=claim
+        )
+
+
+@traced
+def release_email(*, email: str, user_id: uuid.UUID) -> None:
+    with Session(get_engine()) as registry:
+        user_crud.release_email(session=registry, email=email, user_id=user_id)
+
+
+@traced
+def create(*, user_create: UserCreate) -> User | None:
+    """Create a user on their email's shard, or return ``None`` if it's used."""
+    if shards.count() == 1:
+        with Session(get_engine()) as session:
+            return user_crud.create(session=session, user_create=user_create)
+    # That shard's unique index doesn't cover users who moved to the email
+    if find_by_email(email=user_create.email) is not None:
+        return None
+    user_id = shards.new_user_id(user_create.email)
+    if not claim_email(email=user_create.email, user_id=user_id):
+        return None
+    user = None
+    try:
+        with Session(get_user_engine(user_id)) as session:
+            user = user_crud.create(
+                session=session, user_create=user_create, user_id=user_id
+            )
+    finally:
+        if user is None:
+            release_email(email=user_create.email, user_id=user_id)
+    return user
+
+
+@traced
+def update(*, session: Session, db_user: User, user_in: UserUpdateMe) -> User | None:
+    """Update a user, or return ``None`` if their new email is used."""
+    email = user_in.email
+    if shards.count() == 1 or email is None or email == db_user.email:
+        return user_crud.update(session=session, db_user=db_user, new_data=user_in)
+    # The user's own shard only knows the emails of its users
+    if find_by_email(email=email) is not None or not claim_email(
+        email=email, user_id=db_user.id
+    ):
+        return None
+    user = None
+    try:
+        user = user_crud.update(session=session, db_user=db_user, new_data=user_in)
+    finally:
+        if user is None:
+            release_email(email=email, user_id=db_user.id)
+    return user
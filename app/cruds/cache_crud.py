@@ -0,0 +1,27 @@
+from sqlmodel import Session, col, select
+
+from app import dialects
+from app.models import CacheVersion
+from app.tracing import traced
+
+
+@traced
+def get_version(*, session: Session, namespace: str) -> int:
+    statement = select(CacheVersion.version).where(
+        col(CacheVersion.namespace) == namespace
+    )
+    return session.exec(statement).first() or 0
+
+
+@traced
+def bump_version(*, session: Session, namespace: str) -> None:
+    """Increment a version in a single statement, so no bump is ever lost."""
+    values = dialects.insert(session, CacheVersion).values(
+        namespace=namespace, version=1
+    )
+    statement = values.on_conflict_do_update(
+        index_elements=[col(CacheVersion.namespace)],
+        set_={"version": col(CacheVersion.version) + 1},
+    )
+    session.exec(statement)  # type: ignore
+    session.commit()
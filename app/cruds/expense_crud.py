@@ -1,32 +1,528 @@
+import heapq
 import uuid
-from datetime import datetime
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from typing import Any
 
-from sqlmodel import Session
+import sqlalchemy as sa
+from sqlalchemy import CTE, Column, ColumnElement
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.functions import FunctionElement
+from sqlmodel import Session, col, func, or_, select
 
-from app.models import Expense, ExpenseCreate, ExpenseUpdate
+from app import dialects
+from app.cache import response_cache
+from app.enums import ExpenseCategory
+from app.models import (
+    Expense,
+    ExpenseCreate,
+    ExpenseFilter,
+    ExpenseTombstone,
+    ExpenseUpdate,
+)
+from app.models.expenses import SEARCH_CONFIG
+from app.tracing import traced
+from app.utils import escape_like
 
 
+def _public_columns() -> list[Column[Any]]:
+    # The generated search vector is never exposed, so don't return it
+    table = Expense.__table__  # type: ignore[attr-defined]
+    return [column for column in table.columns if column.name != "search_vector"]
+
+
+def _owned_target(expense_id: uuid.UUID) -> CTE:
+    return (
+        select(col(Expense.id), col(Expense.owner_id))
+        .where(col(Expense.id) == expense_id)
+        .cte("target")
+    )
+
+
+@traced
 def create(
     *, session: Session, expense_in: ExpenseCreate, owner_id: uuid.UUID
 ) -> Expense:
     db_expense = Expense.model_validate(expense_in, update={"owner_id": owner_id})
-    session.add(db_expense)
+    return create_many(session=session, expenses=[db_expense])[0]
+
+
+@traced
+def create_many(
+    *, session: Session, expenses: list[Expense], synchronous_commit: bool = True
+) -> list[Expense]:
+    """Insert expenses with one multi-row INSERT and return them in order.
+
+    With ``synchronous_commit`` disabled the commit returns before its WAL
+    is flushed to disk, trading durability of the last few transactions on
+    a server crash for throughput.
+    """
+    if not synchronous_commit and not dialects.is_sqlite(session):
+        session.exec(sa.text("SET LOCAL synchronous_commit = off"))  # type: ignore
+    statement = (
+        sa.insert(Expense)
+        .values([expense.model_dump() for expense in expenses])
+        .returning(*_public_columns())
+    )
+    rows = session.exec(statement).all()  # type: ignore
     session.commit()
-    session.refresh(db_expense)
-    return db_expense
+    response_cache.invalidate(*(expense.owner_id for expense in expenses))
+    created = {row.id: Expense.model_validate(row._mapping) for row in rows}
+    return [created[expense.id] for expense in expenses]
 
 
+@traced
 def update(
-    *, session: Session, db_expense: Expense, expense_in: ExpenseUpdate
-) -> Expense:
+    *,
+    session: Session,
+    expense_id: uuid.UUID,
+    owner_id: uuid.UUID,
+    expense_in: ExpenseUpdate,
+) -> tuple[bool, Expense | None]:
+    """Update an expense if it belongs to ``owner_id``, in a single statement.
+
+    Returns whether the expense exists and the updated expense, which is
+    ``None`` when it belongs to someone else.
+    """
     update_dict = expense_in.model_dump(exclude_unset=True)
-    db_expense.sqlmodel_update(update_dict, update={"updated_at": datetime.now()})
-    session.add(db_expense)
+    update_dict["updated_at"] = datetime.now()
+    if dialects.is_sqlite(session):
+        return _update_sqlite(
+            session=session,
+            expense_id=expense_id,
+            owner_id=owner_id,
+            values=update_dict,
+        )
+    target = _owned_target(expense_id)
+    updated = (
+        sa.update(Expense)
+        .where(col(Expense.id) == target.c.id, target.c.owner_id == owner_id)
+        .values(update_dict)
+        .returning(*_public_columns())
+        .cte("updated")
+    )
+    statement = sa.select(updated).select_from(target.outerjoin(updated, sa.true()))
+    row = session.exec(statement).first()  # type: ignore
     session.commit()
-    session.refresh(db_expense)
-    return db_expense
+    if row is None:
+        return False, None
+    if row.id is None:
+        return True, None
+    response_cache.invalidate(owner_id)
+    return True, Expense.model_validate(row._mapping)
+
+
+@traced
+def delete(
+    *, session: Session, expense_id: uuid.UUID, owner_id: uuid.UUID
+) -> tuple[bool, bool]:
+    """Delete an expense if it belongs to ``owner_id``, in a single statement.
+
+    The same statement records a tombstone for the change feed. Returns
+    whether the expense exists and whether it was deleted.
+    """
+    if dialects.is_sqlite(session):
+        return _delete_sqlite(session=session, expense_id=expense_id, owner_id=owner_id)
+    target = _owned_target(expense_id)
+    deleted = (
+        sa.delete(Expense)
+        .where(col(Expense.id) == target.c.id, target.c.owner_id == owner_id)
+        .returning(col(Expense.id), col(Expense.owner_id))
+        .cte("deleted")
+    )
+    tombstone = (
+        sa.insert(ExpenseTombstone)
+        .from_select(
+            ["id", "owner_id", "deleted_at"],
+            sa.select(deleted.c.id, deleted.c.owner_id, sa.literal(datetime.now())),
+        )
+        .cte("tombstone")
+    )
+    statement = (
+        sa.select(deleted.c.id)
+        .select_from(target.outerjoin(deleted, sa.true()))
+        .add_cte(tombstone)
+    )
+    row = session.exec(statement).first()  # type: ignore
+    session.commit()
+    if row is None:
+        return False, False
+    if row.id is None:
+        return True, False
+    response_cache.invalidate(owner_id)
+    return True, True
+
+
+def _exists(*, session: Session, expense_id: uuid.UUID) -> bool:
+    statement = select(col(Expense.id)).where(col(Expense.id) == expense_id)
+    return session.exec(statement).first() is not None
+
+
+def _update_sqlite(
+    *,
+    session: Session,
+    expense_id: uuid.UUID,
+    owner_id: uuid.UUID,
+    values: dict[str, Any],
+) -> tuple[bool, Expense | None]:
+    # SQLite can't modify rows in a CTE, but its single writer keeps the
+    # existence check in the same transaction consistent with the update
+    statement = (
+        sa.update(Expense)
+        .where(col(Expense.id) == expense_id, col(Expense.owner_id) == owner_id)
+        .values(values)
+        .returning(*_public_columns())
+    )
+    row = session.exec(statement).first()  # type: ignore
+    exists = row is not None or _exists(session=session, expense_id=expense_id)
+    session.commit()
+    if row is None:
+        return exists, None
+    response_cache.invalidate(owner_id)
+    return True, Expense.model_validate(row._mapping)
+
+
+def _delete_sqlite(
+    *, session: Session, expense_id: uuid.UUID, owner_id: uuid.UUID
+) -> tuple[bool, bool]:
+    statement = (
+        sa.delete(Expense)
+        .where(col(Expense.id) == expense_id, col(Expense.owner_id) == owner_id)
+        .returning(col(Expense.id))
+    )
+    if session.exec(statement).first() is None:  # type: ignore
+        exists = _exists(session=session, expense_id=expense_id)
+        session.commit()
+        return exists, False
+    session.add(
+        ExpenseTombstone(id=expense_id, owner_id=owner_id, deleted_at=datetime.now())
+    )
+    session.commit()
+    response_cache.invalidate(owner_id)
+    return True, True
+
+
+def _matches_ids(
+    session: Session, expense_ids: Sequence[uuid.UUID]
+) -> ColumnElement[bool]:
+    if dialects.is_sqlite(session):
+        return col(Expense.id).in_(set(expense_ids))
+    # One array parameter whatever the number of ids
+    ids = sa.bindparam("ids", list(set(expense_ids)), type_=ARRAY(sa.Uuid))
+    return col(Expense.id) == sa.any_(ids)
+
+
+@traced
+def get_existing_ids(
+    *, session: Session, expense_ids: Sequence[uuid.UUID]
+) -> set[uuid.UUID]:
+    """Return which of ``expense_ids`` exist, whoever owns them."""
+    statement = select(col(Expense.id)).where(_matches_ids(session, expense_ids))
+    return set(session.exec(statement).all())
+
+
+@traced
+def get_batch(
+    *, session: Session, expense_ids: Sequence[uuid.UUID], owner_id: uuid.UUID
+) -> dict[uuid.UUID, Expense | None]:
+    """Look up expenses by id in a single statement.
+
+    Expenses of ``owner_id`` map to the expense, those of other owners to
+    ``None``, and ids that don't exist are left out.
+    """
+    matches_ids = _matches_ids(session, expense_ids)
+    target = select(col(Expense.id)).where(matches_ids).cte("target")
+    owned = Expense.__table__.alias("owned")  # type: ignore[attr-defined]
+    statement = sa.select(
+        target.c.id.label("target_id"),
+        *(owned.c[column.name] for column in _public_columns()),
+    ).select_from(
+        target.outerjoin(
+            owned, sa.and_(owned.c.id == target.c.id, owned.c.owner_id == owner_id)
+        )
+    )
+    rows = session.exec(statement).all()  # type: ignore
+    result: dict[uuid.UUID, Expense | None] = {}
+    for row in rows:
+        values = dict(row._mapping)
+        target_id = values.pop("target_id")
+        result[target_id] = Expense.model_validate(values) if row.id else None
+    return result
+
+
+@traced
+def delete_batch_by_owner(
+    *, session: Session, owner_id: uuid.UUID, batch_size: int
+) -> int:
+    """Delete up to ``batch_size`` expenses of an owner and return how many."""
+    batch = (
+        select(col(Expense.id))
+        .where(col(Expense.owner_id) == owner_id)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    result = session.exec(sa.delete(Expense).where(col(Expense.id).in_(batch)))  # type: ignore
+    session.commit()
+    if result.rowcount:
+        response_cache.invalidate(owner_id)
+    return int(result.rowcount)
+
+
+def change_key(change: Expense | ExpenseTombstone) -> tuple[datetime, uuid.UUID]:
+    """Position of a change in the feed, to order changes and resume after one."""
+    if isinstance(change, ExpenseTombstone):
+        return change.deleted_at, change.id
+    return change.updated_at, change.id
+
+
+@traced
+def get_changes(
+    *,
+    session: Session,
+    since: datetime | None,
+    cursor_id: uuid.UUID | None = None,
+    limit: int,
+    owner_id: uuid.UUID | None = None,
+) -> tuple[list[Expense | ExpenseTombstone], bool]:
+    """Return up to ``limit`` expenses changed and deleted after ``since``.
+
+    Changes are ordered by ``change_key`` and resume strictly after
+    ``(since, cursor_id)`` when a cursor is given, so expenses and their
+    deletions share one page size and cursor. A first sync, without
+    ``since``, has nothing to delete and gets no deletions. Also returns
+    whether there are more changes.
+    """
+    statement = select(Expense).order_by(col(Expense.updated_at), col(Expense.id))
+    tombstones = select(ExpenseTombstone).order_by(
+        col(ExpenseTombstone.deleted_at), col(ExpenseTombstone.id)
+    )
+    if owner_id is not None:
+        statement = statement.where(col(Expense.owner_id) == owner_id)
+        tombstones = tombstones.where(col(ExpenseTombstone.owner_id) == owner_id)
+    if since is not None:
+        if cursor_id is not None:
+            cursor = sa.tuple_(sa.literal(since), sa.literal(cursor_id))
+            statement = statement.where(
+                sa.tuple_(col(Expense.updated_at), col(Expense.id)) > cursor
+            )
+            tombstones = tombstones.where(
+                sa.tuple_(col(ExpenseTombstone.deleted_at), col(ExpenseTombstone.id))
+                > cursor
+            )
+        else:
+            statement = statement.where(col(Expense.updated_at) > since)
+            tombstones = tombstones.where(col(ExpenseTombstone.deleted_at) > since)
+
+    expenses: Sequence[Expense | ExpenseTombstone]
+    expenses = session.exec(statement.limit(limit + 1)).all()
+    deleted: Sequence[Expense | ExpenseTombstone] = []
+    if since is not None:
+        deleted = session.exec(tombstones.limit(limit + 1)).all()
+    changes = list(heapq.merge(expenses, deleted, key=change_key))
+    return changes[:limit], len(changes) > limit
 
 
-def delete(*, session: Session, expense_in: Expense) -> None:
-    session.delete(expense_in)
+@traced
+def purge_tombstones(*, session: Session, before: datetime) -> int:
+    statement = sa.delete(ExpenseTombstone).where(
+        col(ExpenseTombstone.deleted_at) < before
+    )
+    result = session.exec(statement)  # type: ignore
     session.commit()
+    return int(result.rowcount)
+
+
+class search_match(FunctionElement[bool]):  # noqa: N801
+    """Whether an expense's search vector matches a web search query."""
+
+    type = sa.Boolean()
+    inherit_cache = True
+
+
+class search_rank(FunctionElement[float]):  # noqa: N801
+    """How well an expense's search vector matches a web search query."""
+
+    type = sa.Float()
+    inherit_cache = True
+
+
+@compiles(search_match)
+def _compile_search_match(element: Any, compiler: SQLCompiler, **kw: Any) -> str:
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, *element.clauses)
+    match = col(Expense.search_vector).bool_op("@@")(ts_query)
+    return compiler.process(match, **kw)
+
+
+@compiles(search_match, "sqlite")
+def _compile_search_match_sqlite(element: Any, compiler: SQLCompiler, **kw: Any) -> str:
+    # No full-text index, the substring matches next to it do the work
+    return "0"
+
+
+@compiles(search_rank)
+def _compile_search_rank(element: Any, compiler: SQLCompiler, **kw: Any) -> str:
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, *element.clauses)
+    return compiler.process(func.ts_rank(Expense.search_vector, ts_query), **kw)
+
+
+@compiles(search_rank, "sqlite")
+def _compile_search_rank_sqlite(element: Any, compiler: SQLCompiler, **kw: Any) -> str:
+    # Weigh title matches above description matches, like the tsvector does
+    q = func.lower(*element.clauses)
+    rank = sa.cast(func.instr(func.lower(Expense.title), q) > 0, sa.Integer) * 2 + (
+        sa.cast(func.instr(Expense.search_vector, q) > 0, sa.Integer)
+    )
+    return compiler.process(rank, **kw)
+
+
+def filter_clauses(
+    filters: ExpenseFilter, owner_id: uuid.UUID | None = None
+) -> list[ColumnElement[bool]]:
+    clauses: list[ColumnElement[bool]] = []
+    # Selecting every category is the default and needs no predicate
+    if set(filters.categories) != set(ExpenseCategory):
+        clauses.append(col(Expense.category).in_(filters.categories))
+    if owner_id is not None:
+        clauses.append(col(Expense.owner_id) == owner_id)
+
+    if filters.period and filters.n_periods:
+        date_threshold = datetime.now() - timedelta(
+            days=filters.n_periods * filters.period.get_days()
+        )
+        clauses.append(col(Expense.created_at) >= date_threshold)
+    elif filters.start_date and filters.end_date:
+        clauses.append(
+            col(Expense.created_at).between(filters.start_date, filters.end_date)
+        )
+    if filters.updated_since:
+        clauses.append(col(Expense.updated_at) >= filters.updated_since)
+
+    if filters.min_amount is not None:
+        clauses.append(col(Expense.amount) >= filters.min_amount)
+    if filters.max_amount is not None:
+        clauses.append(col(Expense.amount) <= filters.max_amount)
+
+    if filters.q:
+        # Full-text match on whole words, trigram-indexed match on substrings
+        pattern = f"%{escape_like(filters.q)}%"
+        clauses.append(
+            or_(
+                search_match(filters.q),
+                col(Expense.title).ilike(pattern, escape="\\"),
+                col(Expense.description).ilike(pattern, escape="\\"),
+            )
+        )
+    return clauses
+
+
+def _sort_value(filters: ExpenseFilter) -> Any:
+    if filters.order_by == "relevance":
+        return search_rank(filters.q or "")
+    return col(getattr(Expense, filters.order_by))
+
+
+def _sort_column(filters: ExpenseFilter) -> Any:
+    sort_column = _sort_value(filters)
+    if filters.sort_order == "desc":
+        return sort_column.desc()
+    return sort_column.asc()
+
+
+def _count(*, session: Session, clauses: list[ColumnElement[bool]]) -> int:
+    count_statement = select(func.count()).select_from(Expense).where(*clauses)
+    return session.exec(count_statement).one()
+
+
+@traced
+def get_multi(
+    *, session: Session, filters: ExpenseFilter, owner_id: uuid.UUID | None = None
+) -> tuple[list[Expense], int]:
+    clauses = filter_clauses(filters, owner_id=owner_id)
+
+    # Get total count before pagination
+    count = _count(session=session, clauses=clauses)
+
+    # Apply sorting and pagination
+    statement = (
+        select(Expense)
+        .where(*clauses)
+        .order_by(_sort_column(filters))
+        .offset(filters.skip)
+        .limit(filters.limit)
+    )
+    expenses = list(session.exec(statement).all())
+    return expenses, count
+
+
+@traced
+def get_multi_fields(
+    *,
+    session: Session,
+    filters: ExpenseFilter,
+    fields: Sequence[str],
+    owner_id: uuid.UUID | None = None,
+) -> tuple[list[dict[str, Any]], int]:
+    """Like ``get_multi``, but only read the columns in ``fields``."""
+    clauses = filter_clauses(filters, owner_id=owner_id)
+    count = _count(session=session, clauses=clauses)
+    statement = (
+        sa.select(*(col(getattr(Expense, name)) for name in fields))
+        .where(*clauses)
+        .order_by(_sort_column(filters))
+        .offset(filters.skip)
+        .limit(filters.limit)
+    )
+    rows = session.exec(statement).all()  # type: ignore
+    return [dict(row._mapping) for row in rows], count
+
+
+@traced
+def get_multi_sorted(
+    *,
+    session: Session,
+    filters: ExpenseFilter,
+    fields: Sequence[str] | None = None,
+    owner_id: uuid.UUID | None = None,
+) -> tuple[list[tuple[Any, dict[str, Any]]], int]:
+    """Read the rows up to the end of a page with the value they sort by.
+
+    Returns ``(sort value, row)`` pairs from the first ``skip + limit``
+    rows, so that the pages of several databases can be merged.
+    """
+    clauses = filter_clauses(filters, owner_id=owner_id)
+    count = _count(session=session, clauses=clauses)
+    columns = (
+        [col(getattr(Expense, name)) for name in fields]
+        if fields
+        else _public_columns()
+    )
+    statement = (
+        sa.select(_sort_value(filters).label("_sort"), *columns)
+        .where(*clauses)
+        .order_by(_sort_column(filters))
+        .limit(filters.skip + filters.limit)
+    )
+    rows = session.exec(statement).all()  # type: ignore
+    pairs = []
+    for row in rows:
+        values = dict(row._mapping)
+        pairs.append((values.pop("_sort"), values))
+    return pairs, count
+
+
+@traced
+def get_fields(
+    *, session: Session, expense_id: uuid.UUID, fields: Sequence[str]
+) -> tuple[uuid.UUID, dict[str, Any]] | None:
+    """Read the columns in ``fields`` of an expense, along with its owner."""
+    statement = sa.select(
+        col(Expense.owner_id).label("_owner_id"),
+        *(col(getattr(Expense, name)) for name in fields),
+    ).where(col(Expense.id) == expense_id)
+    row = session.exec(statement).first()  # type: ignore
+    if row is None:
+        return None
+    values = dict(row._mapping)
+    return values.pop("_owner_id"), values
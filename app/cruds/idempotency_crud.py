@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlmodel import Session, col, delete, func, select, update
+
+from app import dialects
+from app.models import IdempotencyKey
+from app.tracing import traced
+
+
+@traced
+def claim(
+    *, session: Session, key_hash: bytes, request_hash: bytes, ttl: timedelta
+) -> bool:
+    """Reserve a key for this request, reclaiming it if it has expired.
+
+    Returns ``False`` if another request holds a live key, or is claiming
+    it in a transaction that is still open. That transaction holds an
+    advisory lock on the key, so this never waits on its row while holding
+    a connection. The claim is only visible to others once ``session``
+    commits.
+    """
+    if not dialects.is_sqlite(session):
+        lock_id = int.from_bytes(key_hash[:8], signed=True)
+        locked = select(func.pg_try_advisory_xact_lock(lock_id))
+        if not session.exec(locked).one():
+            return False
+    now = datetime.now()
+    values = dialects.insert(session, IdempotencyKey).values(
+        key_hash=key_hash, request_hash=request_hash, created_at=now
+    )
+    statement = values.on_conflict_do_update(
+        index_elements=[col(IdempotencyKey.key_hash)],
+        set_={
+            "request_hash": values.excluded.request_hash,
+            "status_code": None,
+            "response": None,
+            "created_at": values.excluded.created_at,
+        },
+        where=col(IdempotencyKey.created_at) < now - ttl,
+    ).returning(col(IdempotencyKey.key_hash))
+    return session.exec(statement).first() is not None  # type: ignore
+
+
+@traced
+def store(
+    *, session: Session, key_hash: bytes, status_code: int, response: dict[str, Any]
+) -> None:
+    statement = (
+        update(IdempotencyKey)
+        .where(col(IdempotencyKey.key_hash) == key_hash)
+        .values(status_code=status_code, response=response)
+    )
+    session.exec(statement)  # type: ignore
+    session.commit()
+
+
+@traced
+def release(*, session: Session, key_hash: bytes) -> None:
+    """Delete a claim whose response was never stored."""
+    statement = delete(IdempotencyKey).where(
+        col(IdempotencyKey.key_hash) == key_hash,
+        col(IdempotencyKey.status_code).is_(None),
+    )
+    session.exec(statement)  # type: ignore
+    session.commit()
+
+
+@traced
+def purge_expired(*, session: Session, ttl: timedelta) -> int:
+    statement = delete(IdempotencyKey).where(
+        col(IdempotencyKey.created_at) < datetime.now() - ttl
+    )
+    result = session.exec(statement)  # type: ignore
+    session.commit()
+    return int(result.rowcount)
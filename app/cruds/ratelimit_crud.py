@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import ColumnElement, func
+from sqlmodel import Session, col, delete, select
+
+from app import dialects
+from app.models import RateLimitBucket
+from app.tracing import traced
+
+
+@traced
+def take(
+    *, session: Session, key: str, cost: float, rate: float, burst: float
+) -> float:
+    """Take ``cost`` tokens from a bucket refilling at ``rate`` per second.
+
+    Returns 0 if the tokens were taken, otherwise the seconds until the
+    bucket holds enough. The refill and the take are a single statement,
+    so concurrent requests from any process never spend the same tokens.
+    """
+    now = datetime.now()
+    values = dialects.insert(session, RateLimitBucket).values(
+        key=key, tokens=burst - cost, updated_at=now
+    )
+    refilled: ColumnElement[Any]
+    if dialects.is_sqlite(session):
+        elapsed = (
+            func.julianday(values.excluded.updated_at)
+            - func.julianday(col(RateLimitBucket.updated_at))
+        ) * 86400
+        # SQLite's scalar min() takes the smallest of its arguments
+        refilled = func.min(burst, col(RateLimitBucket.tokens) + elapsed * rate)
+    else:
+        elapsed = func.extract(
+            "epoch", values.excluded.updated_at - col(RateLimitBucket.updated_at)
+        )
+        refilled = func.least(burst, col(RateLimitBucket.tokens) + elapsed * rate)
+    statement = values.on_conflict_do_update(
+        index_elements=[col(RateLimitBucket.key)],
+        set_={"tokens": refilled - cost, "updated_at": values.excluded.updated_at},
+        where=refilled >= cost,
+    ).returning(col(RateLimitBucket.tokens))
+    taken = session.exec(statement).first()  # type: ignore
+    session.commit()
+    if taken is not None:
+        return 0.0
+
+    bucket = session.get(RateLimitBucket, key)
+    if bucket is None:
+        # Purged in between, the next request starts with a full bucket
+        return 0.0
+    tokens = min(
+        burst, bucket.tokens + (now - bucket.updated_at).total_seconds() * rate
+    )
+    return max(cost - tokens, 0.0) / rate
+
+
+@traced
+def purge_idle(*, session: Session, before: datetime) -> int:
+    """Delete buckets last used before ``before``.
+
+    A bucket idle for longer than it takes to refill is full again, which
+    is the same as having no bucket at all.
+    """
+    statement = delete(RateLimitBucket).where(col(RateLimitBucket.updated_at) < before)
+    result = session.exec(statement)  # type: ignore
+    session.commit()
+    return int(result.rowcount)
+
+
+@traced
+def count(*, session: Session) -> int:
+    return session.exec(select(func.count()).select_from(RateLimitBucket)).one()
@@ -1,26 +1,52 @@
+import uuid
+from datetime import datetime
 from typing import Any
 
+import sqlalchemy as sa
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlalchemy import Column
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, func, select
 
-from app.models import User, UserCreate
+from app import dialects, shards
+from app.cache import response_cache
+from app.models import Expense, User, UserCreate, UserEmail, UserPurge
 from app.security import get_password_hash, verify_password
+from app.tracing import traced
 
 
-def create(*, session: Session, user_create: UserCreate) -> User:
+def _columns() -> list[Column[Any]]:
+    return list(User.__table__.columns)  # type: ignore[attr-defined]
+
+
+@traced
+def create(
+    *, session: Session, user_create: UserCreate, user_id: uuid.UUID | None = None
+) -> User | None:
+    """Insert a user, or return ``None`` if the email is already used."""
     extra: dict[str, Any] = {"hashed_password": get_password_hash(user_create.password)}
     if user_create.is_root:
         extra["is_superuser"] = True
+    extra["id"] = user_id or shards.new_user_id(user_create.email)
     db_user = User.model_validate(user_create, update=extra)
-    session.add(db_user)
+    statement = (
+        dialects.insert(session, User)
+        .values(db_user.model_dump())
+        .on_conflict_do_nothing(index_elements=[col(User.email)])
+        .returning(*_columns())
+    )
+    row = session.exec(statement).first()  # type: ignore
     session.commit()
-    session.refresh(db_user)
-    return db_user
+    if row is None:
+        return None
+    return User.model_validate(row._mapping)
 
 
+@traced
 def update(
     *, session: Session, db_user: User, new_data: dict[str, Any] | BaseModel
-) -> User:
+) -> User | None:
+    """Update a user, or return ``None`` if the new email is already used."""
     if isinstance(new_data, BaseModel):
         new_data = new_data.model_dump(exclude_unset=True)
     if new_data.get("is_root") is True:
@@ -28,24 +54,116 @@ def update(
     if new_data.get("password"):
         new_data["hashed_password"] = get_password_hash(new_data["password"])
 
-    db_user.sqlmodel_update(new_data)
-    session.add(db_user)
+    columns = _columns()
+    values = {c.name: new_data[c.name] for c in columns if c.name in new_data}
+    if not values:
+        return db_user
+    statement = (
+        sa.update(User)
+        .where(col(User.id) == db_user.id)
+        .values(values)
+        .returning(*columns)
+    )
+    try:
+        row = session.exec(statement).one()  # type: ignore
+    except IntegrityError as e:
+        session.rollback()
+        if dialects.is_unique_violation(e):
+            return None
+        raise
     session.commit()
-    session.refresh(db_user)
-    return db_user
+    return User.model_validate(row._mapping)
 
 
+@traced
 def delete(*, session: Session, user_in: User) -> None:
     session.delete(user_in)
     session.commit()
+    # The database cascade removes the user's expenses
+    response_cache.invalidate(user_in.id)
+
+
+@traced
+def start_purge(*, session: Session, db_user: User) -> UserPurge:
+    """Deactivate a user and record a purge of their expenses.
 
+    The expenses and the user are then removed in batches by
+    ``app.tasks.purge_user``.
+    """
+    purge = session.get(UserPurge, db_user.id)
+    if purge:
+        return purge
+    total = session.exec(
+        select(func.count()).select_from(Expense).where(Expense.owner_id == db_user.id)
+    ).one()
+    purge = UserPurge(user_id=db_user.id, total_expenses=total)
+    db_user.is_active = False
+    session.add(db_user)
+    session.add(purge)
+    session.commit()
+    session.refresh(purge)
+    return purge
 
+
+@traced
+def get_multi(*, session: Session, skip: int, limit: int) -> tuple[list[User], int]:
+    """Return a page of users in id order, and the number of users."""
+    count = session.exec(select(func.count()).select_from(User)).one()
+    statement = select(User).order_by(col(User.id)).offset(skip).limit(limit)
+    return list(session.exec(statement).all()), count
+
+
+@traced
 def get_by_email(*, session: Session, email: str) -> User | None:
     statement = select(User).where(User.email == email)
     session_user = session.exec(statement).first()
     return session_user
 
 
+@traced
+def claim_email(
+    *,
+    session: Session,
+    email: str,
+    user_id: uuid.UUID,
+    replace: UserEmail | None = None,
+) -> bool:
+    """Reserve ``email`` for ``user_id`` in the email registry.
+
+    Returns ``False`` if it is reserved for another user, unless that
+    reservation is ``replace``, which is then taken over. Commits, so that
+    the reservation holds before the user is written to their shard.
+    """
+    now = datetime.now()
+    taken_over = col(UserEmail.user_id) == user_id
+    if replace is not None:
+        taken_over |= (col(UserEmail.user_id) == replace.user_id) & (
+            col(UserEmail.claimed_at) == replace.claimed_at
+        )
+    values = dialects.insert(session, UserEmail).values(
+        email=email, user_id=user_id, claimed_at=now
+    )
+    statement = values.on_conflict_do_update(
+        index_elements=[col(UserEmail.email)],
+        set_={"user_id": user_id, "claimed_at": now},
+        where=taken_over,
+    ).returning(col(UserEmail.email))
+    claimed = session.exec(statement).first() is not None  # type: ignore
+    session.commit()
+    return claimed
+
+
+@traced
+def release_email(*, session: Session, email: str, user_id: uuid.UUID) -> None:
+    """Drop a reservation whose user was never written."""
+    statement = sa.delete(UserEmail).where(
+        col(UserEmail.email) == email, col(UserEmail.user_id) == user_id
+    )
+    session.exec(statement)  # type: ignore
+    session.commit()
+
+
+@traced
 def authenticate(*, session: Session, email: str, password: str) -> User | None:
     db_user = get_by_email(session=session, email=email)
     if not db_user:
@@ -1,23 +1,285 @@
-from sqlmodel import Session, SQLModel, create_engine, select
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
 
+from sqlalchemy import Engine, event, make_url
+from sqlalchemy.pool import ConnectionPoolEntry
+from sqlmodel import Session, SQLModel, create_engine, select, text
+
+from app import cancellation, shards, tracing
 from app.config import settings
 from app.cruds import user_crud
-from app.models import User, UserCreate
+from app.enums import ExpenseCategory
+from app.models import PoolStats, User, UserCreate
+from app.models.expenses import CATEGORY_TYPE, SEARCH_VECTOR_EXPRESSION
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+T = TypeVar("T")
 
+_engines: list[Engine] = []
+_engine_lock = threading.Lock()
+_fan_out_pool: ThreadPoolExecutor | None = None
+
+SQLITE_PRAGMAS: dict[str, str | int] = {
+    # Readers and the writer don't block each other
+    "journal_mode": "WAL",
+    # With WAL, a power loss may only lose the last commits, never corrupt
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    # Wait for the write lock rather than fail at once
+    "busy_timeout": 5_000,
+    "cache_size": -64 * 1024,  # KiB
+    "temp_store": "MEMORY",
+    "mmap_size": 256 * 1024 * 1024,
+}
+
+
+class PoolUsage:
+    """Measure how long connections stay checked out of the pool."""
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.held_seconds = 0.0
+        self.max_held_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def checkout(
+        self, dbapi_connection: Any, record: ConnectionPoolEntry, proxy: Any
+    ) -> None:
+        record.info["checked_out_at"] = time.perf_counter()
+
+    def checkin(self, dbapi_connection: Any, record: ConnectionPoolEntry) -> None:
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is None:
+            return
+        held = time.perf_counter() - checked_out_at
+        with self._lock:
+            self.checkouts += 1
+            self.held_seconds += held
+            self.max_held_seconds = max(self.max_held_seconds, held)
+
+    def stats(self) -> PoolStats:
+        pools: list[Any] = [engine.pool for engine in get_engines()]
+        with self._lock:
+            mean = self.held_seconds / self.checkouts if self.checkouts else 0.0
+            return PoolStats(
+                size=sum(pool.size() for pool in pools),
+                checked_out=sum(pool.checkedout() for pool in pools),
+                checkouts=self.checkouts,
+                mean_held_ms=mean * 1000,
+                max_held_ms=self.max_held_seconds * 1000,
+            )
+
+
+pool_usage = PoolUsage()
+
+
+def get_engines() -> list[Engine]:
+    """Return the engine of every shard, creating them on first use.
+
+    Creating them loads the database driver, so it is left out of importing
+    the app and done by the process that serves requests.
+    """
+    if not _engines:
+        with _engine_lock:
+            if not _engines:
+                engines = []
+                for url in [
+                    settings.SQLALCHEMY_DATABASE_URI,
+                    *settings.DATABASE_SHARD_URLS,
+                ]:
+                    engine = _create_engine(url)
+                    cancellation.install(engine)
+                    tracing.install(engine)
+                    event.listen(engine, "checkout", pool_usage.checkout)
+                    event.listen(engine, "checkin", pool_usage.checkin)
+                    engines.append(engine)
+                _engines.extend(engines)
+    return _engines
+
+
+def get_engine(shard: int = 0) -> Engine:
+    """Return the engine of a shard, the main database by default."""
+    return get_engines()[shard]
+
+
+def get_user_engine(user_id: uuid.UUID) -> Engine:
+    """Return the engine of the shard holding a user and their expenses."""
+    return get_engine(shards.for_user(user_id))
+
+
+def fan_out(read: Callable[..., T]) -> list[T]:
+    """Call ``read(session=...)`` on every shard in parallel.
+
+    Returns the results in shard order. Each call runs in a copy of the
+    caller's context, so its queries are traced and cancelled with the
+    request's.
+    """
+    global _fan_out_pool
+    if _fan_out_pool is None:
+        with _engine_lock:
+            if _fan_out_pool is None:
+                _fan_out_pool = ThreadPoolExecutor(thread_name_prefix="fan-out")
+
+    def run(engine: Engine) -> T:
+        with Session(engine) as session:
+            return read(session=session)
+
+    futures = [
+        _fan_out_pool.submit(contextvars.copy_context().run, run, engine)
+        for engine in get_engines()
+    ]
+    return [future.result() for future in futures]
 
-def init_db(session: Session) -> None:
-    SQLModel.metadata.create_all(engine)
 
-    user = session.exec(
-        select(User).where(User.email == settings.ROOT_USER_EMAIL)
-    ).first()
-    if not user:
-        user_create = UserCreate(
-            email=settings.ROOT_USER_EMAIL,
-            password=settings.ROOT_USER_PASSWORD,
-            is_superuser=True,
-            is_root=True,
+def _configure_sqlite(dbapi_connection: Any, record: ConnectionPoolEntry) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def _create_engine(url: str) -> Engine:
+    if make_url(url).get_backend_name() == "sqlite":
+        # Pooled connections are used by one thread at a time, but not
+        # always the thread that opened them
+        engine = create_engine(
+            url,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            connect_args={"check_same_thread": False},
         )
-        user_crud.create(session=session, user_create=user_create)
+        event.listen(engine, "connect", _configure_sqlite)
+        return engine
+    options = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+    execution_options = {}
+    if schema := settings.POSTGRES_SCHEMA:
+        # Tables are qualified with the schema, so that tables of the same
+        # name in public are never mistaken for them. The search path is
+        # for textual SQL, and for the extensions installed in public.
+        options += f" -c search_path={schema},public"
+        execution_options["schema_translate_map"] = {None: schema}
+    return create_engine(
+        url,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        connect_args={"options": options},
+        execution_options=execution_options,
+    )
+
+
+def dispose_engine() -> None:
+    for engine in _engines:
+        engine.dispose()
+
+
+def _reset_pool_after_fork() -> None:
+    # A forked child must open its own connections rather than share the
+    # parent's sockets. Don't close them, they still belong to the parent.
+    global _fan_out_pool
+    for engine in _engines:
+        engine.dispose(close=False)
+    # Its threads didn't survive the fork
+    _fan_out_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def warm_up_pool(connections: int) -> None:
+    """Open up to ``connections`` pooled connections per shard ahead of traffic."""
+    opened = [
+        engine.connect()
+        for engine in get_engines()
+        for _ in range(min(connections, settings.DB_POOL_SIZE))
+    ]
+    for connection in opened:
+        connection.close()
+
+
+EXTENSIONS = ["pg_trgm"]
+# Arbitrary key of the advisory lock held while creating them
+EXTENSIONS_LOCK = 7_310_592
+
+CATEGORY_LABELS = ", ".join(f"'{category.name}'" for category in ExpenseCategory)
+
+# `create_all` only creates missing tables, so columns added to existing tables
+# are declared here. Every statement must be idempotent. SQLite databases
+# postdate them, so they only run on Postgres.
+MIGRATIONS = [
+    "ALTER TABLE expense ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS ({SEARCH_VECTOR_EXPRESSION}) STORED",
+    # Superseded by the composite indexes leading with owner_id
+    "DROP INDEX IF EXISTS ix_expense_owner_id",
+    # Convert a category column created as varchar to the native enum
+    f"""
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_type WHERE typname = '{CATEGORY_TYPE.name}')
+        THEN
+            CREATE TYPE {CATEGORY_TYPE.name} AS ENUM ({CATEGORY_LABELS});
+        END IF;
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+                AND table_name = 'expense' AND column_name = 'category'
+                AND data_type = 'character varying'
+        ) THEN
+            ALTER TABLE expense ALTER COLUMN category TYPE {CATEGORY_TYPE.name}
+                USING upper(category)::{CATEGORY_TYPE.name};
+        END IF;
+    END $$
+    """,
+]
+
+
+def migrate_db() -> None:
+    for engine in get_engines():
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                for statement in MIGRATIONS:
+                    connection.execute(text(statement))
+            for table in SQLModel.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+
+def _create_schema(engine: Engine) -> None:
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            # Apps starting together on one database would race to create
+            # the extensions, which are shared by all schemas
+            connection.execute(text(f"SELECT pg_advisory_xact_lock({EXTENSIONS_LOCK})"))
+            for extension in EXTENSIONS:
+                connection.execute(
+                    text(f"CREATE EXTENSION IF NOT EXISTS {extension} SCHEMA public")
+                )
+            if settings.POSTGRES_SCHEMA:
+                connection.execute(
+                    text(f"CREATE SCHEMA IF NOT EXISTS {settings.POSTGRES_SCHEMA}")
+                )
+    SQLModel.metadata.create_all(engine)
+
+
+def init_db() -> None:
+    for engine in get_engines():
+        _create_schema(engine)
+    migrate_db()
+
+    shard = shards.for_email(settings.ROOT_USER_EMAIL)
+    with Session(get_engine(shard)) as session:
+        user = session.exec(
+            select(User).where(User.email == settings.ROOT_USER_EMAIL)
+        ).first()
+        if not user:
+            user_create = UserCreate(
+                email=settings.ROOT_USER_EMAIL,
+                password=settings.ROOT_USER_PASSWORD,
+                is_superuser=True,
+                is_root=True,
+            )
+            user_crud.create(session=session, user_create=user_create)
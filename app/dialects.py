@@ -0,0 +1,25 @@
+import sqlite3
+from typing import Any
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+UNIQUE_VIOLATION = "23505"
+
+
+def is_sqlite(session: Session) -> bool:
+    return session.get_bind().dialect.name == "sqlite"
+
+
+def insert(session: Session, table: Any) -> postgresql.Insert | sqlite.Insert:
+    """Start an INSERT supporting ``ON CONFLICT`` in the session's dialect."""
+    if is_sqlite(session):
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def is_unique_violation(error: IntegrityError) -> bool:
+    if isinstance(error.orig, sqlite3.IntegrityError):
+        return str(error.orig).startswith("UNIQUE")
+    return getattr(error.orig, "sqlstate", None) == UNIQUE_VIOLATION
@@ -27,3 +27,15 @@ class TimePeriod(str, Enum):
 
     def get_days(self) -> int:
         return self._days
+
+
+class PurgeStatus(str, Enum):
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class LookupStatus(str, Enum):
+    FOUND = "found"
+    FORBIDDEN = "forbidden"
+    MISSING = "missing"
@@ -0,0 +1,135 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from sqlmodel import Session
+
+from app import shards
+from app.config import settings
+from app.cruds import expense_crud
+from app.db import get_engine
+from app.models import Expense, ExpenseCreate
+
+logger = logging.getLogger(__name__)
+
+_Pending = tuple[Expense, "Future[Expense]"]
+
+
+class ExpenseBatcher:
+    """Group concurrent expense creations into a single commit.
+
+    Rows are buffered until ``max_size`` rows are waiting or ``max_delay``
+    seconds have passed since the first one, then written with one
+    multi-row INSERT. Each caller waits until the batch holding its row is
+    committed, so a response is only sent for stored expenses.
+
+    Async callers should await ``enqueue``: a caller blocking a worker
+    thread in ``submit`` caps batches at the size of the threadpool.
+    """
+
+    def __init__(
+        self, *, max_size: int, max_delay: float, synchronous_commit: bool = True
+    ) -> None:
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.synchronous_commit = synchronous_commit
+        self._queue: queue.Queue[_Pending | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, expense_in: ExpenseCreate, owner_id: uuid.UUID) -> Expense:
+        return self.enqueue(expense_in, owner_id).result()
+
+    def enqueue(
+        self, expense_in: ExpenseCreate, owner_id: uuid.UUID
+    ) -> "Future[Expense]":
+        """Buffer an expense, returning a future set once it is stored."""
+        expense = Expense.model_validate(expense_in, update={"owner_id": owner_id})
+        future: Future[Expense] = Future()
+        self._start()
+        self._queue.put((expense, future))
+        return future
+
+    def stop(self) -> None:
+        """Flush the buffered rows and stop the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="expense-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch: list[_Pending]) -> None:
+        # One INSERT per shard, each owner's rows go to the shard holding them
+        by_shard: dict[int, list[_Pending]] = {}
+        for pending in batch:
+            by_shard.setdefault(shards.for_user(pending[0].owner_id), []).append(
+                pending
+            )
+        for shard, pending_rows in by_shard.items():
+            self._flush_shard(shard, pending_rows)
+
+    def _flush_shard(self, shard: int, batch: list[_Pending]) -> None:
+        with Session(get_engine(shard)) as session:
+            try:
+                created = expense_crud.create_many(
+                    session=session,
+                    expenses=[expense for expense, _ in batch],
+                    synchronous_commit=self.synchronous_commit,
+                )
+            except Exception:
+                session.rollback()
+                logger.warning("Batch insert failed, retrying rows one by one")
+                # Isolate the failing rows so they don't fail the whole batch
+                for expense, future in batch:
+                    try:
+                        future.set_result(
+                            expense_crud.create_many(
+                                session=session,
+                                expenses=[expense],
+                                synchronous_commit=self.synchronous_commit,
+                            )[0]
+                        )
+                    except Exception as e:
+                        session.rollback()
+                        future.set_exception(e)
+                return
+        for (_, future), expense in zip(batch, created, strict=True):
+            future.set_result(expense)
+
+
+expense_batcher = ExpenseBatcher(
+    max_size=settings.EXPENSE_BATCH_MAX_SIZE,
+    max_delay=settings.EXPENSE_BATCH_MAX_DELAY_MS / 1000,
+    synchronous_commit=settings.EXPENSE_BATCH_SYNCHRONOUS_COMMIT,
+)
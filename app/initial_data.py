@@ -1,11 +1,8 @@
-from sqlmodel import Session
-
-from app.db import engine, init_db
+from app.db import init_db
 
 
 def main() -> None:
-    with Session(engine) as session:
-        init_db(session)
+    init_db()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,44 @@
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from sqlalchemy.exc import OperationalError
 
+from app.api.disconnect import CancelOnDisconnectMiddleware, query_canceled_handler
+from app.api.loopmonitor import LoopMonitorMiddleware, loop_monitor
 from app.api.main import api_router
+from app.api.profiling import ProfileMiddleware
+from app.api.tracing import TracingMiddleware
 from app.config import settings
+from app.db import dispose_engine, warm_up_pool
+from app.ingest import expense_batcher
+from app.security import load_password_hasher
+from app.tracing import trace_processor
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    load_password_hasher()
+    warm_up_pool(settings.DB_POOL_WARMUP)
+    yield
+    if loop_monitor.running:
+        await loop_monitor.stop()
+    expense_batcher.stop()
+    trace_processor.flush()
+    dispose_engine()
+
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
 )
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(LoopMonitorMiddleware)
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfileMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_exception_handler(OperationalError, query_canceled_handler)
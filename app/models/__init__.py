@@ -1,42 +1,80 @@
+from .cache import CacheVersion
 from .expenses import (
     Expense,
+    ExpenseBatchGet,
+    ExpenseChanges,
     ExpenseCreate,
     ExpenseFilter,
+    ExpenseLookup,
+    ExpenseLookups,
     ExpensePublic,
     ExpensesPublic,
+    ExpenseTombstone,
     ExpenseUpdate,
 )
+from .idempotency import IdempotencyKey
+from .ratelimit import RateLimitBucket
 from .users import (
     User,
     UserCreate,
+    UserEmail,
     UserPublic,
+    UserPurge,
+    UserPurgePublic,
     UserRegister,
     UsersPublic,
     UserUpdateMe,
     UserUpdateStatus,
 )
 from .utils import (
+    CacheStats,
+    LagBucket,
+    LoopBlock,
+    LoopStats,
     Message,
+    PoolStats,
+    QueryStats,
+    RateLimitStats,
+    SingleFlightStats,
     Token,
     TokenPayload,
     UpdatePassword,
 )
 
 __all__ = [
+    "CacheStats",
+    "CacheVersion",
     "Expense",
+    "ExpenseBatchGet",
+    "ExpenseChanges",
     "ExpenseCreate",
     "ExpenseFilter",
+    "ExpenseLookup",
+    "ExpenseLookups",
     "ExpensePublic",
     "ExpensesPublic",
+    "ExpenseTombstone",
     "ExpenseUpdate",
+    "IdempotencyKey",
+    "RateLimitBucket",
     "User",
     "UserCreate",
+    "UserEmail",
     "UserPublic",
+    "UserPurge",
+    "UserPurgePublic",
     "UserRegister",
     "UsersPublic",
     "UserUpdateMe",
     "UserUpdateStatus",
+    "LagBucket",
+    "LoopBlock",
+    "LoopStats",
     "Message",
+    "PoolStats",
+    "QueryStats",
+    "RateLimitStats",
+    "SingleFlightStats",
     "Token",
     "TokenPayload",
     "UpdatePassword",
@@ -0,0 +1,8 @@
+from sqlmodel import Field, SQLModel
+
+
+class CacheVersion(SQLModel, table=True):
+    __tablename__ = "cache_version"
+
+    namespace: str = Field(primary_key=True, max_length=255)
+    version: int = 0
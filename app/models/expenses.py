@@ -1,11 +1,45 @@
 import uuid
 from datetime import datetime
-from typing import Literal
-
+from functools import lru_cache
+from typing import Annotated, Any, Literal
+
+from pydantic import AfterValidator, BaseModel, BeforeValidator, create_model
+from sqlalchemy import Column, Computed, Enum, Index, Text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.compiler import SQLCompiler
+from sqlalchemy.sql.expression import ColumnElement
 from sqlmodel import Field, Relationship, SQLModel
 
-from app.enums import ExpenseCategory, TimePeriod
+from app.config import settings
+from app.enums import ExpenseCategory, LookupStatus, TimePeriod
 from app.models.users import User
+from app.utils import uuid7
+
+SEARCH_CONFIG = "simple"
+SEARCH_VECTOR_EXPRESSION = (
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')"
+)
+
+
+class SearchVectorExpression(ColumnElement[str]):
+    """The expression generating ``Expense.search_vector`` in each dialect."""
+
+    inherit_cache = True
+
+
+@compiles(SearchVectorExpression)
+def _compile_search_vector(element: Any, compiler: SQLCompiler, **kw: Any) -> str:
+    return SEARCH_VECTOR_EXPRESSION
+
+
+@compiles(SearchVectorExpression, "sqlite")
+def _compile_search_vector_sqlite(
+    element: Any, compiler: SQLCompiler, **kw: Any
+) -> str:
+    # Without tsvector, searches match substrings of this lowercased text
+    return "lower(title || ' ' || coalesce(description, ''))"
 
 
 class ExpenseBase(SQLModel):
@@ -38,28 +72,163 @@ class ExpensesPublic(SQLModel):
     count: int
 
 
+ExpenseField = Literal[
+    "id",
+    "title",
+    "description",
+    "amount",
+    "category",
+    "owner_id",
+    "created_at",
+    "updated_at",
+]
+
+
+def _split_fields(value: Any) -> Any:
+    # Accept both `fields=title,amount` and repeated `fields=` parameters
+    if isinstance(value, str):
+        value = [value]
+    if isinstance(value, list):
+        return [name.strip() for item in value for name in str(item).split(",")]
+    return value
+
+
+def _order_fields(value: list[str] | None) -> list[str] | None:
+    if value is None:
+        return None
+    return [name for name in ExpensePublic.model_fields if name in value]
+
+
+ExpenseFields = Annotated[
+    list[ExpenseField] | None,
+    BeforeValidator(_split_fields),
+    AfterValidator(_order_fields),
+]
+
+
+@lru_cache
+def partial_expense_models(
+    fields: tuple[str, ...],
+) -> tuple[type[BaseModel], type[BaseModel]]:
+    """Return models for an expense and a page with only ``fields``."""
+    expense_model = create_model(  # type: ignore[call-overload]
+        "ExpensePartial",
+        **{name: (ExpensePublic.model_fields[name].annotation, ...) for name in fields},
+    )
+    page_model = create_model(
+        "ExpensesPartial",
+        data=(list[expense_model], ...),  # type: ignore[valid-type]
+        count=(int, ...),
+    )
+    return expense_model, page_model
+
+
+class ExpenseBatchGet(SQLModel):
+    ids: list[uuid.UUID] = Field(min_length=1, max_length=500)
+
+
+class ExpenseLookup(SQLModel):
+    id: uuid.UUID
+    status: LookupStatus
+    expense: ExpensePublic | None = None
+
+
+class ExpenseLookups(SQLModel):
+    data: list[ExpenseLookup]
+
+
+class ExpenseChanges(SQLModel):
+    data: list[ExpensePublic]
+    deleted: list[uuid.UUID]
+    next_token: str
+    has_more: bool
+
+
+CATEGORY_TYPE = Enum(ExpenseCategory, name="expensecategory")
+
+
 class Expense(ExpenseBase, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    __table_args__ = (
+        # Cover the common list filters so counts are answered by index-only scans
+        Index(
+            "ix_expense_owner_id_created_at",
+            "owner_id",
+            "created_at",
+            postgresql_include=["category", "amount", "updated_at"],
+        ),
+        Index(
+            "ix_expense_owner_id_updated_at",
+            "owner_id",
+            "updated_at",
+            postgresql_include=["category", "amount", "created_at"],
+        ),
+        Index(
+            "ix_expense_search_vector", "search_vector", postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_expense_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_expense_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid7, primary_key=True)
+    # Stored as a native enum (4 bytes) rather than the value strings
+    category: ExpenseCategory = Field(sa_type=CATEGORY_TYPE)  # type: ignore[call-overload]
     created_at: datetime = Field(default_factory=datetime.now, index=True)
     updated_at: datetime = Field(
         default_factory=lambda data: data["created_at"],  # type: ignore
         index=True,
     )
     owner_id: uuid.UUID = Field(
-        foreign_key="user.id", nullable=False, index=True, ondelete="CASCADE"
+        foreign_key="user.id", nullable=False, ondelete="CASCADE"
     )
     owner: User = Relationship(back_populates="expenses")
+    search_vector: str | None = Field(
+        default=None,
+        sa_column=Column(
+            Text().with_variant(TSVECTOR, "postgresql"),
+            Computed(SearchVectorExpression(), persisted=True),
+        ),
+        exclude=True,
+    )
+
+
+class ExpenseTombstone(SQLModel, table=True):
+    __tablename__ = "expense_tombstone"
+    __table_args__ = (
+        Index("ix_expense_tombstone_owner_id_deleted_at", "owner_id", "deleted_at"),
+    )
+
+    # Records deleted expenses so that the change feed can report them
+    id: uuid.UUID = Field(primary_key=True)
+    owner_id: uuid.UUID = Field(
+        foreign_key="user.id", nullable=False, ondelete="CASCADE"
+    )
+    deleted_at: datetime = Field(default_factory=datetime.now, index=True)
 
 
 class ExpenseFilter(SQLModel):
-    skip: int = 0
-    limit: int = 100
+    skip: int = Field(default=0, ge=0)
+    limit: int = Field(default=100, gt=0, le=settings.EXPENSES_MAX_PAGE_SIZE)
     period: TimePeriod | None = None
     n_periods: int | None = Field(default=None, gt=0)
     start_date: datetime | None = None
     end_date: datetime | None = None
-    order_by: Literal["amount", "created_at", "updated_at"] = "created_at"
+    updated_since: datetime | None = None
+    min_amount: float | None = Field(default=None, ge=0)
+    max_amount: float | None = Field(default=None, ge=0)
+    q: str | None = Field(default=None, min_length=1, max_length=255)
+    order_by: Literal["amount", "created_at", "updated_at", "relevance"] = "created_at"
     sort_order: Literal["asc", "desc"] = "asc"
     categories: list[ExpenseCategory] = Field(
         default_factory=lambda: list(ExpenseCategory)
     )
+    fields: ExpenseFields = None
@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import JSON, Column
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Field, SQLModel
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __tablename__ = "idempotency_key"
+
+    # SHA-256 digests keep the rows small whatever the client sends as a key
+    key_hash: bytes = Field(primary_key=True)
+    request_hash: bytes
+    status_code: int | None = None
+    response: dict[str, Any] | None = Field(
+        default=None, sa_column=Column(JSON().with_variant(JSONB, "postgresql"))
+    )
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
@@ -1,9 +1,13 @@
 import uuid
+from datetime import datetime
 from typing import TYPE_CHECKING
 
 from pydantic import EmailStr
 from sqlmodel import Field, Relationship, SQLModel
 
+from app.enums import PurgeStatus
+from app.utils import uuid7
+
 if TYPE_CHECKING:
     from .expenses import Expense
 
@@ -44,8 +48,42 @@ class UserUpdateMe(SQLModel):
 
 
 class User(BaseUser, table=True):
-    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    id: uuid.UUID = Field(default_factory=uuid7, primary_key=True)
     hashed_password: str
+    # Let the ON DELETE CASCADE foreign key remove expenses instead of
+    # loading every one of them into the session first
     expenses: list["Expense"] = Relationship(
-        back_populates="owner", cascade_delete=True
+        back_populates="owner", cascade_delete=True, passive_deletes=True
     )
+
+
+class UserPurgeBase(SQLModel):
+    status: PurgeStatus = PurgeStatus.RUNNING
+    total_expenses: int
+    deleted_expenses: int = 0
+    started_at: datetime = Field(default_factory=datetime.now)
+    finished_at: datetime | None = None
+
+
+class UserPurgePublic(UserPurgeBase):
+    user_id: uuid.UUID
+
+
+class UserPurge(UserPurgeBase, table=True):
+    # Not a foreign key: the record outlives the purged user
+    user_id: uuid.UUID = Field(primary_key=True)
+
+
+class UserEmail(SQLModel, table=True):
+    """The user each email is reserved for, across all shards.
+
+    Kept on the main database when users are sharded, where the unique
+    index of each shard's user table only covers that shard.
+    """
+
+    __tablename__ = "user_email"
+
+    email: str = Field(primary_key=True, max_length=255)
+    # Not a foreign key: the user may live on another shard
+    user_id: uuid.UUID
+    claimed_at: datetime = Field(default_factory=datetime.now)
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, Field
 
 
@@ -13,7 +15,63 @@ class TokenPayload(BaseModel):
 class Message(BaseModel):
     message: str
 
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    entries: int
+    size_bytes: int
+
+
+class SingleFlightStats(BaseModel):
+    executions: int
+    shared: int
+    in_flight: int
+
+
+class QueryStats(BaseModel):
+    cancelled: int
+    timed_out: int
+
+
+class PoolStats(BaseModel):
+    size: int
+    checked_out: int
+    checkouts: int
+    mean_held_ms: float
+    max_held_ms: float
+
+
+class RateLimitStats(BaseModel):
+    allowed: int
+    limited: int
+    keys: int
+
+
+class LagBucket(BaseModel):
+    # Upper bound of the bucket, unbounded for the last one
+    le_ms: float | None
+    count: int
+
+
+class LoopBlock(BaseModel):
+    # The route whose handler was running on the loop, if any
+    route: str | None
+    started_at: datetime
+    duration_ms: float
+    stack: str | None
+
+
+class LoopStats(BaseModel):
+    running: bool
+    samples: int
+    max_lag_ms: float
+    lag_histogram: list[LagBucket]
+    blocked: list[LoopBlock]
+
+
 class UpdatePassword(BaseModel):
     current_password: str = Field(min_length=8, max_length=40)
     new_password: str = Field(min_length=8, max_length=40)
-
@@ -5,6 +5,7 @@ import jwt
 from passlib.context import CryptContext
 
 from app.config import settings
+from app.tracing import span
 
 ALGORITHM = "HS256"
 
@@ -12,6 +13,11 @@ ALGORITHM = "HS256"
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+def load_password_hasher() -> None:
+    # The bcrypt backend is loaded on first use, so load it before traffic
+    pwd_context.handler().get_backend()
+
+
 def create_access_token(subject: Any, expires_delta: timedelta) -> str:
     expire = datetime.now(UTC) + expires_delta
     to_encode = {"sub": str(subject), "exp": expire}
@@ -19,9 +25,19 @@ def create_access_token(subject: Any, expires_delta: timedelta) -> str:
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> dict[str, Any]:
+    with span("security.decode_access_token"):
+        payload: dict[str, Any] = jwt.decode(
+            token, key=settings.SECRET_KEY, algorithms=[ALGORITHM]
+        )
+        return payload
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    with span("security.verify_password"):
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    with span("security.get_password_hash"):
+        return pwd_context.hash(password)
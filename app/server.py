@@ -0,0 +1,58 @@
+import os
+
+import uvicorn
+
+from app.config import settings
+
+
+def worker_count() -> int:
+    if settings.WEB_WORKERS:
+        return settings.WEB_WORKERS
+    # Only the CPUs this process may run on, e.g. within a container's cpuset
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Keeps its versions in process memory, so a worker never sees another's writes
+MEMORY_CACHE_BACKEND = "app.cache.MemoryBackend"
+
+
+def check_config(workers: int) -> None:
+    """Refuse settings that would serve stale data with several workers."""
+    if (
+        workers > 1
+        and settings.RESPONSE_CACHE_ENABLED
+        and settings.RESPONSE_CACHE_BACKEND == MEMORY_CACHE_BACKEND
+    ):
+        raise SystemExit(
+            "RESPONSE_CACHE_BACKEND must be shared between workers, such as "
+            "app.cache.DatabaseBackend, when serving with more than one"
+        )
+
+
+def main() -> None:
+    """Serve the API with one worker process per CPU.
+
+    Workers import the app after they start, so each one creates its own
+    engine and connection pool. On SIGTERM they stop accepting connections
+    and finish in-flight requests for up to WEB_GRACEFUL_SHUTDOWN_SECONDS
+    before running the app's shutdown.
+    """
+    # Workers must agree on the key signing access tokens, so a generated
+    # one is shared with them rather than generated again by each
+    os.environ.setdefault("SECRET_KEY", settings.SECRET_KEY)
+    workers = worker_count()
+    check_config(workers)
+    uvicorn.run(
+        "app.main:app",
+        host=settings.WEB_HOST,
+        port=settings.WEB_PORT,
+        workers=workers,
+        timeout_graceful_shutdown=settings.WEB_GRACEFUL_SHUTDOWN_SECONDS,
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Placement of users on the database shards.
+
+A user and everything they own live on the shard picked by hashing their
+id. New users get an id that hashes to the same shard as their email, so
+two signups with one email meet the same unique index.
+"""
+
+import hashlib
+import heapq
+import itertools
+import uuid
+from collections.abc import Callable, Sequence
+from typing import Any, TypeVar
+
+from app.config import settings
+from app.utils import uuid7
+
+T = TypeVar("T")
+
+
+def count() -> int:
+    return 1 + len(settings.DATABASE_SHARD_URLS)
+
+
+def _shard(key: bytes) -> int:
+    # Stable across processes and releases, unlike hash()
+    digest = hashlib.blake2b(key, digest_size=8).digest()
+    return int.from_bytes(digest) % count()
+
+
+def for_user(user_id: uuid.UUID) -> int:
+    return _shard(user_id.bytes)
+
+
+def for_email(email: str) -> int:
+    return _shard(email.encode())
+
+
+def new_user_id(email: str) -> uuid.UUID:
+    """Generate a user id that lives on the same shard as ``email``."""
+    shard = for_email(email)
+    while True:
+        # Takes ``count()`` tries on average
+        user_id = uuid7()
+        if for_user(user_id) == shard:
+            return user_id
+
+
+def merge_pages(
+    pages: Sequence[tuple[Sequence[T], int]],
+    *,
+    key: Callable[[T], Any],
+    skip: int,
+    limit: int,
+    reverse: bool = False,
+) -> tuple[list[T], int]:
+    """Merge pages read from every shard into one page and total count.
+
+    Each shard's page must be sorted by ``key`` and hold its first
+    ``skip + limit`` rows.
+    """
+    rows = heapq.merge(*(rows for rows, _ in pages), key=key, reverse=reverse)
+    page = list(itertools.islice(rows, skip, skip + limit))
+    return page, sum(total for _, total in pages)
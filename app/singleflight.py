@@ -0,0 +1,73 @@
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, TypeVar, cast
+
+from app.cancellation import QueryCanceller, current_canceller
+from app.models import SingleFlightStats
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call:
+    # Cancels the leader's queries when its client disconnects
+    canceller: QueryCanceller | None
+    future: Future[Any] = field(default_factory=Future)
+
+
+class SingleFlight:
+    """Share one execution between concurrent calls with the same key.
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for it and get the same result or exception. Once it
+    finishes, the next call with that key runs the function again, so
+    results are never reused after the fact.
+
+    A failure caused by the leader's client disconnecting isn't shared:
+    the waiting callers start a new execution instead.
+    """
+
+    def __init__(self) -> None:
+        self.executions = 0
+        self.shared = 0
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call(current_canceller.get())
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            try:
+                return cast(T, call.future.result())
+            except Exception:
+                if call.canceller is None or not call.canceller.cancelled:
+                    raise
+            return self.do(key, fn)
+
+        try:
+            call.future.set_result(fn())
+        except BaseException as exc:
+            call.future.set_exception(exc)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return cast(T, call.future.result())
+
+    def stats(self) -> SingleFlightStats:
+        with self._lock:
+            return SingleFlightStats(
+                executions=self.executions,
+                shared=self.shared,
+                in_flight=len(self._calls),
+            )
+
+
+expense_flights = SingleFlight()
@@ -0,0 +1,52 @@
+import logging
+import time
+import uuid
+from datetime import datetime
+
+from sqlmodel import Session
+
+from app.config import settings
+from app.cruds import expense_crud, user_crud
+from app.db import get_user_engine
+from app.enums import PurgeStatus
+from app.models import User, UserPurge
+
+logger = logging.getLogger(__name__)
+
+
+def purge_user(
+    user_id: uuid.UUID,
+    *,
+    batch_size: int = settings.USER_PURGE_BATCH_SIZE,
+    delay: float = settings.USER_PURGE_BATCH_DELAY_SECONDS,
+) -> None:
+    """Delete a user's expenses in throttled batches, then the user.
+
+    Each batch is its own short transaction, so a huge account never holds
+    locks or a connection for long, and progress is saved on the user's
+    ``UserPurge`` record after every batch.
+    """
+    with Session(get_user_engine(user_id)) as session:
+        purge = session.get(UserPurge, user_id)
+        if not purge or purge.status == PurgeStatus.DONE:
+            return
+        try:
+            while deleted := expense_crud.delete_batch_by_owner(
+                session=session, owner_id=user_id, batch_size=batch_size
+            ):
+                purge.deleted_expenses += deleted
+                session.add(purge)
+                session.commit()
+                time.sleep(delay)
+
+            user = session.get(User, user_id)
+            if user:
+                user_crud.delete(session=session, user_in=user)
+            purge.status = PurgeStatus.DONE
+        except Exception:
+            logger.exception("Failed to purge user %s", user_id)
+            session.rollback()
+            purge.status = PurgeStatus.FAILED
+        purge.finished_at = datetime.now()
+        session.add(purge)
+        session.commit()
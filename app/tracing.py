@@ -0,0 +1,324 @@
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Protocol, TypeVar, cast
+
+import httpx
+from sqlalchemy import Engine, event
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Attribute values are kept to the types every exporter can represent
+AttributeValue = str | int | float | bool
+
+
+class Span:
+    """A timed operation within a trace, with times in Unix nanoseconds."""
+
+    __slots__ = (
+        "trace",
+        "name",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        trace: "Trace",
+        name: str,
+        parent_id: str | None,
+        attributes: dict[str, AttributeValue],
+    ) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error = False
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1_000_000
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+        self.trace.spans.append(self)
+
+
+class Trace:
+    """The spans of one request, exported together once the root ends."""
+
+    def __init__(self) -> None:
+        self.trace_id = os.urandom(16).hex()
+        # Appended to from whichever thread a span ends in
+        self.spans: list[Span] = []
+
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+def start_span(
+    name: str, parent: Span | None = None, **attributes: AttributeValue
+) -> Span:
+    """Start a span under ``parent``, or as the root of a new trace."""
+    if parent is None:
+        return Span(Trace(), name, None, attributes)
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes: AttributeValue) -> Iterator[Span | None]:
+    """Time the block as a child of the current span.
+
+    Outside a trace this does nothing, so instrumented code costs a
+    context variable lookup when tracing is off.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = start_span(name, parent, **attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException:
+        child.error = True
+        raise
+    finally:
+        current_span.reset(token)
+        child.end()
+
+
+def traced(fn: F) -> F:
+    """Trace each call of ``fn`` as a span named after its module."""
+    name = f"{fn.__module__.rpartition('.')[2]}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if current_span.get() is None:
+            return fn(*args, **kwargs)
+        with span(name):
+            return fn(*args, **kwargs)
+
+    return cast(F, wrapper)
+
+
+def format_trace(spans: list[Span]) -> str:
+    """Render spans as an indented tree with their durations."""
+    children: dict[str | None, list[Span]] = {}
+    for s in sorted(spans, key=lambda s: s.start_ns):
+        children.setdefault(s.parent_id, []).append(s)
+    span_ids = {s.span_id for s in spans}
+    lines = []
+
+    def walk(s: Span, depth: int) -> None:
+        attributes = " ".join(f"{k}={v}" for k, v in s.attributes.items())
+        error = " ERROR" if s.error else ""
+        lines.append(
+            f"{'  ' * depth}{s.name} {s.duration_ms:.2f} ms{error} {attributes}"
+        )
+        for child in children.get(s.span_id, []):
+            walk(child, depth + 1)
+
+    for s in spans:
+        if s.parent_id is None or s.parent_id not in span_ids:
+            walk(s, 0)
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def otlp_payload(spans: list[Span]) -> dict[str, Any]:
+    """Encode spans as an OTLP/HTTP JSON export request."""
+
+    def value(v: AttributeValue) -> dict[str, Any]:
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": v}
+
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": settings.PROJECT_NAME},
+                        }
+                    ]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": __name__},
+                        "spans": [
+                            {
+                                "traceId": s.trace.trace_id,
+                                "spanId": s.span_id,
+                                "parentSpanId": s.parent_id or "",
+                                "name": s.name,
+                                # SPAN_KIND_SERVER for roots, INTERNAL otherwise
+                                "kind": 2 if s.parent_id is None else 1,
+                                "startTimeUnixNano": str(s.start_ns),
+                                "endTimeUnixNano": str(s.end_ns),
+                                "attributes": [
+                                    {"key": k, "value": value(v)}
+                                    for k, v in s.attributes.items()
+                                ],
+                                # STATUS_CODE_ERROR or STATUS_CODE_UNSET
+                                "status": {"code": 2 if s.error else 0},
+                            }
+                            for s in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+class SpanExporter(Protocol):
+    def export(self, spans: list[Span]) -> None: ...
+
+
+class ConsoleExporter:
+    def export(self, spans: list[Span]) -> None:
+        logger.info("Trace %s\n%s", spans[0].trace.trace_id, format_trace(spans))
+
+
+class FileExporter:
+    """Append each trace to a file as a line of OTLP JSON."""
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+
+    def export(self, spans: list[Span]) -> None:
+        with self.path.open("a") as f:
+            f.write(json.dumps(otlp_payload(spans)) + "\n")
+
+
+class OTLPExporter:
+    """Send traces to an OTLP/HTTP collector as JSON."""
+
+    def __init__(self, endpoint: str) -> None:
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=5)
+
+    def export(self, spans: list[Span]) -> None:
+        self._client.post(self.endpoint, json=otlp_payload(spans)).raise_for_status()
+
+
+def load_exporter(name: str) -> SpanExporter:
+    if name == "file":
+        return FileExporter(settings.TRACING_FILE)
+    if name == "otlp":
+        return OTLPExporter(settings.TRACING_OTLP_ENDPOINT)
+    return ConsoleExporter()
+
+
+class TraceProcessor:
+    """Export finished traces from a background thread.
+
+    Requests only enqueue their spans. If the exporter falls behind, traces
+    beyond ``max_queue`` are dropped rather than held in memory.
+    """
+
+    def __init__(self, max_queue: int = 1_000) -> None:
+        self.dropped = 0
+        self._queue: queue.Queue[list[Span] | None] = queue.Queue(max_queue)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, spans: list[Span]) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="trace-exporter", daemon=True
+                    )
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """Wait until every submitted trace has been exported."""
+        self._queue.join()
+
+    def _run(self) -> None:
+        exporter = load_exporter(settings.TRACING_EXPORTER)
+        while True:
+            spans = self._queue.get()
+            try:
+                if spans:
+                    exporter.export(spans)
+            except Exception:
+                logger.exception("Failed to export trace")
+            finally:
+                self._queue.task_done()
+
+
+trace_processor = TraceProcessor()
+
+
+def _before_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    if (parent := current_span.get()) is None:
+        return
+    # Statements are logged without their parameters, which may hold secrets
+    statement_span = start_span("db.statement", parent, statement=statement[:500])
+    conn.info.setdefault("tracing_spans", []).append(statement_span)
+
+
+def _after_cursor_execute(
+    conn: Any,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    if spans := conn.info.get("tracing_spans"):
+        statement_span = spans.pop()
+        statement_span.attributes["rows"] = cursor.rowcount
+        statement_span.end()
+
+
+def _handle_error(exception_context: Any) -> None:
+    connection = exception_context.connection
+    if connection is not None and (spans := connection.info.get("tracing_spans")):
+        statement_span = spans.pop()
+        statement_span.error = True
+        statement_span.end()
+
+
+def install(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+import uuid
+
+_uuid7_lock = threading.Lock()
+_uuid7_last_timestamp = 0
+_uuid7_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """Generate a time-ordered UUID (RFC 9562, version 7).
+
+    The first 48 bits hold the Unix timestamp in milliseconds and the 12-bit
+    ``rand_a`` field is used as a counter, so ids created by this process are
+    strictly increasing even within the same millisecond. New rows therefore
+    land on the right-most page of the primary key index instead of being
+    scattered across it like ``uuid4`` keys.
+    """
+    global _uuid7_last_timestamp, _uuid7_counter
+
+    timestamp = time.time_ns() // 1_000_000
+    with _uuid7_lock:
+        if timestamp > _uuid7_last_timestamp:
+            # Seed the counter randomly, leaving room for increments
+            _uuid7_counter = int.from_bytes(os.urandom(2)) & 0x7FF
+            _uuid7_last_timestamp = timestamp
+        else:
+            _uuid7_counter += 1
+            if _uuid7_counter > 0xFFF:
+                # Counter overflow (or clock moved backwards), borrow the next ms
+                _uuid7_last_timestamp += 1
+                _uuid7_counter = 0
+            timestamp = _uuid7_last_timestamp
+        counter = _uuid7_counter
+
+    rand_b = int.from_bytes(os.urandom(8)) & 0x3FFF_FFFF_FFFF_FFFF
+    value = (
+        (timestamp & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | counter << 64
+        | 0b10 << 62
+        | rand_b
+    )
+    return uuid.UUID(int=value)
+
+
+def escape_like(value: str, escape: str = "\\") -> str:
+    """Escape the LIKE wildcards in ``value`` so it is matched literally."""
+    return (
+        value.replace(escape, escape * 2)
+        .replace("%", f"{escape}%")
+        .replace("_", f"{escape}_")
+    )
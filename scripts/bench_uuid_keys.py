@@ -0,0 +1,62 @@
+"""Compare uuid4 and uuid7 primary keys on insert throughput and index size.
+
+Usage: PYTHONPATH=. python scripts/bench_uuid_keys.py [--rows N] [--batch-size N]
+"""
+
+import argparse
+import time
+import uuid
+from collections.abc import Callable
+
+from sqlalchemy import text
+
+from app.db import get_engine
+from app.utils import uuid7
+
+
+def run(
+    name: str, factory: Callable[[], uuid.UUID], rows: int, batch_size: int
+) -> None:
+    table = f"bench_{name}"
+    with get_engine().connect() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(
+            text(f"CREATE UNLOGGED TABLE {table} (id uuid PRIMARY KEY, payload text)")
+        )
+        conn.commit()
+
+        insert = text(f"INSERT INTO {table} (id, payload) VALUES (:id, :payload)")
+        start = time.perf_counter()
+        for offset in range(0, rows, batch_size):
+            batch = [
+                {"id": factory(), "payload": "x" * 32}
+                for _ in range(min(batch_size, rows - offset))
+            ]
+            conn.execute(insert, batch)
+            conn.commit()
+        elapsed = time.perf_counter() - start
+
+        index_size = conn.execute(
+            text(f"SELECT pg_relation_size('{table}_pkey')")
+        ).scalar_one()
+        conn.execute(text(f"DROP TABLE {table}"))
+        conn.commit()
+
+    print(
+        f"{name}: {rows / elapsed:,.0f} rows/s, "
+        f"primary key index {index_size / 1024 / 1024:.1f} MiB"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args()
+
+    run("uuid4", uuid.uuid4, args.rows, args.batch_size)
+    run("uuid7", uuid7, args.rows, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
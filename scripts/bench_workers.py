@@ -0,0 +1,109 @@
+"""Measure request throughput of `app.server` as the number of workers grows.
+
+Starts the server with 1, 2, 4, ... workers up to the CPU count, loads it
+with authenticated expense list reads from several client processes, and
+prints requests per second with the speedup over a single worker. The load
+generator needs spare cores too, so run it on a larger machine than the
+server's worker count, or point --client-processes at fewer processes.
+
+Usage: PYTHONPATH=. python scripts/bench_workers.py [--duration S] [--port N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.config import settings
+from app.server import worker_count
+from app.utils import uuid7
+
+
+def wait_until_ready(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(
+                f"{base_url}{settings.API_V1_STR}/openapi.json"
+            ).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def access_token(base_url: str) -> str:
+    email, password = f"bench-{uuid7()}@example.com", "benchmark-password"
+    httpx.post(
+        f"{base_url}{settings.API_V1_STR}/signup",
+        json={"email": email, "password": password},
+    ).raise_for_status()
+    r = httpx.post(
+        f"{base_url}{settings.API_V1_STR}/signin/access-token",
+        data={"username": email, "password": password},
+    )
+    r.raise_for_status()
+    return str(r.json()["access_token"])
+
+
+def load(base_url: str, token: str, duration: float) -> int:
+    headers = {"Authorization": f"Bearer {token}"}
+    requests = 0
+    deadline = time.monotonic() + duration
+    with httpx.Client(base_url=base_url, headers=headers) as client:
+        while time.monotonic() < deadline:
+            client.get(f"{settings.API_V1_STR}/expenses/").raise_for_status()
+            requests += 1
+    return requests
+
+
+def run(workers: int, args: argparse.Namespace) -> float:
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, "WEB_WORKERS": str(workers), "WEB_PORT": str(args.port)}
+    server = subprocess.Popen([sys.executable, "-m", "app.server"], env=env)
+    try:
+        wait_until_ready(base_url)
+        token = access_token(base_url)
+        with multiprocessing.Pool(args.client_processes) as pool:
+            counts = pool.starmap(
+                load, [(base_url, token, args.duration)] * args.client_processes
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    return sum(counts) / args.duration
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--max-workers", type=int, default=worker_count())
+    parser.add_argument("--client-processes", type=int, default=None)
+    args = parser.parse_args()
+
+    counts = [1]
+    while counts[-1] * 2 <= args.max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.max_workers:
+        counts.append(args.max_workers)
+
+    if args.client_processes is None:
+        args.client_processes = 4 * args.max_workers
+
+    baseline = None
+    for workers in counts:
+        throughput = run(workers, args)
+        baseline = baseline or throughput
+        print(
+            f"{workers} workers: {throughput:,.0f} req/s "
+            f"({throughput / baseline:.2f}x, ideal {workers}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Measure how long a worker takes to import the app and serve its first requests.
+
+Reports the slowest modules imported by `app.main`, then starts
+`app.server` with one worker and reports the time until it answers, and
+the latency of the first and second sign-in and expense list requests.
+
+Usage: PYTHONPATH=. python scripts/measure_startup.py [--top N] [--port N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.config import settings
+from app.utils import uuid7
+
+
+def import_times(top: int) -> None:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        modules.append((int(self_us), int(cumulative_us), name.strip()))
+
+    total = next(cumulative for _, cumulative, name in modules if name == "app.main")
+    print(f"import app.main: {total / 1000:.0f} ms")
+    print(f"{'self ms':>8} {'total ms':>9}  module")
+    for self_us, cumulative_us, name in sorted(modules, reverse=True)[:top]:
+        print(f"{self_us / 1000:8.1f} {cumulative_us / 1000:9.1f}  {name}")
+
+
+def timed(request: httpx.Request, client: httpx.Client) -> tuple[float, httpx.Response]:
+    start = time.perf_counter()
+    response = client.send(request)
+    return (time.perf_counter() - start) * 1000, response
+
+
+def first_requests(port: int) -> None:
+    base_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "WEB_WORKERS": "1", "WEB_PORT": str(port)}
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "app.server"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=base_url) as client:
+            while True:
+                try:
+                    client.get("/docs").raise_for_status()
+                    break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            print(
+                f"time to first response: {(time.perf_counter() - start) * 1000:.0f} ms"
+            )
+
+            email, password = f"startup-{uuid7()}@example.com", "startup-password"
+            client.post(
+                f"{settings.API_V1_STR}/signup",
+                json={"email": email, "password": password},
+            ).raise_for_status()
+            for attempt in ("first", "second"):
+                elapsed, r = timed(
+                    client.build_request(
+                        "POST",
+                        f"{settings.API_V1_STR}/signin/access-token",
+                        data={"username": email, "password": password},
+                    ),
+                    client,
+                )
+                r.raise_for_status()
+                print(f"{attempt} sign-in: {elapsed:.0f} ms")
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            for attempt in ("first", "second"):
+                elapsed, r = timed(
+                    client.build_request(
+                        "GET", f"{settings.API_V1_STR}/expenses/", headers=headers
+                    ),
+                    client,
+                )
+                r.raise_for_status()
+                print(f"{attempt} expense list: {elapsed:.0f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    import_times(args.top)
+    first_requests(args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Report on-disk size of every table and its indexes.
+
+Run before and after a schema change to measure its storage impact.
+
+Usage: PYTHONPATH=. python scripts/report_table_sizes.py
+"""
+
+from sqlalchemy import text
+
+from app.db import get_engine
+
+TABLE_SIZES = text(
+    """
+    SELECT
+        c.relname AS name,
+        c.reltuples::bigint AS rows,
+        pg_table_size(c.oid) AS table_size,
+        pg_indexes_size(c.oid) AS indexes_size
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r' AND n.nspname = current_schema()
+    ORDER BY pg_total_relation_size(c.oid) DESC
+    """
+)
+
+INDEX_SIZES = text(
+    """
+    SELECT indexrelid::regclass::text AS name, pg_relation_size(indexrelid) AS size
+    FROM pg_index
+    WHERE indrelid = CAST(:table AS regclass)
+    ORDER BY size DESC
+    """
+)
+
+
+def main() -> None:
+    with get_engine().connect() as conn:
+        for name, rows, table_size, indexes_size in conn.execute(TABLE_SIZES):
+            print(
+                f"{name}: ~{max(rows, 0):,} rows, table {table_size / 1024:,.0f} KiB, "
+                f"indexes {indexes_size / 1024:,.0f} KiB"
+            )
+            for index_name, size in conn.execute(INDEX_SIZES, {"table": f'"{name}"'}):
+                print(f"  {index_name}: {size / 1024:,.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
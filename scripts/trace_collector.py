@@ -0,0 +1,67 @@
+"""Receive traces over OTLP/HTTP JSON and print them as span trees.
+
+A stand-in for a real collector while working locally. Run it, then
+start the app with TRACING_ENABLED=true and TRACING_EXPORTER=otlp.
+
+Usage: python scripts/trace_collector.py [--port N]
+"""
+
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+
+def format_spans(spans: list[dict[str, Any]]) -> str:
+    children: dict[str, list[dict[str, Any]]] = {}
+    for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        children.setdefault(span["parentSpanId"], []).append(span)
+    lines = []
+
+    def walk(span: dict[str, Any], depth: int) -> None:
+        duration = int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])
+        attributes = " ".join(
+            f"{a['key']}={next(iter(a['value'].values()))}" for a in span["attributes"]
+        )
+        error = " ERROR" if span["status"].get("code") == 2 else ""
+        lines.append(
+            f"{'  ' * depth}{span['name']} {duration / 1e6:.2f} ms{error} {attributes}"
+        )
+        for child in children.get(span["spanId"], []):
+            walk(child, depth + 1)
+
+    for root in children.get("", []):
+        walk(root, 0)
+    return "\n".join(line.rstrip() for line in lines)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:  # noqa: N802
+        if self.path != "/v1/traces":
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        for resource in body["resourceSpans"]:
+            for scope in resource["scopeSpans"]:
+                print(format_spans(scope["spans"]), end="\n\n", flush=True)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=4318)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"Listening on http://127.0.0.1:{args.port}/v1/traces")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
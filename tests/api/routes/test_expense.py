@@ -1,18 +1,23 @@
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, func, select
 
+from app.api.idempotency import IdempotencyGuard
 from app.config import settings
-from app.models import Expense
+from app.models import Expense, ExpenseCreate
 from tests.utils import (
+    count_statements,
     random_expense,
     random_expense_category,
     random_positive_number,
     random_string,
     random_user,
+    using_sqlite,
 )
 
 DUMMY_UUID = "123e4567-e89b-12d3-a456-426614174000"
@@ -26,6 +31,7 @@ DUMMY_UUID = "123e4567-e89b-12d3-a456-426614174000"
         ("get", f"/expenses/{DUMMY_UUID}", None),
         ("put", f"/expenses/{DUMMY_UUID}", {"title": "Foo"}),
         ("delete", f"/expenses/{DUMMY_UUID}", None),
+        ("post", "/expenses/batch-get", {"ids": [DUMMY_UUID]}),
     ],
 )
 def test_user_unauthenticated(
@@ -59,9 +65,9 @@ def test_read_expenses_superuser(
     num_users = 5
     num_expenses = 3
     for _ in range(num_users):
-        owner_id = uuid.uuid4()
+        owner, *_ = random_user(session=db)
         for _ in range(num_expenses):
-            random_expense(session=db, owner_id=owner_id)
+            random_expense(session=db, owner_id=owner.id)
     r = client.get(f"{settings.API_V1_STR}/expenses/", headers=superuser["headers"])
     assert r.status_code == 200
     data = r.json()
@@ -99,6 +105,128 @@ def test_create_expense(
     assert db_expense is not None
 
 
+def test_create_expense_idempotent_replay(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    headers = {**normal_user["headers"], "Idempotency-Key": random_string()}
+    expense_data = {
+        "title": random_string(),
+        "amount": random_positive_number(),
+        "category": random_expense_category(),
+    }
+    first = client.post(
+        f"{settings.API_V1_STR}/expenses/", headers=headers, json=expense_data
+    )
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+
+    replay = client.post(
+        f"{settings.API_V1_STR}/expenses/", headers=headers, json=expense_data
+    )
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == first.json()
+
+    count = db.exec(
+        select(func.count())
+        .select_from(Expense)
+        .where(Expense.title == expense_data["title"])
+    ).one()
+    assert count == 1
+
+
+def test_create_expense_idempotent_concurrent(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    headers = {**normal_user["headers"], "Idempotency-Key": random_string()}
+    expense_data = {
+        "title": random_string(),
+        "amount": random_positive_number(),
+        "category": random_expense_category(),
+    }
+    n_requests = 8
+
+    def create(_: int) -> tuple[int, dict[str, Any]]:
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/", headers=headers, json=expense_data
+        )
+        return r.status_code, r.json()
+
+    with ThreadPoolExecutor(max_workers=n_requests) as executor:
+        responses = list(executor.map(create, range(n_requests)))
+
+    assert all(status_code == 200 for status_code, _ in responses)
+    assert len({body["id"] for _, body in responses}) == 1
+    count = db.exec(
+        select(func.count())
+        .select_from(Expense)
+        .where(Expense.title == expense_data["title"])
+    ).one()
+    assert count == 1
+
+
+def test_create_expense_idempotent_wait_is_bounded(
+    client: TestClient, normal_user: dict[str, Any], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "IDEMPOTENCY_WAIT_SECONDS", 0.2)
+    key = random_string()
+    expense_in = ExpenseCreate(title=random_string(), amount=1.0, category="other")
+    r = client.get(f"{settings.API_V1_STR}/users/me", headers=normal_user["headers"])
+    scope = f"expenses:{r.json()['id']}"
+    # A first request that never finishes
+    with IdempotencyGuard(key, scope=scope, request=expense_in):
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/",
+            headers={**normal_user["headers"], "Idempotency-Key": key},
+            json=expense_in.model_dump(mode="json"),
+        )
+    assert r.status_code == 409
+    assert r.json() == {"detail": "A request with this Idempotency-Key is in progress"}
+
+    # Its key is released, so the retry runs
+    r = client.post(
+        f"{settings.API_V1_STR}/expenses/",
+        headers={**normal_user["headers"], "Idempotency-Key": key},
+        json=expense_in.model_dump(mode="json"),
+    )
+    assert r.status_code == 200
+    assert "Idempotent-Replayed" not in r.headers
+
+
+def test_create_expense_idempotency_key_reused(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    headers = {**normal_user["headers"], "Idempotency-Key": random_string()}
+    for title, status_code in [(random_string(), 200), (random_string(), 422)]:
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/",
+            headers=headers,
+            json={"title": title, "amount": 1.0, "category": "other"},
+        )
+        assert r.status_code == status_code
+    assert r.json() == {
+        "detail": "Idempotency-Key was already used with a different request"
+    }
+
+
+def test_create_expense_idempotency_key_per_user(
+    client: TestClient, normal_user: dict[str, Any], superuser: dict[str, Any]
+) -> None:
+    key = random_string()
+    expense_data = {"title": random_string(), "amount": 1.0, "category": "other"}
+    ids = set()
+    for user in (normal_user, superuser):
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/",
+            headers={**user["headers"], "Idempotency-Key": key},
+            json=expense_data,
+        )
+        assert r.status_code == 200
+        assert "Idempotent-Replayed" not in r.headers
+        ids.add(r.json()["id"])
+    assert len(ids) == 2
+
+
 def test_read_expense(
     client: TestClient, db: Session, normal_user: dict[str, Any]
 ) -> None:
@@ -242,3 +370,311 @@ def test_delete_expense_not_enough_permissions(
     )
     assert r.status_code == 403
     assert r.json() == {"detail": "Not enough permissions"}
+
+
+def test_read_expenses_search(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    owner_id = normal_user["user"].id
+    keyword = random_string()
+    matched = [
+        random_expense(session=db, owner_id=owner_id, extra={"title": keyword}),
+        random_expense(
+            session=db, owner_id=owner_id, extra={"description": f"paid {keyword}"}
+        ),
+    ]
+    random_expense(session=db, owner_id=owner_id)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"q": keyword, "order_by": "relevance", "sort_order": "desc"},
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert data["count"] == len(matched)
+    # Title matches are weighted above description matches
+    assert [item["id"] for item in data["data"]] == [str(e.id) for e in matched]
+
+
+def test_read_expenses_search_substring(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    keyword = random_string()
+    expense = random_expense(
+        session=db, owner_id=normal_user["user"].id, extra={"title": keyword}
+    )
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"q": keyword[4:12]},
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert [item["id"] for item in data["data"]] == [str(expense.id)]
+
+
+def test_read_expenses_search_with_category(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    owner_id = normal_user["user"].id
+    keyword = random_string()
+    expense = random_expense(
+        session=db, owner_id=owner_id, extra={"title": keyword, "category": "health"}
+    )
+    random_expense(
+        session=db, owner_id=owner_id, extra={"title": keyword, "category": "leisure"}
+    )
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"q": keyword, "categories": ["health"]},
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert [item["id"] for item in data["data"]] == [str(expense.id)]
+
+
+def test_read_expenses_search_escapes_wildcards(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"q": "%"},
+    )
+    assert r.status_code == 200
+    assert r.json()["count"] == 0
+
+
+def test_read_expenses_relevance_without_query(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"order_by": "relevance"},
+    )
+    assert r.status_code == 400
+    assert r.json() == {"detail": "Sorting by relevance requires a search query"}
+
+
+def test_read_expenses_amount_range(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    owner_id = normal_user["user"].id
+    keyword = random_string()
+    expense = random_expense(
+        session=db, owner_id=owner_id, extra={"title": keyword, "amount": 42.0}
+    )
+    random_expense(
+        session=db, owner_id=owner_id, extra={"title": keyword, "amount": 420.0}
+    )
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"q": keyword, "min_amount": 40, "max_amount": 50},
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert [item["id"] for item in data["data"]] == [str(expense.id)]
+
+
+def test_read_expenses_invalid_amount_range(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"min_amount": 50, "max_amount": 40},
+    )
+    assert r.status_code == 400
+    assert r.json() == {"detail": "Minimum amount must not exceed maximum amount"}
+
+
+def test_update_expense_round_trips(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    expense = random_expense(session=db, owner_id=normal_user["user"].id)
+    with count_statements(db) as statements:
+        r = client.put(
+            f"{settings.API_V1_STR}/expenses/{expense.id}",
+            headers=normal_user["headers"],
+            json={"title": random_string()},
+        )
+    assert r.status_code == 200
+    # Load the current user, then a single conditional UPDATE ... RETURNING
+    assert len(statements) == 2
+
+
+def test_read_expense_changes(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    user = normal_user["user"]
+    url = f"{settings.API_V1_STR}/expenses/changes"
+    expenses = [random_expense(session=db, owner_id=user.id) for _ in range(3)]
+
+    # Initial sync, in pages
+    seen: set[str] = set()
+    token = None
+    while True:
+        params: dict[str, Any] = {"limit": 2}
+        if token:
+            params["since"] = token
+        r = client.get(url, headers=normal_user["headers"], params=params)
+        assert r.status_code == 200
+        data = r.json()
+        if token is None:
+            # Nothing synced yet, so nothing to delete
+            assert data["deleted"] == []
+        seen.update(expense["id"] for expense in data["data"])
+        token = data["next_token"]
+        if not data["has_more"]:
+            break
+    assert {str(expense.id) for expense in expenses} <= seen
+
+    # Incremental sync only returns what changed since the token
+    updated = client.put(
+        f"{settings.API_V1_STR}/expenses/{expenses[1].id}",
+        headers=normal_user["headers"],
+        json={"title": random_string()},
+    ).json()
+    client.delete(
+        f"{settings.API_V1_STR}/expenses/{expenses[2].id}",
+        headers=normal_user["headers"],
+    )
+    r = client.get(url, headers=normal_user["headers"], params={"since": token})
+    assert r.status_code == 200
+    data = r.json()
+    assert updated in data["data"]
+    assert str(expenses[2].id) in data["deleted"]
+    assert str(expenses[2].id) not in {expense["id"] for expense in data["data"]}
+    assert not data["has_more"]
+
+
+def test_read_expense_changes_invalid_token(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/changes",
+        headers=normal_user["headers"],
+        params={"since": "not-a-token"},
+    )
+    assert r.status_code == 400
+    assert r.json() == {"detail": "Invalid change token"}
+
+
+def test_read_expense_changes_expired_token(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    url = f"{settings.API_V1_STR}/expenses/changes"
+    r = client.get(url, headers=normal_user["headers"])
+    token = r.json()["next_token"]
+
+    with patch.object(settings, "CHANGE_FEED_RETENTION_DAYS", -1):
+        r = client.get(url, headers=normal_user["headers"], params={"since": token})
+    assert r.status_code == 410
+    assert r.json() == {"detail": "Change token expired, resync all expenses"}
+
+
+def test_read_expenses_fields(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    random_expense(session=db, owner_id=normal_user["user"].id)
+    fields = ["title", "amount", "category", "created_at"]
+    for params in [
+        {"fields": ",".join(reversed(fields))},
+        {"fields": fields},
+    ]:
+        with count_statements(db) as statements:
+            r = client.get(
+                f"{settings.API_V1_STR}/expenses/",
+                headers=normal_user["headers"],
+                params=params,
+            )
+        assert r.status_code == 200
+        data = r.json()
+        assert data["count"] >= 1
+        assert all(list(expense) == fields for expense in data["data"])
+        page_query = next(s for s in statements if "ORDER BY" in s)
+        assert "description" not in page_query.split("FROM")[0]
+
+
+def test_read_expenses_unknown_field(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        params={"fields": "title,hashed_password"},
+    )
+    assert r.status_code == 422
+
+
+def test_read_expense_fields(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    expense = random_expense(session=db, owner_id=normal_user["user"].id)
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/{expense.id}",
+        headers=normal_user["headers"],
+        params={"fields": "amount,id"},
+    )
+    assert r.status_code == 200
+    assert r.json() == {"id": str(expense.id), "amount": expense.amount}
+
+
+def test_read_expense_fields_not_enough_permissions(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    expense = random_expense(session=db)
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/{expense.id}",
+        headers=normal_user["headers"],
+        params={"fields": "title"},
+    )
+    assert r.status_code == 403
+    assert r.json() == {"detail": "Not enough permissions"}
+
+
+def test_read_expenses_batch(
+    client: TestClient, db: Session, normal_user: dict[str, Any]
+) -> None:
+    owned = [random_expense(session=db, owner_id=normal_user["user"].id)]
+    owned.append(random_expense(session=db, owner_id=normal_user["user"].id))
+    other = random_expense(session=db)
+    missing = uuid.uuid4()
+    ids = [str(owned[1].id), str(missing), str(other.id), str(owned[0].id)]
+
+    with count_statements(db) as statements:
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/batch-get",
+            headers=normal_user["headers"],
+            json={"ids": ids},
+        )
+    assert r.status_code == 200
+    data = r.json()["data"]
+    assert [item["id"] for item in data] == ids
+    assert [item["status"] for item in data] == [
+        "found",
+        "missing",
+        "forbidden",
+        "found",
+    ]
+    assert data[0]["expense"]["title"] == owned[1].title
+    assert data[1]["expense"] is None
+    assert data[2]["expense"] is None
+    assert data[3]["expense"]["id"] == str(owned[0].id)
+    # The route's statement timeout, the current user, then every id at once
+    assert len(statements) == (2 if using_sqlite() else 3)
+
+
+def test_read_expenses_batch_too_many_ids(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.post(
+        f"{settings.API_V1_STR}/expenses/batch-get",
+        headers=normal_user["headers"],
+        json={"ids": [str(uuid.uuid4()) for _ in range(501)]},
+    )
+    assert r.status_code == 422
@@ -1,10 +1,12 @@
+import hashlib
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, select
 
 from app.config import settings
-from app.models import User
+from app.models import IdempotencyKey, User, UserRegister
 from app.security import verify_password
 from tests.utils import random_email, random_string, random_user
 
@@ -38,6 +40,77 @@ def test_register_duplicate_email(client: TestClient, db: Session) -> None:
     assert r.json() == {"detail": "The email is already used with an account"}
 
 
+def test_register_concurrent_same_email(client: TestClient, db: Session) -> None:
+    email = random_email()
+    n_requests = 16
+
+    def register(password: str) -> int:
+        r = client.post(
+            f"{settings.API_V1_STR}/signup",
+            json={"email": email, "password": password},
+        )
+        return r.status_code
+
+    with ThreadPoolExecutor(max_workers=n_requests) as executor:
+        passwords = [random_string() for _ in range(n_requests)]
+        status_codes = list(executor.map(register, passwords))
+
+    assert sorted(status_codes) == [200] + [400] * (n_requests - 1)
+    users = db.exec(select(User).where(User.email == email)).all()
+    assert len(users) == 1
+
+
+def test_register_idempotent_replay(client: TestClient, db: Session) -> None:
+    headers = {"Idempotency-Key": random_string()}
+    user_data = {"email": random_email(), "password": random_string()}
+    first = client.post(
+        f"{settings.API_V1_STR}/signup", headers=headers, json=user_data
+    )
+    assert first.status_code == 200
+
+    replay = client.post(
+        f"{settings.API_V1_STR}/signup", headers=headers, json=user_data
+    )
+    assert replay.status_code == 200
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.json() == first.json()
+
+
+def test_register_idempotency_hash_hides_password(
+    client: TestClient, db: Session
+) -> None:
+    key = random_string()
+    user_in = UserRegister(email=random_email(), password=random_string())
+    r = client.post(
+        f"{settings.API_V1_STR}/signup",
+        headers={"Idempotency-Key": key},
+        json=user_in.model_dump(),
+    )
+    assert r.status_code == 200
+
+    key_hash = hashlib.sha256(f"signup:{key}".encode()).digest()
+    record = db.get(IdempotencyKey, key_hash)
+    assert record is not None
+    # Without the secret key, a guessed password can't be checked against it
+    guess = hashlib.sha256(user_in.model_dump_json().encode()).digest()
+    assert record.request_hash != guess
+
+
+def test_register_idempotency_key_released_on_error(
+    client: TestClient, db: Session
+) -> None:
+    _, email, _ = random_user(session=db)
+    headers = {"Idempotency-Key": random_string()}
+    user_data = {"email": email, "password": random_string()}
+    for _ in range(2):
+        # Failed requests are not stored and run again on retry
+        r = client.post(
+            f"{settings.API_V1_STR}/signup", headers=headers, json=user_data
+        )
+        assert r.status_code == 400
+        assert "Idempotent-Replayed" not in r.headers
+
+
 def test_login_success(client: TestClient, db: Session) -> None:
     _, email, password = random_user(session=db)
 
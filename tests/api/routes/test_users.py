@@ -10,6 +10,7 @@ from app.security import verify_password
 from tests.utils import (
     get_authentication_headers,
     random_email,
+    random_expense,
     random_string,
     random_user,
 )
@@ -336,6 +337,45 @@ def test_delete_user_by_id_superuser(
     assert r.json() == {"message": "Delete user successfully"}
 
 
+def test_delete_user_by_id_background(
+    client: TestClient, db: Session, superuser: dict[str, Any]
+) -> None:
+    user, *_ = random_user(session=db)
+    for _ in range(3):
+        random_expense(session=db, owner_id=user.id)
+
+    r = client.delete(
+        f"{settings.API_V1_STR}/users/{user.id}",
+        headers=superuser["headers"],
+        params={"background": True},
+    )
+    assert r.status_code == 202
+    assert r.json() == {"message": "User deletion scheduled"}
+
+    # The test client runs background tasks before returning
+    r = client.get(
+        f"{settings.API_V1_STR}/users/{user.id}/purge",
+        headers=superuser["headers"],
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert data["user_id"] == str(user.id)
+    assert data["status"] == "done"
+    assert data["total_expenses"] == 3
+    assert data["deleted_expenses"] == 3
+
+
+def test_read_user_purge_not_found(
+    client: TestClient, superuser: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/users/{DUMMY_UUID}/purge",
+        headers=superuser["headers"],
+    )
+    assert r.status_code == 404
+    assert r.json() == {"detail": "User purge not found"}
+
+
 def test_delete_user_by_id_normal_user(
     client: TestClient, db: Session, normal_user: dict[str, Any]
 ) -> None:
@@ -1,23 +1,56 @@
+import os
 from collections.abc import Generator
 from typing import Any
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, delete
+from sqlalchemy import make_url
+from sqlmodel import Session, SQLModel, delete, text
 
-from app.db import engine, init_db
+from app.config import settings
+from app.db import get_engine, init_db
 from app.main import app
-from tests.utils import get_authentication_headers, random_user
+from app.security import pwd_context
+from tests.utils import get_authentication_headers, random_user, using_sqlite
+
+# The lowest cost bcrypt accepts, creating users dominates the suite otherwise
+TEST_HASH_ROUNDS = 4
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    pwd_context.update(bcrypt__rounds=TEST_HASH_ROUNDS)
+    # Each pytest-xdist worker gets its own schema, or SQLite file, so
+    # parallel runs never see each other's rows
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    if worker is None:
+        return
+    if using_sqlite():
+        url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+        root, _, extension = (url.database or "test.db").rpartition(".")
+        settings.DATABASE_URL = str(url.set(database=f"{root}-{worker}.{extension}"))
+    else:
+        settings.POSTGRES_SCHEMA = f"test_{worker}"
+
+
+def _drop_worker_schema() -> None:
+    if settings.POSTGRES_SCHEMA:
+        with get_engine().begin() as connection:
+            connection.execute(
+                text(f"DROP SCHEMA IF EXISTS {settings.POSTGRES_SCHEMA} CASCADE")
+            )
 
 
 @pytest.fixture(scope="session", autouse=True)
 def db() -> Generator[Session, None, None]:
-    with Session(engine) as session:
-        init_db(session)
+    # Start from an empty schema in case a previous run was interrupted
+    _drop_worker_schema()
+    init_db()
+    with Session(get_engine()) as session:
         yield session
         for table in reversed(SQLModel.metadata.sorted_tables):
             session.exec(delete(table))  # type: ignore
         session.commit()
+    _drop_worker_schema()
 
 
 @pytest.fixture(scope="module")
@@ -0,0 +1,32 @@
+from collections.abc import Generator
+
+import pytest
+from sqlmodel import Session
+
+from app.db import get_engine
+from tests.utils import using_sqlite
+
+
+@pytest.fixture
+def db(db: Session) -> Generator[Session, None, None]:
+    """A session whose changes, committed or not, are undone after the test.
+
+    The test runs in a transaction that is rolled back at the end, and the
+    session's own commits only release savepoints inside it.
+    """
+    with get_engine().connect() as connection:
+        transaction = connection.begin()
+        dbapi_connection = connection.connection.dbapi_connection
+        if using_sqlite():
+            # pysqlite begins lazily and would commit when the outermost
+            # savepoint is released, so begin explicitly instead
+            dbapi_connection.isolation_level = None  # type: ignore[union-attr]
+            connection.exec_driver_sql("BEGIN")
+        session = Session(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            yield session
+        finally:
+            session.close()
+            transaction.rollback()
+            if using_sqlite():
+                dbapi_connection.isolation_level = ""  # type: ignore[union-attr]
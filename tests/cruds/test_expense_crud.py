@@ -1,15 +1,28 @@
-import uuid
 from datetime import datetime
+from typing import Any
 
-from sqlmodel import Session
+from sqlmodel import Session, func, select, text
 
 from app.cruds import expense_crud
-from app.models import Expense, ExpenseCreate, ExpenseUpdate
+from app.db import get_engine
+from app.models import (
+    Expense,
+    ExpenseCreate,
+    ExpenseFilter,
+    ExpenseTombstone,
+    ExpenseUpdate,
+)
+from app.utils import uuid7
 from tests.utils import (
+    count_statements,
     random_expense,
     random_expense_category,
     random_positive_number,
     random_string,
+    random_user,
+    requires_idle_database,
+    requires_postgres,
+    using_sqlite,
 )
 
 
@@ -21,7 +34,8 @@ def test_create_expense(db: Session) -> None:
         "category": random_expense_category(),
     }
     expense_in = ExpenseCreate(**expense_data)
-    owner_id = uuid.uuid4()
+    owner, *_ = random_user(session=db)
+    owner_id = owner.id
     expense = expense_crud.create(session=db, expense_in=expense_in, owner_id=owner_id)
     assert expense.id is not None
     assert expense.title == expense_data["title"]
@@ -29,6 +43,7 @@ def test_create_expense(db: Session) -> None:
     assert expense.amount == expense_data["amount"]
     assert expense.category == expense_data["category"]
     assert expense.owner_id == owner_id
+    assert expense.id.version == 7
     assert isinstance(expense.created_at, datetime)
     assert isinstance(expense.updated_at, datetime)
     assert expense.created_at == expense.updated_at
@@ -37,7 +52,8 @@ def test_create_expense(db: Session) -> None:
     assert db_expense is not None
     assert expense.title == expense_data["title"]
 
-def test_update_expense(db:Session) -> None:
+
+def test_update_expense(db: Session) -> None:
     expense = random_expense(session=db)
 
     update_data = {
@@ -50,9 +66,14 @@ def test_update_expense(db:Session) -> None:
     original_created_at = expense.created_at
     original_updated_at = expense.updated_at
 
-    updated_expense = expense_crud.update(
-        session=db, db_expense=expense, expense_in=expense_update
+    found, updated_expense = expense_crud.update(
+        session=db,
+        expense_id=expense.id,
+        owner_id=expense.owner_id,
+        expense_in=expense_update,
     )
+    assert found
+    assert updated_expense is not None
     assert updated_expense.id == expense.id
     assert updated_expense.title == update_data["title"]
     assert updated_expense.amount == update_data["amount"]
@@ -62,16 +83,228 @@ def test_update_expense(db:Session) -> None:
 
     db_expense = db.get(Expense, expense.id)
     assert db_expense is not None
-    assert expense.title == update_data["title"]
+    assert db_expense.title == update_data["title"]
 
 
-def test_delete_expense(db: Session) -> None:
+def test_update_expense_not_owner(db: Session) -> None:
     expense = random_expense(session=db)
+    other, *_ = random_user(session=db)
 
-    expense_to_delete = db.get(Expense, expense.id)
-    assert expense_to_delete is not None
+    found, updated_expense = expense_crud.update(
+        session=db,
+        expense_id=expense.id,
+        owner_id=other.id,
+        expense_in=ExpenseUpdate(title=random_string()),
+    )
+    assert found
+    assert updated_expense is None
+
+    db_expense = db.get(Expense, expense.id)
+    assert db_expense is not None
+    assert db_expense.title == expense.title
+
+
+def test_update_expense_not_found(db: Session) -> None:
+    found, updated_expense = expense_crud.update(
+        session=db,
+        expense_id=uuid7(),
+        owner_id=uuid7(),
+        expense_in=ExpenseUpdate(title=random_string()),
+    )
+    assert not found
+    assert updated_expense is None
+
+
+def test_delete_expense(db: Session) -> None:
+    expense = random_expense(session=db)
 
-    expense_crud.delete(session=db, expense_in=expense_to_delete)
+    found, deleted = expense_crud.delete(
+        session=db, expense_id=expense.id, owner_id=expense.owner_id
+    )
+    assert found
+    assert deleted
 
     deleted_expense = db.get(Expense, expense.id)
     assert deleted_expense is None
+    tombstone = db.get(ExpenseTombstone, expense.id)
+    assert tombstone is not None
+    assert tombstone.owner_id == expense.owner_id
+
+
+def test_delete_expense_not_owner(db: Session) -> None:
+    expense = random_expense(session=db)
+    other, *_ = random_user(session=db)
+
+    found, deleted = expense_crud.delete(
+        session=db, expense_id=expense.id, owner_id=other.id
+    )
+    assert found
+    assert not deleted
+    assert db.get(Expense, expense.id) is not None
+    assert db.get(ExpenseTombstone, expense.id) is None
+
+
+def test_write_round_trips(db: Session) -> None:
+    owner, *_ = random_user(session=db)
+    expense_in = ExpenseCreate(
+        title=random_string(),
+        amount=random_positive_number(),
+        category=random_expense_category(),
+    )
+    with count_statements(db) as statements:
+        expense = expense_crud.create(
+            session=db, expense_in=expense_in, owner_id=owner.id
+        )
+    assert len(statements) == 1
+
+    with count_statements(db) as statements:
+        expense_crud.update(
+            session=db,
+            expense_id=expense.id,
+            owner_id=owner.id,
+            expense_in=ExpenseUpdate(title=random_string()),
+        )
+    assert len(statements) == 1
+
+    with count_statements(db) as statements:
+        expense_crud.delete(session=db, expense_id=expense.id, owner_id=owner.id)
+    # SQLite can't insert the tombstone from the DELETE statement
+    assert len(statements) == (2 if using_sqlite() else 1)
+
+
+def test_get_multi_filters(db: Session) -> None:
+    owner, *_ = random_user(session=db)
+    amounts = [5.0, 50.0, 500.0]
+    expenses = [
+        random_expense(session=db, owner_id=owner.id, extra={"amount": amount})
+        for amount in amounts
+    ]
+
+    filters = ExpenseFilter(min_amount=10, max_amount=100)
+    data, count = expense_crud.get_multi(session=db, filters=filters, owner_id=owner.id)
+    assert count == 1
+    assert [expense.id for expense in data] == [expenses[1].id]
+
+    filters = ExpenseFilter(updated_since=expenses[1].updated_at)
+    data, count = expense_crud.get_multi(session=db, filters=filters, owner_id=owner.id)
+    assert count == 2
+    assert [expense.id for expense in data] == [e.id for e in expenses[1:]]
+
+
+def _explain(db: Session, statement: Any) -> dict[str, Any]:
+    compiled = statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    result = db.exec(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}")  # type: ignore
+    )
+    plan: dict[str, Any] = result.scalar_one()[0]
+    return plan
+
+
+def _plan_nodes(node: dict[str, Any]) -> list[dict[str, Any]]:
+    nodes = [node]
+    for child in node.get("Plans", []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def test_get_changes(db: Session) -> None:
+    owner, *_ = random_user(session=db)
+    since = datetime.now()
+    expenses = [random_expense(session=db, owner_id=owner.id) for _ in range(3)]
+    expense_crud.delete(session=db, expense_id=expenses[0].id, owner_id=owner.id)
+
+    changes, has_more = expense_crud.get_changes(
+        session=db, since=since, limit=10, owner_id=owner.id
+    )
+    assert [(type(change), change.id) for change in changes] == [
+        (Expense, expenses[1].id),
+        (Expense, expenses[2].id),
+        (ExpenseTombstone, expenses[0].id),
+    ]
+    assert not has_more
+
+    # A first sync holds nothing the deletions would remove
+    changes, _ = expense_crud.get_changes(
+        session=db, since=None, limit=10, owner_id=owner.id
+    )
+    assert all(isinstance(change, Expense) for change in changes)
+
+
+def test_get_changes_pages(db: Session) -> None:
+    owner, *_ = random_user(session=db)
+    since = datetime.now()
+    expenses = [random_expense(session=db, owner_id=owner.id) for _ in range(5)]
+    for expense in expenses[:3]:
+        expense_crud.delete(session=db, expense_id=expense.id, owner_id=owner.id)
+
+    seen: list[Any] = []
+    cursor_id, has_more = None, True
+    while has_more:
+        changes, has_more = expense_crud.get_changes(
+            session=db, since=since, cursor_id=cursor_id, limit=2, owner_id=owner.id
+        )
+        # Deletions count towards the page size
+        assert len(changes) <= 2
+        seen.extend(change.id for change in changes)
+        since, cursor_id = expense_crud.change_key(changes[-1])
+    assert seen == [expense.id for expense in [*expenses[3:], *expenses[:3]]]
+
+
+@requires_postgres
+@requires_idle_database
+def test_get_multi_count_uses_covering_index() -> None:
+    # VACUUM only sees committed rows, so this test commits for real
+    with Session(get_engine()) as db:
+        owner, *_ = random_user(session=db)
+        db.add_all(
+            Expense.model_validate(
+                {
+                    "title": random_string(),
+                    "amount": random_positive_number(),
+                    "category": random_expense_category(),
+                    "owner_id": owner.id,
+                }
+            )
+            for _ in range(500)
+        )
+        db.commit()
+        # Index-only scans skip the heap only for pages marked all-visible
+        with db.get_bind().connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+                text("VACUUM ANALYZE expense")
+            )
+
+        filters = ExpenseFilter(min_amount=50, max_amount=150)
+        clauses = expense_crud.filter_clauses(filters, owner_id=owner.id)
+        statement = select(func.count()).select_from(Expense).where(*clauses)
+
+        # The test table is tiny, so keep the planner from preferring a seq scan
+        db.exec(text("SET LOCAL enable_seqscan = off"))  # type: ignore
+        covered = _explain(db, statement)
+        # Compare against the previous schema, which only indexed owner_id
+        db.exec(text("DROP INDEX ix_expense_owner_id_created_at"))  # type: ignore
+        db.exec(text("DROP INDEX ix_expense_owner_id_updated_at"))  # type: ignore
+        db.exec(text("CREATE INDEX ix_expense_owner_id ON expense (owner_id)"))  # type: ignore
+        uncovered = _explain(db, statement)
+        db.rollback()
+
+        covered_nodes = _plan_nodes(covered["Plan"])
+        scan = next(n for n in covered_nodes if n["Node Type"] == "Index Only Scan")
+        assert scan["Index Name"].startswith("ix_expense_owner_id_")
+        assert scan["Heap Fetches"] == 0
+
+        uncovered_nodes = _plan_nodes(uncovered["Plan"])
+        assert all(n["Node Type"] != "Index Only Scan" for n in uncovered_nodes)
+        assert (
+            covered["Plan"]["Shared Hit Blocks"] + covered["Plan"]["Shared Read Blocks"]
+            < uncovered["Plan"]["Shared Hit Blocks"]
+            + uncovered["Plan"]["Shared Read Blocks"]
+        )
+
+
+def test_filter_clauses_skips_default_categories() -> None:
+    assert expense_crud.filter_clauses(ExpenseFilter()) == []
+    clauses = expense_crud.filter_clauses(
+        ExpenseFilter(categories=[random_expense_category()])
+    )
+    assert len(clauses) == 1
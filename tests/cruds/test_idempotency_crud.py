@@ -0,0 +1,75 @@
+import os
+from datetime import timedelta
+
+from sqlmodel import Session, text
+
+from app.cruds import idempotency_crud
+from app.db import get_engine
+from app.models import IdempotencyKey
+from tests.utils import requires_postgres
+
+TTL = timedelta(hours=1)
+
+
+def test_claim_once(db: Session) -> None:
+    key_hash = os.urandom(32)
+    assert idempotency_crud.claim(
+        session=db, key_hash=key_hash, request_hash=b"a", ttl=TTL
+    )
+    idempotency_crud.store(
+        session=db, key_hash=key_hash, status_code=200, response={"id": 1}
+    )
+    assert not idempotency_crud.claim(
+        session=db, key_hash=key_hash, request_hash=b"a", ttl=TTL
+    )
+
+    record = db.get(IdempotencyKey, key_hash)
+    assert record is not None
+    assert record.status_code == 200
+    assert record.response == {"id": 1}
+
+
+@requires_postgres
+def test_claim_in_flight_does_not_wait() -> None:
+    key_hash = os.urandom(32)
+    with Session(get_engine()) as first, Session(get_engine()) as second:
+        assert idempotency_crud.claim(
+            session=first, key_hash=key_hash, request_hash=b"a", ttl=TTL
+        )
+        # Fail rather than hang if the claim waits on the first one's row
+        second.exec(text("SET LOCAL lock_timeout = '1s'"))  # type: ignore
+        assert not idempotency_crud.claim(
+            session=second, key_hash=key_hash, request_hash=b"a", ttl=TTL
+        )
+        first.rollback()
+        second.rollback()
+
+
+def test_claim_expired(db: Session) -> None:
+    key_hash = os.urandom(32)
+    idempotency_crud.claim(session=db, key_hash=key_hash, request_hash=b"a", ttl=TTL)
+    idempotency_crud.store(
+        session=db, key_hash=key_hash, status_code=200, response={"id": 1}
+    )
+
+    assert idempotency_crud.claim(
+        session=db, key_hash=key_hash, request_hash=b"b", ttl=timedelta(0)
+    )
+    db.commit()
+    record = db.get(IdempotencyKey, key_hash)
+    assert record is not None
+    db.refresh(record)
+    assert record.request_hash == b"b"
+    assert record.response is None
+
+
+def test_purge_expired(db: Session) -> None:
+    key_hash = os.urandom(32)
+    idempotency_crud.claim(session=db, key_hash=key_hash, request_hash=b"a", ttl=TTL)
+    db.commit()
+
+    idempotency_crud.purge_expired(session=db, ttl=TTL)
+    assert db.get(IdempotencyKey, key_hash) is not None
+    assert idempotency_crud.purge_expired(session=db, ttl=timedelta(0)) >= 1
+    db.expire_all()
+    assert db.get(IdempotencyKey, key_hash) is None
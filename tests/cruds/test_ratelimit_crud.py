@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from app.cruds import ratelimit_crud
+from app.models import RateLimitBucket
+from app.utils import uuid7
+
+
+def test_take_until_empty(db: Session) -> None:
+    key = f"test:{uuid7()}"
+    for _ in range(3):
+        assert not ratelimit_crud.take(session=db, key=key, cost=1, rate=1, burst=3)
+    wait = ratelimit_crud.take(session=db, key=key, cost=1, rate=1, burst=3)
+    assert 0 < wait <= 1
+
+    bucket = db.get(RateLimitBucket, key)
+    assert bucket is not None
+    assert 0 <= bucket.tokens < 1
+
+
+def test_take_refills(db: Session) -> None:
+    key = f"test:{uuid7()}"
+    assert not ratelimit_crud.take(session=db, key=key, cost=2, rate=1, burst=2)
+    bucket = db.get(RateLimitBucket, key)
+    assert bucket is not None
+    bucket.updated_at -= timedelta(seconds=2)
+    db.add(bucket)
+    db.commit()
+
+    assert not ratelimit_crud.take(session=db, key=key, cost=2, rate=1, burst=2)
+
+
+def test_purge_idle(db: Session) -> None:
+    key = f"test:{uuid7()}"
+    ratelimit_crud.take(session=db, key=key, cost=1, rate=1, burst=1)
+    assert ratelimit_crud.purge_idle(session=db, before=datetime.now()) >= 1
+    db.expire_all()
+    assert db.get(RateLimitBucket, key) is None
@@ -2,9 +2,16 @@ from pydantic import BaseModel, EmailStr
 from sqlmodel import Session
 
 from app.cruds import user_crud
-from app.models import User, UserCreate
+from app.enums import PurgeStatus
+from app.models import Expense, User, UserCreate
 from app.security import verify_password
-from tests.utils import random_email, random_string
+from tests.utils import (
+    count_statements,
+    random_email,
+    random_expense,
+    random_string,
+    random_user,
+)
 
 
 def test_create_user(db: Session) -> None:
@@ -49,6 +56,31 @@ def test_update_user(db: Session) -> None:
     assert updated_user.email == new_email
 
 
+def test_create_user_email_exists(db: Session) -> None:
+    user_create = UserCreate(email=random_email(), password=random_string())
+    user_crud.create(session=db, user_create=user_create)
+
+    with count_statements(db) as statements:
+        user = user_crud.create(session=db, user_create=user_create)
+    assert user is None
+    assert len(statements) == 1
+
+
+def test_update_user_email_exists(db: Session) -> None:
+    user_create = UserCreate(email=random_email(), password=random_string())
+    user_crud.create(session=db, user_create=user_create)
+    other = user_crud.create(
+        session=db,
+        user_create=UserCreate(email=random_email(), password=random_string()),
+    )
+    assert other is not None
+
+    updated_user = user_crud.update(
+        session=db, db_user=other, new_data={"email": user_create.email}
+    )
+    assert updated_user is None
+
+
 def test_update_user_with_basemodel(db: Session) -> None:
     user_create = UserCreate(email=random_email(), password=random_string())
     user = user_crud.create(session=db, user_create=user_create)
@@ -108,6 +140,38 @@ def test_delete_user(db: Session) -> None:
     assert deleted_user is None
 
 
+def test_delete_user_with_expenses(db: Session) -> None:
+    user, *_ = random_user(session=db)
+    expenses = [random_expense(session=db, owner_id=user.id) for _ in range(3)]
+
+    user_to_delete = db.get(User, user.id)
+    assert user_to_delete is not None
+    with count_statements(db) as statements:
+        user_crud.delete(session=db, user_in=user_to_delete)
+    # Expenses are removed by the database, not loaded and deleted one by one
+    assert len(statements) == 1
+
+    for expense in expenses:
+        assert db.get(Expense, expense.id) is None
+
+
+def test_start_purge(db: Session) -> None:
+    user, *_ = random_user(session=db)
+    for _ in range(3):
+        random_expense(session=db, owner_id=user.id)
+    db_user = db.get(User, user.id)
+    assert db_user is not None
+
+    purge = user_crud.start_purge(session=db, db_user=db_user)
+    assert purge.user_id == user.id
+    assert purge.status == PurgeStatus.RUNNING
+    assert purge.total_expenses == 3
+    assert purge.deleted_expenses == 0
+    assert not db_user.is_active
+
+    assert user_crud.start_purge(session=db, db_user=db_user) == purge
+
+
 def test_get_user_by_email(db: Session) -> None:
     user_create = UserCreate(email=random_email(), password=random_string())
     user = user_crud.create(session=db, user_create=user_create)
@@ -147,3 +211,14 @@ def test_authenticate_user_wrong_password(db: Session) -> None:
         session=db, email=user_create.email, password=random_string()
     )
     assert user is None
+
+
+def test_update_user_round_trips(db: Session) -> None:
+    user_create = UserCreate(email=random_email(), password=random_string())
+    with count_statements(db) as statements:
+        user = user_crud.create(session=db, user_create=user_create)
+    assert len(statements) == 1
+
+    with count_statements(db) as statements:
+        user_crud.update(session=db, db_user=user, new_data={"is_active": False})
+    assert len(statements) == 1
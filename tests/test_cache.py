@@ -0,0 +1,155 @@
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.cache import DatabaseBackend, MemoryBackend, ResponseCache
+from app.config import settings
+from app.enums import ExpenseCategory, TimePeriod
+from app.models import ExpenseFilter
+from app.server import check_config
+from app.utils import uuid7
+from tests.utils import count_statements, random_expense
+
+
+@pytest.fixture
+def cache_enabled() -> Generator[None, None, None]:
+    with patch.object(settings, "RESPONSE_CACHE_ENABLED", True):
+        yield
+
+
+def test_memory_backend_evicts_least_recently_used() -> None:
+    backend = MemoryBackend(max_bytes=10)
+    backend.set("a", b"1234")
+    backend.set("b", b"1234")
+    backend.get("a")
+    backend.set("c", b"1234")
+
+    assert backend.get("a") == b"1234"
+    assert backend.get("b") is None
+    assert backend.get("c") == b"1234"
+    assert backend.evictions == 1
+    assert backend.size() == (2, 8)
+
+
+def test_memory_backend_skips_oversized_values() -> None:
+    backend = MemoryBackend(max_bytes=4)
+    backend.set("a", b"12345")
+    assert backend.get("a") is None
+    assert backend.size() == (0, 0)
+
+
+def test_key_normalizes_filters(cache_enabled: None) -> None:
+    cache = ResponseCache(MemoryBackend(max_bytes=1024))
+    owner_id = uuid7()
+    categories = [ExpenseCategory.GROCERIES, ExpenseCategory.OTHER]
+
+    key = cache.key(owner_id, ExpenseFilter(categories=categories))
+    assert key == cache.key(
+        owner_id, ExpenseFilter(categories=[*reversed(categories), categories[0]])
+    )
+    assert key != cache.key(uuid7(), ExpenseFilter(categories=categories))
+    assert (
+        cache.key(owner_id, ExpenseFilter(period=TimePeriod.DAY, n_periods=1)) is None
+    )
+
+
+def test_invalidate_bumps_owner_and_global_versions(cache_enabled: None) -> None:
+    cache = ResponseCache(MemoryBackend(max_bytes=1024))
+    owner_id, other_id = uuid7(), uuid7()
+    filters = ExpenseFilter()
+    keys = [cache.key(owner_id, filters), cache.key(other_id, filters)]
+    all_owners_key = cache.key(None, filters)
+
+    cache.invalidate(owner_id)
+    assert cache.key(owner_id, filters) != keys[0]
+    assert cache.key(other_id, filters) == keys[1]
+    assert cache.key(None, filters) != all_owners_key
+
+
+def test_database_backend_shares_versions(cache_enabled: None) -> None:
+    # Two workers, each with its own entries
+    worker, other_worker = (
+        ResponseCache(DatabaseBackend(max_bytes=1024)) for _ in range(2)
+    )
+    owner_id = uuid7()
+    key = worker.key(owner_id, ExpenseFilter())
+    assert key is not None
+    worker.set(key, b"page")
+    assert worker.get(key) == b"page"
+
+    other_worker.invalidate(owner_id)
+    assert worker.key(owner_id, ExpenseFilter()) != key
+    assert other_worker.key(owner_id, ExpenseFilter()) == worker.key(
+        owner_id, ExpenseFilter()
+    )
+
+
+def test_memory_backend_refused_with_several_workers(cache_enabled: None) -> None:
+    check_config(1)
+    with pytest.raises(SystemExit):
+        check_config(2)
+    with patch.object(settings, "RESPONSE_CACHE_BACKEND", "app.cache.DatabaseBackend"):
+        check_config(2)
+
+
+def test_stats_count_concurrent_lookups() -> None:
+    cache = ResponseCache(MemoryBackend(max_bytes=1024))
+    cache.set("hit", b"1")
+    n_lookups = 10_000
+
+    def lookup(i: int) -> bytes | None:
+        return cache.get("hit" if i % 2 else "miss")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lookup, range(n_lookups)))
+    assert (cache.hits, cache.misses) == (n_lookups // 2, n_lookups // 2)
+
+
+def test_key_disabled() -> None:
+    cache = ResponseCache(MemoryBackend(max_bytes=1024))
+    with patch.object(settings, "RESPONSE_CACHE_ENABLED", False):
+        assert cache.key(uuid7(), ExpenseFilter()) is None
+
+
+def test_read_expenses_cached(
+    client: TestClient,
+    db: Session,
+    normal_user: dict[str, Any],
+    superuser: dict[str, Any],
+    cache_enabled: None,
+) -> None:
+    url = f"{settings.API_V1_STR}/expenses/"
+    user = normal_user["user"]
+    random_expense(session=db, owner_id=user.id)
+
+    first = client.get(url, headers=normal_user["headers"])
+    with count_statements(db) as statements:
+        second = client.get(url, headers=normal_user["headers"])
+    assert second.json() == first.json()
+    # Only the current user is loaded, the page comes from the cache
+    assert len([s for s in statements if s.startswith("SELECT")]) == 1
+
+    stats = client.get(
+        f"{settings.API_V1_STR}/utils/cache-stats", headers=superuser["headers"]
+    ).json()
+    assert stats["hits"] >= 1
+    assert 0 < stats["hit_ratio"] <= 1
+
+    expense = random_expense(session=db, owner_id=user.id)
+    third = client.get(url, headers=normal_user["headers"])
+    assert third.json()["count"] == first.json()["count"] + 1
+    assert str(expense.id) in {e["id"] for e in third.json()["data"]}
+
+
+def test_read_cache_stats_normal_user(
+    client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/cache-stats", headers=normal_user["headers"]
+    )
+    assert r.status_code == 403
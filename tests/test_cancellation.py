@@ -0,0 +1,113 @@
+import asyncio
+import time
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+from fastapi import APIRouter, Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, text
+
+from app.api.deps import SessionDep, apply_statement_timeout
+from app.api.disconnect import CancelOnDisconnectMiddleware, query_canceled_handler
+from app.cancellation import STATEMENT_TIMEOUT_KEY, query_stats
+from app.config import settings
+from app.db import get_engine
+from tests.utils import busy, using_sqlite
+
+
+@pytest.fixture
+def slow_app() -> FastAPI:
+    router = APIRouter(dependencies=[Depends(apply_statement_timeout)])
+
+    @router.get("/sleep")
+    def sleep(session: SessionDep, seconds: float) -> None:
+        busy(session, seconds)
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(CancelOnDisconnectMiddleware)
+    app.add_exception_handler(OperationalError, query_canceled_handler)
+    return app
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    ["/expenses/?limit=1001", "/expenses/changes?limit=1001", "/users/?limit=1001"],
+)
+def test_page_size_capped(
+    client: TestClient, superuser: dict[str, Any], endpoint: str
+) -> None:
+    r = client.get(f"{settings.API_V1_STR}{endpoint}", headers=superuser["headers"])
+    assert r.status_code == 422
+
+
+def test_session_statement_timeout() -> None:
+    with Session(get_engine()) as session:
+        session.info[STATEMENT_TIMEOUT_KEY] = 50
+        with pytest.raises(OperationalError):
+            busy(session, 1)
+        session.rollback()
+        session.info.pop(STATEMENT_TIMEOUT_KEY)
+        if using_sqlite():
+            # The timeout is dropped when the connection goes back to the pool
+            busy(session, 0.1)
+        else:
+            # SET LOCAL ends with the transaction, the connection keeps its default
+            timeout = session.exec(text("SHOW statement_timeout")).one()  # type: ignore
+            assert timeout[0] != "50ms"
+
+
+def test_route_statement_timeout(slow_app: FastAPI) -> None:
+    timeouts = {**settings.ROUTE_STATEMENT_TIMEOUTS_MS, "sleep": 100}
+    before = query_stats.stats()
+    with (
+        patch.object(settings, "ROUTE_STATEMENT_TIMEOUTS_MS", timeouts),
+        TestClient(slow_app) as client,
+    ):
+        assert client.get("/sleep", params={"seconds": 0}).status_code == 200
+        r = client.get("/sleep", params={"seconds": 1})
+    assert r.status_code == 503
+    assert r.json() == {"detail": "The request took too long"}
+    assert query_stats.stats().timed_out == before.timed_out + 1
+
+
+def test_disconnect_cancels_query(slow_app: FastAPI) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/sleep",
+        "raw_path": b"/sleep",
+        "query_string": b"seconds=10",
+        "root_path": "",
+        "headers": [],
+        "client": ("testclient", 1),
+        "server": ("testserver", 80),
+    }
+    sent: list[dict[str, Any]] = []
+    messages = iter(
+        [
+            {"type": "http.request", "body": b"", "more_body": False},
+            {"type": "http.disconnect"},
+        ]
+    )
+
+    async def receive() -> dict[str, Any]:
+        message = next(messages)
+        if message["type"] == "http.disconnect":
+            await asyncio.sleep(0.3)
+        return message
+
+    async def send(message: dict[str, Any]) -> None:
+        sent.append(message)
+
+    before = query_stats.stats()
+    start = time.perf_counter()
+    asyncio.run(slow_app(scope, receive, send))  # type: ignore[arg-type]
+    assert time.perf_counter() - start < 5
+    assert sent[0]["status"] == 499
+    assert query_stats.stats().cancelled == before.cancelled + 1
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import time
+from typing import Any
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, field_serializer
+from sqlmodel import Session, text
+
+from app.api.deps import AppRoute, SessionDep
+from app.config import settings
+from app.db import get_engine, pool_usage, warm_up_pool
+
+
+def test_warm_up_pool() -> None:
+    engine = get_engine()
+    warm_up_pool(2)
+    assert engine.pool.checkedin() >= 2  # type: ignore[attr-defined]
+
+
+def test_forked_child_does_not_reuse_connections() -> None:
+    engine = get_engine()
+    warm_up_pool(settings.DB_POOL_WARMUP)
+    pid = os.fork()
+    if pid == 0:
+        # The child starts with an empty pool and can still connect
+        reused = engine.pool.checkedin()  # type: ignore[attr-defined]
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT 1")
+        os._exit(0 if reused == 0 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    with engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+
+
+def test_import_does_not_create_engine() -> None:
+    code = (
+        "import sys, app.main, app.db; "
+        "assert not app.db._engines; assert 'psycopg' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_pool_usage() -> None:
+    before = pool_usage.stats()
+    with Session(get_engine()) as session:
+        session.exec(text("SELECT 1"))  # type: ignore
+        time.sleep(0.05)
+    stats = pool_usage.stats()
+    assert stats.checkouts == before.checkouts + 1
+    assert stats.max_held_ms >= 50
+    assert stats.size == settings.DB_POOL_SIZE
+
+
+def test_route_releases_connection_before_serialization() -> None:
+    checked_out: dict[str, int] = {}
+
+    class Page(BaseModel):
+        value: int
+
+        @field_serializer("value")
+        def record(self, value: int) -> int:
+            checked_out["serializing"] = get_engine().pool.checkedout()  # type: ignore[attr-defined]
+            return value
+
+    router = APIRouter(route_class=AppRoute)
+
+    @router.get("/page", response_model=Page)
+    def read_page(session: SessionDep) -> Any:
+        value = session.exec(text("SELECT 1")).one()[0]  # type: ignore
+        checked_out["querying"] = get_engine().pool.checkedout()  # type: ignore[attr-defined]
+        return Page(value=value)
+
+    app = FastAPI()
+    app.include_router(router)
+    with TestClient(app) as client:
+        assert client.get("/page").json() == {"value": 1}
+    assert checked_out["serializing"] == checked_out["querying"] - 1
+
+
+def test_read_pool_stats(client: TestClient, superuser: dict[str, Any]) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/pool-stats", headers=superuser["headers"]
+    )
+    assert r.status_code == 200
+    assert r.json()["checkouts"] > 0
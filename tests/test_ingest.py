@@ -0,0 +1,137 @@
+import re
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app.api.routes import expenses as expenses_routes
+from app.config import settings
+from app.ingest import ExpenseBatcher
+from app.models import Expense, ExpenseCreate
+from app.utils import uuid7
+from tests.utils import (
+    count_statements,
+    random_expense_category,
+    random_positive_number,
+    random_string,
+    random_user,
+)
+
+
+@pytest.fixture
+def batcher() -> Generator[ExpenseBatcher, None, None]:
+    batcher = ExpenseBatcher(max_size=50, max_delay=0.05)
+    yield batcher
+    batcher.stop()
+
+
+def expense_inserts(statements: list[str]) -> list[str]:
+    # Tables are qualified with the worker's schema under pytest-xdist
+    return [s for s in statements if re.match(r"INSERT INTO (\w+\.)?expense ", s)]
+
+
+def random_expense_create() -> ExpenseCreate:
+    return ExpenseCreate(
+        title=random_string(),
+        amount=random_positive_number(),
+        category=random_expense_category(),
+    )
+
+
+def test_batcher_coalesces_inserts(db: Session, batcher: ExpenseBatcher) -> None:
+    owner, *_ = random_user(session=db)
+    expenses_in = [random_expense_create() for _ in range(40)]
+
+    with count_statements(db) as statements:
+        with ThreadPoolExecutor(max_workers=len(expenses_in)) as executor:
+            expenses = list(
+                executor.map(
+                    lambda e: batcher.submit(e, owner_id=owner.id), expenses_in
+                )
+            )
+
+    inserts = expense_inserts(statements)
+    assert 0 < len(inserts) < len(expenses_in)
+    for expense_in, expense in zip(expenses_in, expenses, strict=True):
+        assert expense.title == expense_in.title
+        assert expense.owner_id == owner.id
+        assert db.get(Expense, expense.id) is not None
+
+
+def test_batcher_isolates_failing_rows(db: Session, batcher: ExpenseBatcher) -> None:
+    owner, *_ = random_user(session=db)
+    owner_ids = [owner.id, uuid7(), owner.id]
+
+    with ThreadPoolExecutor(max_workers=len(owner_ids)) as executor:
+        futures = [
+            executor.submit(batcher.submit, random_expense_create(), owner_id)
+            for owner_id in owner_ids
+        ]
+    assert futures[0].result().owner_id == owner.id
+    assert futures[2].result().owner_id == owner.id
+    with pytest.raises(IntegrityError):
+        futures[1].result()
+
+
+def test_batcher_relaxed_durability(db: Session) -> None:
+    owner, *_ = random_user(session=db)
+    batcher = ExpenseBatcher(max_size=10, max_delay=0, synchronous_commit=False)
+    try:
+        expense = batcher.submit(random_expense_create(), owner_id=owner.id)
+    finally:
+        batcher.stop()
+    assert db.get(Expense, expense.id) is not None
+
+
+def test_create_expense_batched(
+    client: TestClient, normal_user: dict[str, Any], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "EXPENSE_BATCHING_ENABLED", True)
+    expense_in = random_expense_create()
+    r = client.post(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+        json=expense_in.model_dump(mode="json"),
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert data["title"] == expense_in.title
+    assert data["owner_id"] == str(normal_user["user"].id)
+
+
+def test_batch_outgrows_threadpool(
+    client: TestClient,
+    db: Session,
+    normal_user: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # More concurrent requests than the 40 threads of AnyIO's threadpool
+    n_requests = 60
+    batcher = ExpenseBatcher(max_size=n_requests, max_delay=10)
+    monkeypatch.setattr(settings, "EXPENSE_BATCHING_ENABLED", True)
+    monkeypatch.setattr(expenses_routes, "expense_batcher", batcher)
+
+    def create(expense_in: ExpenseCreate) -> int:
+        r = client.post(
+            f"{settings.API_V1_STR}/expenses/",
+            headers=normal_user["headers"],
+            json=expense_in.model_dump(mode="json"),
+        )
+        return r.status_code
+
+    expenses_in = [random_expense_create() for _ in range(n_requests)]
+    try:
+        with count_statements(db) as statements:
+            with ThreadPoolExecutor(max_workers=n_requests) as executor:
+                status_codes = list(executor.map(create, expenses_in))
+    finally:
+        batcher.stop()
+
+    assert status_codes == [200] * n_requests
+    # Flushed as soon as it was full, long before the delay ran out
+    inserts = expense_inserts(statements)
+    assert len(inserts) == 1
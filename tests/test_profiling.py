@@ -0,0 +1,136 @@
+import io
+import json
+import pstats
+import tempfile
+import time
+import zipfile
+from collections.abc import Generator
+from typing import Any
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.deps import AppRoute
+from app.api.profiling import ProfileMiddleware, profile_requested
+from app.config import settings
+from app.main import app as main_app
+
+
+@pytest.fixture
+def profiled_client() -> Generator[TestClient, None, None]:
+    """The app as installed with ``PROFILING_ENABLED``, off by default."""
+    with TestClient(ProfileMiddleware(main_app)) as c:
+        yield c
+
+
+def busy() -> list[bytes]:
+    held = []
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        held.append(b"x" * 1024)
+    return held
+
+
+def read_artifact(content: bytes) -> dict[str, bytes]:
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def load_pstats(content: bytes) -> pstats.Stats:
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+        return pstats.Stats(f.name)
+
+
+def test_profile_endpoint(superuser: dict[str, Any]) -> None:
+    router = APIRouter(route_class=AppRoute)
+
+    @router.get("/busy")
+    def read_busy() -> int:
+        return len(busy())
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(ProfileMiddleware)
+    with TestClient(app) as client:
+        assert client.get("/busy").json() > 0
+        r = client.get("/busy", headers={**superuser["headers"], "X-Profile": "1"})
+
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/zip"
+    assert 'filename="profile-read_busy.zip"' in r.headers["content-disposition"]
+    assert r.headers["x-profiled-status"] == "200"
+    files = read_artifact(r.content)
+
+    stats = load_pstats(files["profile.pstats"])
+    [busy_stats] = [s for (_, _, name), s in stats.stats.items() if name == "busy"]  # type: ignore[attr-defined]
+    # Sampled for most of the 100 ms it runs
+    assert busy_stats[3] > 0.05
+
+    speedscope = json.loads(files["profile.speedscope.json"])
+    names = [frame["name"] for frame in speedscope["shared"]["frames"]]
+    assert names[:2] == ["read_busy", "busy"]
+    [profile] = speedscope["profiles"]
+    assert len(profile["samples"]) == len(profile["weights"]) > 0
+
+    summary = files["summary.txt"].decode()
+    assert summary.startswith("read_busy: ")
+    assert "test_profiling.py" in summary
+
+
+def test_profile_requested() -> None:
+    def scope(headers: list[tuple[bytes, bytes]], query: bytes) -> dict[str, Any]:
+        return {"headers": headers, "query_string": query}
+
+    assert profile_requested(scope([(b"x-profile", b"1")], b""))
+    assert profile_requested(scope([], b"limit=5&profile"))
+    assert not profile_requested(scope([(b"accept", b"*/*")], b"limit=5"))
+    assert not profile_requested(scope([], b"q=profiled"))
+
+
+def test_profile_route(profiled_client: TestClient, superuser: dict[str, Any]) -> None:
+    r = profiled_client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        params={"profile": ""},
+        headers=superuser["headers"],
+    )
+    assert r.status_code == 200
+    assert set(read_artifact(r.content)) == {
+        "profile.pstats",
+        "profile.speedscope.json",
+        "summary.txt",
+    }
+
+
+def test_profile_rejected_before_endpoint(
+    profiled_client: TestClient, superuser: dict[str, Any]
+) -> None:
+    r = profiled_client.get(
+        f"{settings.API_V1_STR}/expenses/?limit=0&profile=1",
+        headers=superuser["headers"],
+    )
+    assert r.status_code == 422
+    assert "x-profiled-status" not in r.headers
+
+
+def test_profile_requires_superuser(
+    profiled_client: TestClient, normal_user: dict[str, Any]
+) -> None:
+    url = f"{settings.API_V1_STR}/users/me"
+    headers = {**normal_user["headers"], "X-Profile": "1"}
+    assert profiled_client.get(url, headers=headers).status_code == 403
+    r = profiled_client.get(url, headers=normal_user["headers"])
+    assert r.status_code == 200
+
+
+def test_profiling_disabled_by_default(
+    client: TestClient, superuser: dict[str, Any]
+) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/users/me",
+        headers={**superuser["headers"], "X-Profile": "1"},
+    )
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/json"
@@ -0,0 +1,98 @@
+from typing import Any
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.api.ratelimit import (
+    DatabaseBackend,
+    MemoryBackend,
+    RateLimiter,
+    rate_limiter,
+)
+from app.config import settings
+
+
+def test_memory_backend_refills() -> None:
+    backend = MemoryBackend()
+    with patch("app.api.ratelimit.time.monotonic", return_value=100.0):
+        assert not backend.take("a", 2, 1, 2)
+        assert backend.take("a", 1, 1, 2) == 1
+    with patch("app.api.ratelimit.time.monotonic", return_value=101.0):
+        assert not backend.take("a", 1, 1, 2)
+
+
+def test_memory_backend_evicts_least_recently_used() -> None:
+    backend = MemoryBackend(max_keys=2)
+    backend.take("a", 1, 1, 1)
+    backend.take("b", 1, 1, 1)
+    backend.take("a", 1, 1, 1)
+    backend.take("c", 1, 1, 1)
+    assert backend.size() == 2
+    assert backend.evictions == 1
+    # "a" is still empty, "b" was evicted and starts over with a full bucket
+    assert backend.take("a", 1, 0.1, 1)
+    assert not backend.take("b", 1, 1, 1)
+
+
+def test_global_limit() -> None:
+    limiter = RateLimiter(MemoryBackend())
+    with (
+        patch.object(settings, "RATE_LIMIT_GLOBAL_PER_SECOND", 0.001),
+        patch.object(settings, "RATE_LIMIT_GLOBAL_BURST", 2),
+    ):
+        assert not limiter.check("ip:a", 1)
+        assert not limiter.check("ip:b", 1)
+        assert limiter.check("ip:c", 1)
+    stats = limiter.stats()
+    assert (stats.allowed, stats.limited, stats.keys) == (2, 1, 4)
+
+
+def test_shared_backend() -> None:
+    limiter = RateLimiter(DatabaseBackend())
+    with (
+        patch.object(settings, "RATE_LIMIT_PER_SECOND", 0.001),
+        patch.object(settings, "RATE_LIMIT_BURST", 1),
+    ):
+        assert not limiter.check("ip:shared", 1)
+        assert limiter.check("ip:shared", 1)
+        # A second worker sees the same bucket
+        assert RateLimiter(DatabaseBackend()).check("ip:shared", 1)
+
+
+def test_login_rate_limited(client: TestClient) -> None:
+    data = {"username": "nobody@example.com", "password": "wrong-password"}
+    with (
+        patch.object(rate_limiter, "backend", MemoryBackend()),
+        patch.object(settings, "RATE_LIMIT_ENABLED", True),
+        patch.object(settings, "RATE_LIMIT_PER_SECOND", 1),
+        patch.object(settings, "RATE_LIMIT_BURST", 20),
+    ):
+        for _ in range(2):
+            r = client.post(f"{settings.API_V1_STR}/signin/access-token", data=data)
+            assert r.status_code == 400
+        r = client.post(f"{settings.API_V1_STR}/signin/access-token", data=data)
+        assert r.status_code == 429
+        assert r.headers["Retry-After"] == "10"
+
+
+def test_rate_limited_per_user(
+    client: TestClient, normal_user: dict[str, Any], superuser: dict[str, Any]
+) -> None:
+    url = f"{settings.API_V1_STR}/users/me"
+    with (
+        patch.object(rate_limiter, "backend", MemoryBackend()),
+        patch.object(settings, "RATE_LIMIT_ENABLED", True),
+        patch.object(settings, "RATE_LIMIT_PER_SECOND", 0.001),
+        patch.object(settings, "RATE_LIMIT_BURST", 1),
+    ):
+        assert client.get(url, headers=normal_user["headers"]).status_code == 200
+        assert client.get(url, headers=normal_user["headers"]).status_code == 429
+        assert client.get(url, headers=superuser["headers"]).status_code == 200
+
+
+def test_read_rate_limit_stats(client: TestClient, superuser: dict[str, Any]) -> None:
+    r = client.get(
+        f"{settings.API_V1_STR}/utils/rate-limit-stats", headers=superuser["headers"]
+    )
+    assert r.status_code == 200
+    assert set(r.json()) == {"allowed", "limited", "keys"}
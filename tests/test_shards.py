@@ -0,0 +1,334 @@
+import os
+import uuid
+from collections.abc import Generator
+from datetime import timedelta
+from pathlib import Path
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, make_url
+from sqlmodel import Session, func, select, text
+
+from app import db, shards
+from app.config import settings
+from app.cruds import account_crud
+from app.db import get_engine, get_engines, init_db
+from app.enums import LookupStatus
+from app.ingest import ExpenseBatcher
+from app.models import Expense, ExpenseCreate, User, UserCreate
+from tests.utils import (
+    get_authentication_headers,
+    random_email,
+    random_expense_category,
+    random_positive_number,
+    random_string,
+    using_sqlite,
+)
+
+
+def email_on_shard(shard: int) -> str:
+    while True:
+        email = random_email()
+        if shards.for_email(email) == shard:
+            return email
+
+
+def _execute_outside_transaction(*statements: str) -> None:
+    with get_engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        # Databases take a while to create or drop while other workers run
+        connection.execute(text("SET statement_timeout = 0"))
+        try:
+            for statement in statements:
+                connection.execute(text(statement))
+        finally:
+            connection.execute(text("RESET statement_timeout"))
+
+
+def _create_shard_database(tmp_path: Path) -> tuple[str, str | None]:
+    if using_sqlite():
+        return f"sqlite:///{tmp_path / 'shard.db'}", None
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    name = f"{url.database}_shard_{worker}"
+    _execute_outside_transaction(
+        f"DROP DATABASE IF EXISTS {name} WITH (FORCE)", f"CREATE DATABASE {name}"
+    )
+    return url.set(database=name).render_as_string(hide_password=False), name
+
+
+@pytest.fixture
+def sharded(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Generator[list[Engine], None, None]:
+    """Run the app on the main database and a second, empty one."""
+    shard_url, database = _create_shard_database(tmp_path)
+    engines: list[Engine] = []
+    with monkeypatch.context() as patch:
+        patch.setattr(settings, "DATABASE_SHARD_URLS", [shard_url])
+        patch.setattr(db, "_engines", engines)
+        init_db()
+        yield engines
+        for engine in engines:
+            engine.dispose()
+    if database:
+        _execute_outside_transaction(f"DROP DATABASE {database} WITH (FORCE)")
+
+
+def signup(client: TestClient, email: str) -> dict[str, Any]:
+    password = random_string()
+    r = client.post(
+        f"{settings.API_V1_STR}/signup", json={"email": email, "password": password}
+    )
+    assert r.status_code == 200
+    headers = get_authentication_headers(client=client, email=email, password=password)
+    return {"id": r.json()["id"], "password": password, "headers": headers}
+
+
+def test_new_user_id_lands_on_email_shard(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "DATABASE_SHARD_URLS", ["a", "b", "c"])
+    for _ in range(20):
+        email = random_email()
+        user_id = shards.new_user_id(email)
+        assert shards.for_user(user_id) == shards.for_email(email)
+
+
+def test_merge_pages() -> None:
+    pages = [([1, 4, 6, 9], 10), ([2, 3, 8], 3), ([], 0)]
+    assert shards.merge_pages(pages, key=lambda n: n, skip=2, limit=3) == (
+        [3, 4, 6],
+        13,
+    )
+    pages = [([9, 6, 4, 1], 10), ([8, 3, 2], 3)]
+    assert shards.merge_pages(
+        pages, key=lambda n: n, skip=0, limit=3, reverse=True
+    ) == ([9, 8, 6], 13)
+
+
+def test_users_live_on_their_shard(client: TestClient, sharded: list[Engine]) -> None:
+    for shard in range(shards.count()):
+        email = email_on_shard(shard)
+        user = signup(client, email)
+        r = client.get(f"{settings.API_V1_STR}/users/me", headers=user["headers"])
+        assert r.status_code == 200
+        assert r.json()["email"] == email
+        for engine in get_engines():
+            with Session(engine) as session:
+                stored = session.get(User, uuid.UUID(r.json()["id"]))
+            assert (stored is not None) == (engine is sharded[shard])
+
+
+def test_changed_email_is_found_on_other_shard(
+    client: TestClient, sharded: list[Engine]
+) -> None:
+    user = signup(client, email_on_shard(0))
+    new_email = email_on_shard(1)
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me",
+        headers=user["headers"],
+        json={"email": new_email},
+    )
+    assert r.status_code == 200
+
+    # Shard 1 has no row with the email, the signup must still be refused
+    r = client.post(
+        f"{settings.API_V1_STR}/signup",
+        json={"email": new_email, "password": random_string()},
+    )
+    assert r.status_code == 400
+    r = client.post(
+        f"{settings.API_V1_STR}/signin/access-token",
+        data={"username": new_email, "password": user["password"]},
+    )
+    assert r.status_code == 200
+
+    other = signup(client, email_on_shard(1))
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me",
+        headers=other["headers"],
+        json={"email": new_email},
+    )
+    assert r.status_code == 409
+
+
+def test_email_reserved_across_shards(
+    client: TestClient, sharded: list[Engine]
+) -> None:
+    user = signup(client, email_on_shard(0))
+    email = email_on_shard(1)
+    # A signup of the email has reserved it, but not written its user yet
+    assert account_crud.claim_email(email=email, user_id=shards.new_user_id(email))
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me",
+        headers=user["headers"],
+        json={"email": email},
+    )
+    assert r.status_code == 409
+
+    # And the other way round, for an email change
+    email = email_on_shard(1)
+    assert account_crud.claim_email(email=email, user_id=uuid.UUID(user["id"]))
+    r = client.post(
+        f"{settings.API_V1_STR}/signup",
+        json={"email": email, "password": random_string()},
+    )
+    assert r.status_code == 400
+
+
+def test_email_reservation_taken_over(
+    client: TestClient, sharded: list[Engine], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(account_crud, "EMAIL_CLAIM_GRACE", timedelta(0))
+    old_email = email_on_shard(1)
+    user = signup(client, old_email)
+    r = client.patch(
+        f"{settings.API_V1_STR}/users/me",
+        headers=user["headers"],
+        json={"email": email_on_shard(0)},
+    )
+    assert r.status_code == 200
+    # Whoever held the email no longer does
+    moved = signup(client, old_email)
+
+    r = client.delete(f"{settings.API_V1_STR}/users/me", headers=moved["headers"])
+    assert r.status_code == 200
+    signup(client, old_email)
+
+
+def test_expense_on_other_shard_is_forbidden(
+    client: TestClient, sharded: list[Engine]
+) -> None:
+    owner = signup(client, email_on_shard(0))
+    other = signup(client, email_on_shard(1))
+    r = client.post(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=owner["headers"],
+        json={
+            "title": random_string(),
+            "amount": random_positive_number(),
+            "category": random_expense_category(),
+        },
+    )
+    expense_id = r.json()["id"]
+    url = f"{settings.API_V1_STR}/expenses/{expense_id}"
+
+    # Another user's shard doesn't hold the expense, but it exists
+    assert client.get(url, headers=other["headers"]).status_code == 403
+    r = client.get(url, headers=other["headers"], params={"fields": "id"})
+    assert r.status_code == 403
+    r = client.put(url, headers=other["headers"], json={"title": random_string()})
+    assert r.status_code == 403
+    assert client.delete(url, headers=other["headers"]).status_code == 403
+    missing = str(uuid.uuid4())
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/{missing}", headers=other["headers"]
+    )
+    assert r.status_code == 404
+
+    r = client.post(
+        f"{settings.API_V1_STR}/expenses/batch-get",
+        headers=other["headers"],
+        json={"ids": [expense_id, missing]},
+    )
+    statuses = [lookup["status"] for lookup in r.json()["data"]]
+    assert statuses == [LookupStatus.FORBIDDEN, LookupStatus.MISSING]
+    assert client.get(url, headers=owner["headers"]).status_code == 200
+
+
+def test_superuser_reads_every_shard(client: TestClient, sharded: list[Engine]) -> None:
+    email, password = email_on_shard(1), random_string()
+    account_crud.create(
+        user_create=UserCreate(email=email, password=password, is_superuser=True)
+    )
+    headers = get_authentication_headers(client=client, email=email, password=password)
+
+    tag = random_string()
+    expense_ids = set()
+    for shard in range(shards.count()):
+        user = signup(client, email_on_shard(shard))
+        for _ in range(3):
+            r = client.post(
+                f"{settings.API_V1_STR}/expenses/",
+                headers=user["headers"],
+                json={
+                    "title": tag,
+                    "amount": random_positive_number(),
+                    "category": random_expense_category(),
+                },
+            )
+            assert r.status_code == 200
+            expense_ids.add(r.json()["id"])
+
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=headers,
+        params={"q": tag, "order_by": "amount", "sort_order": "desc", "skip": 1},
+    )
+    assert r.status_code == 200
+    page = r.json()
+    assert page["count"] == len(expense_ids)
+    amounts = [expense["amount"] for expense in page["data"]]
+    assert len(amounts) == len(expense_ids) - 1
+    assert amounts == sorted(amounts, reverse=True)
+
+    r = client.get(
+        f"{settings.API_V1_STR}/expenses/",
+        headers=headers,
+        params={"q": tag, "fields": "id"},
+    )
+    assert {expense["id"] for expense in r.json()["data"]} == expense_ids
+
+    changed: list[str] = []
+    params: dict[str, Any] = {"limit": 2}
+    while True:
+        r = client.get(
+            f"{settings.API_V1_STR}/expenses/changes", headers=headers, params=params
+        )
+        assert r.status_code == 200
+        changed.extend(expense["id"] for expense in r.json()["data"])
+        if not r.json()["has_more"]:
+            break
+        params["since"] = r.json()["next_token"]
+    assert expense_ids <= set(changed)
+
+    users_count = 0
+    for engine in get_engines():
+        with Session(engine) as session:
+            users_count += session.exec(select(func.count()).select_from(User)).one()
+    r = client.get(
+        f"{settings.API_V1_STR}/users/", headers=headers, params={"limit": 100}
+    )
+    assert r.json()["count"] == users_count
+    ids = [user["id"] for user in r.json()["data"]]
+    assert ids == sorted(ids)
+
+
+def test_batcher_writes_to_owner_shard(sharded: list[Engine]) -> None:
+    owners = [
+        account_crud.create(
+            user_create=UserCreate(
+                email=email_on_shard(shard), password=random_string()
+            )
+        )
+        for shard in range(shards.count())
+    ]
+    batcher = ExpenseBatcher(max_size=50, max_delay=0.05)
+    try:
+        expenses = [
+            batcher.submit(
+                ExpenseCreate(
+                    title=random_string(),
+                    amount=random_positive_number(),
+                    category=random_expense_category(),
+                ),
+                owner_id=owner.id,
+            )
+            for owner in owners
+            if owner is not None
+        ]
+    finally:
+        batcher.stop()
+    for shard, expense in enumerate(expenses):
+        with Session(sharded[shard]) as session:
+            assert session.get(Expense, expense.id) is not None
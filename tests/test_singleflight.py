@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session
+
+from app.cancellation import QueryCanceller, current_canceller
+from app.config import settings
+from app.cruds import expense_crud
+from app.db import get_engine
+from app.singleflight import SingleFlight, expense_flights
+from tests.utils import busy, random_expense
+
+
+def test_concurrent_calls_share_execution() -> None:
+    flights = SingleFlight()
+    release = threading.Event()
+    n_calls = 8
+
+    def slow() -> object:
+        release.wait(timeout=5)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=n_calls) as executor:
+        futures = [executor.submit(flights.do, "key", slow) for _ in range(n_calls)]
+        while flights.stats().shared < n_calls - 1:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len({id(result) for result in results}) == 1
+    stats = flights.stats()
+    assert stats.executions == 1
+    assert stats.shared == n_calls - 1
+    assert stats.in_flight == 0
+
+
+def test_sequential_calls_run_again() -> None:
+    flights = SingleFlight()
+    assert flights.do("key", lambda: 1) == 1
+    assert flights.do("key", lambda: 2) == 2
+    assert flights.stats().executions == 2
+
+
+def test_exception_is_shared_and_released() -> None:
+    flights = SingleFlight()
+
+    def fail() -> None:
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do("key", fail)
+    assert flights.stats().in_flight == 0
+    assert flights.do("key", lambda: 1) == 1
+
+
+def test_leader_disconnect_is_not_shared() -> None:
+    flights = SingleFlight()
+    canceller = QueryCanceller()
+    checked_out = threading.Event()
+    n_followers = 4
+
+    def query() -> str:
+        with Session(get_engine()) as session:
+            # Attached to the canceller on checkout
+            session.connection()
+            checked_out.set()
+            busy(session, 10)
+        return "leader"
+
+    def lead() -> str:
+        current_canceller.set(canceller)
+        return flights.do("key", query)
+
+    with ThreadPoolExecutor(max_workers=n_followers + 1) as executor:
+        leader = executor.submit(lead)
+        assert checked_out.wait(timeout=5)
+        followers = [
+            executor.submit(flights.do, "key", lambda: "fresh")
+            for _ in range(n_followers)
+        ]
+        while flights.stats().shared < n_followers:
+            time.sleep(0.01)
+        # The leader's client disconnects, the followers' are still there.
+        # A cancel only reaches a running statement, so repeat it until the
+        # query has started.
+        while not leader.done():
+            canceller.cancel()
+            time.sleep(0.05)
+        with pytest.raises(OperationalError):
+            leader.result()
+        assert [follower.result() for follower in followers] == ["fresh"] * n_followers
+
+
+def test_read_expenses_coalesced(
+    client: TestClient,
+    db: Session,
+    normal_user: dict[str, Any],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    random_expense(session=db, owner_id=normal_user["user"].id)
+    before = expense_flights.stats()
+    n_requests = 8
+    release = threading.Event()
+    get_multi = expense_crud.get_multi
+
+    def held_get_multi(**kwargs: Any) -> Any:
+        # Keep the leader's query in flight until every follower joined it
+        release.wait(timeout=5)
+        return get_multi(**kwargs)
+
+    monkeypatch.setattr(expense_crud, "get_multi", held_get_multi)
+
+    def read(_: int) -> dict[str, Any]:
+        r = client.get(
+            f"{settings.API_V1_STR}/expenses/", headers=normal_user["headers"]
+        )
+        assert r.status_code == 200
+        return r.json()
+
+    with ThreadPoolExecutor(max_workers=n_requests) as executor:
+        futures = [executor.submit(read, i) for i in range(n_requests)]
+        deadline = time.monotonic() + 5
+        while expense_flights.stats().shared - before.shared < n_requests - 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        release.set()
+        pages = [future.result() for future in futures]
+
+    assert all(page == pages[0] for page in pages)
+    after = expense_flights.stats()
+    assert after.executions - before.executions == 1
+    assert after.shared - before.shared == n_requests - 1
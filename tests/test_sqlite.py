@@ -0,0 +1,115 @@
+import uuid
+from collections.abc import Generator
+from pathlib import Path
+
+import pytest
+from sqlmodel import Session, SQLModel, text
+
+from app.cruds import expense_crud, ratelimit_crud, user_crud
+from app.db import SQLITE_PRAGMAS, _create_engine
+from app.models import (
+    ExpenseCreate,
+    ExpenseFilter,
+    ExpenseTombstone,
+    ExpenseUpdate,
+    UserCreate,
+)
+from tests.utils import random_email, random_expense_category, random_string
+
+
+@pytest.fixture
+def session(tmp_path: Path) -> Generator[Session, None, None]:
+    engine = _create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def test_pragmas(session: Session) -> None:
+    assert session.exec(text("PRAGMA journal_mode")).one()[0] == "wal"  # type: ignore
+    assert session.exec(text("PRAGMA foreign_keys")).one()[0] == 1  # type: ignore
+    busy_timeout = session.exec(text("PRAGMA busy_timeout")).one()[0]  # type: ignore
+    assert busy_timeout == SQLITE_PRAGMAS["busy_timeout"]
+
+
+def test_users(session: Session) -> None:
+    user_create = UserCreate(email=random_email(), password=random_string())
+    user = user_crud.create(session=session, user_create=user_create)
+    assert user is not None
+    assert user_crud.create(session=session, user_create=user_create) is None
+    other = user_crud.create(
+        session=session,
+        user_create=UserCreate(email=random_email(), password=random_string()),
+    )
+    assert other is not None
+    assert (
+        user_crud.update(session=session, db_user=other, new_data={"email": user.email})
+        is None
+    )
+
+
+def test_expenses(session: Session) -> None:
+    owner = user_crud.create(
+        session=session,
+        user_create=UserCreate(email=random_email(), password=random_string()),
+    )
+    assert owner is not None
+    in_description = expense_crud.create(
+        session=session,
+        expense_in=ExpenseCreate(
+            title="Groceries",
+            description="Coffee beans",
+            amount=12,
+            category=random_expense_category(),
+        ),
+        owner_id=owner.id,
+    )
+    in_title = expense_crud.create(
+        session=session,
+        expense_in=ExpenseCreate(
+            title="Coffee", amount=3, category=random_expense_category()
+        ),
+        owner_id=owner.id,
+    )
+
+    expenses, count = expense_crud.get_multi(
+        session=session,
+        filters=ExpenseFilter(q="coffee", order_by="relevance", sort_order="desc"),
+        owner_id=owner.id,
+    )
+    assert count == 2
+    assert [expense.id for expense in expenses] == [in_title.id, in_description.id]
+
+    found = expense_crud.get_batch(
+        session=session, expense_ids=[in_title.id], owner_id=owner.id
+    )
+    assert found[in_title.id] is not None
+
+    exists, updated = expense_crud.update(
+        session=session,
+        expense_id=in_title.id,
+        owner_id=owner.id,
+        expense_in=ExpenseUpdate(title="Tea"),
+    )
+    assert exists
+    assert updated is not None and updated.title == "Tea"
+
+    exists, deleted = expense_crud.delete(
+        session=session, expense_id=in_title.id, owner_id=uuid.uuid4()
+    )
+    assert (exists, deleted) == (True, False)
+    exists, deleted = expense_crud.delete(
+        session=session, expense_id=in_title.id, owner_id=owner.id
+    )
+    assert (exists, deleted) == (True, True)
+    assert session.get(ExpenseTombstone, in_title.id) is not None
+
+
+def test_rate_limit_buckets(session: Session) -> None:
+    waits = [
+        ratelimit_crud.take(session=session, key="ip:sqlite", cost=1, rate=1, burst=2)
+        for _ in range(3)
+    ]
+    assert waits[:2] == [0, 0]
+    assert 0 < waits[2] <= 1
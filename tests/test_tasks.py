@@ -0,0 +1,36 @@
+from sqlmodel import Session, func, select
+
+from app.cruds import user_crud
+from app.enums import PurgeStatus
+from app.models import Expense, User, UserPurge
+from app.tasks import purge_user
+from tests.utils import random_expense, random_user
+
+
+def test_purge_user(db: Session) -> None:
+    user, *_ = random_user(session=db)
+    for _ in range(5):
+        random_expense(session=db, owner_id=user.id)
+    db_user = db.get(User, user.id)
+    assert db_user is not None
+    user_crud.start_purge(session=db, db_user=db_user)
+
+    purge_user(user.id, batch_size=2, delay=0)
+
+    db.expire_all()
+    purge = db.get(UserPurge, user.id)
+    assert purge is not None
+    assert purge.status == PurgeStatus.DONE
+    assert purge.deleted_expenses == 5
+    assert purge.finished_at is not None
+    assert db.get(User, user.id) is None
+    count = db.exec(
+        select(func.count()).select_from(Expense).where(Expense.owner_id == user.id)
+    ).one()
+    assert count == 0
+
+
+def test_purge_user_not_started(db: Session) -> None:
+    user, *_ = random_user(session=db)
+    purge_user(user.id, batch_size=2, delay=0)
+    assert db.get(User, user.id) is not None
@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.tracing import (
+    FileExporter,
+    Span,
+    current_span,
+    format_trace,
+    span,
+    start_span,
+    trace_processor,
+)
+
+
+def traced_request(
+    client: TestClient, method: str, url: str, **kwargs: Any
+) -> list[Span]:
+    traces: list[list[Span]] = []
+    with (
+        patch.object(settings, "TRACING_ENABLED", True),
+        patch.object(trace_processor, "submit", traces.append),
+    ):
+        client.request(method, url, **kwargs).raise_for_status()
+    [spans] = traces
+    return spans
+
+
+def by_name(spans: list[Span]) -> dict[str, Span]:
+    return {s.name: s for s in spans}
+
+
+def test_span_outside_trace() -> None:
+    with span("orphan") as s:
+        assert s is None
+
+
+def test_trace_expense_list(client: TestClient, normal_user: dict[str, Any]) -> None:
+    spans = traced_request(
+        client,
+        "GET",
+        f"{settings.API_V1_STR}/expenses/",
+        headers=normal_user["headers"],
+    )
+    named = by_name(spans)
+    root = named[f"GET {settings.API_V1_STR}/expenses/"]
+    assert root.parent_id is None
+    assert root.attributes["status_code"] == 200
+    assert {s.trace.trace_id for s in spans} == {root.trace.trace_id}
+
+    auth = named["deps.get_current_user"]
+    assert auth.parent_id == root.span_id
+    assert named["security.decode_access_token"].parent_id == auth.span_id
+
+    endpoint = named["endpoint"]
+    assert endpoint.attributes["route"] == "read_expenses"
+    get_multi = named["expense_crud.get_multi"]
+    assert get_multi.parent_id == endpoint.span_id
+    statements = [s for s in spans if s.name == "db.statement"]
+    assert any(s.parent_id == get_multi.span_id for s in statements)
+    assert any(s.parent_id == auth.span_id for s in statements)
+    assert named["serialize"].start_ns == endpoint.end_ns
+
+    for s in spans:
+        assert root.start_ns <= s.start_ns <= s.end_ns <= root.end_ns
+
+
+def test_trace_login(client: TestClient, normal_user: dict[str, Any]) -> None:
+    spans = traced_request(
+        client,
+        "POST",
+        f"{settings.API_V1_STR}/signin/access-token",
+        data={"username": normal_user["email"], "password": normal_user["password"]},
+    )
+    named = by_name(spans)
+    authenticate = named["account_crud.authenticate"]
+    assert named["security.verify_password"].parent_id == authenticate.span_id
+    assert named["security.verify_password"].duration_ms > 0
+
+
+def test_format_trace() -> None:
+    root = start_span("root")
+    token = current_span.set(root)
+    with span("child", rows=1):
+        pass
+    current_span.reset(token)
+    root.end()
+
+    lines = format_trace(root.trace.spans).splitlines()
+    assert lines[0].startswith("root ")
+    assert lines[1].startswith("  child ")
+    assert lines[1].endswith(" ms rows=1")
+
+
+def test_file_exporter(tmp_path: Path) -> None:
+    root = start_span("root")
+    child = start_span("child", root, attempt=2)
+    child.error = True
+    child.end()
+    root.end()
+
+    path = tmp_path / "traces.jsonl"
+    FileExporter(str(path)).export(root.trace.spans)
+    [line] = path.read_text().splitlines()
+    [resource] = json.loads(line)["resourceSpans"]
+    [scope] = resource["scopeSpans"]
+    exported = {s["name"]: s for s in scope["spans"]}
+    assert exported["child"]["parentSpanId"] == root.span_id
+    assert exported["child"]["traceId"] == root.trace.trace_id
+    assert exported["child"]["attributes"] == [
+        {"key": "attempt", "value": {"intValue": "2"}}
+    ]
+    assert exported["child"]["status"] == {"code": 2}
+    assert exported["root"]["parentSpanId"] == ""
@@ -1,10 +1,15 @@
+import os
 import random
 import string
 import uuid
+from collections.abc import Generator
+from contextlib import contextmanager
 from typing import Any
 
+import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlalchemy import event, make_url
+from sqlmodel import Session, text
 
 from app.config import settings
 from app.cruds import expense_crud, user_crud
@@ -12,6 +17,32 @@ from app.enums import ExpenseCategory
 from app.models import Expense, ExpenseCreate, User, UserCreate
 
 
+def using_sqlite() -> bool:
+    return make_url(settings.SQLALCHEMY_DATABASE_URI).get_backend_name() == "sqlite"
+
+
+requires_postgres = pytest.mark.skipif(using_sqlite(), reason="needs PostgreSQL")
+# Transactions of parallel workers keep VACUUM from marking pages all-visible
+requires_idle_database = pytest.mark.skipif(
+    "PYTEST_XDIST_WORKER" in os.environ, reason="needs no concurrent transactions"
+)
+
+
+def busy(session: Session, seconds: float) -> None:
+    """Keep the database busy for about ``seconds``."""
+    if using_sqlite():
+        # No sleep function, count through a few million rows instead
+        statement = text(
+            "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c "
+            "WHERE x < :rows) SELECT count(*) FROM c"
+        )
+        params = {"rows": int(seconds * 10_000_000)}
+    else:
+        statement = text("SELECT pg_sleep(:seconds)")
+        params = {"seconds": seconds}
+    session.exec(statement, params=params)  # type: ignore
+
+
 def random_string() -> str:
     return "".join(random.choices(string.ascii_lowercase, k=32))
 
@@ -41,7 +72,12 @@ def random_user(
     return user, email, password
 
 
-def random_expense(*, session: Session, owner_id: uuid.UUID | None = None) -> Expense:
+def random_expense(
+    *,
+    session: Session,
+    owner_id: uuid.UUID | None = None,
+    extra: dict[str, Any] | None = None,
+) -> Expense:
     if owner_id is None:
         user, *_ = random_user(session=session)
         owner_id = user.id
@@ -52,6 +88,8 @@ def random_expense(*, session: Session, owner_id: uuid.UUID | None = None) -> Ex
         "amount": random_positive_number(),
         "category": random_expense_category(),
     }
+    if extra:
+        expense_data.update(extra)
     expense = ExpenseCreate(**expense_data)
     return expense_crud.create(session=session, expense_in=expense, owner_id=owner_id)
 
@@ -66,3 +104,21 @@ def get_authentication_headers(
     auth_token = r.json()["access_token"]
     headers = {"Authorization": f"Bearer {auth_token}"}
     return headers
+
+
+@contextmanager
+def count_statements(session: Session) -> Generator[list[str], None, None]:
+    """Collect the SQL statements sent to the database inside the block."""
+    statements: list[str] = []
+
+    def before_cursor_execute(*args: Any) -> None:
+        # Leave out the savepoints of tests rolled back at the end
+        if "SAVEPOINT" not in args[2]:
+            statements.append(args[2])
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)